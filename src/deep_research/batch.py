@@ -0,0 +1,188 @@
+# ▸ Batch runner: read research prompts from JSONL, run many research + report
+#   jobs concurrently under one shared Scheduler, and append each result to a
+#   JSONL file as soon as its job finishes.
+#
+# Input, one JSON object per line (only the prompt is required):
+#   {"id": "ppo", "prompt": "...", "priority": 1, "plan_depth": 8,
+#    "search_depth": 3, "max_llm_calls": 400, "max_tokens": 2000000}
+# "request_id"/"body" are accepted as aliases for "id"/"prompt".
+
+import argparse
+import json
+import time
+from concurrent.futures import as_completed
+from typing import Any, Dict, List, Optional
+
+from research import (
+    research
+)
+
+from report import (
+    write_report
+)
+
+from prompts import (
+    initial_messages
+)
+
+from page_cache import (
+    enable_page_cache
+)
+
+from llm_cache import (
+    enable_llm_cache
+)
+
+from context import (
+    set_token_budget
+)
+
+from dedup import (
+    DuplicateIndex
+)
+
+from registry import (
+    SessionRegistry
+)
+
+from checkpoint import (
+    checkpoint_path_for
+)
+
+from resilience import (
+    get_resilience
+)
+
+from routing import (
+    enable_routing
+)
+
+from tracing import (
+    enable_tracing
+)
+
+from scheduler import (
+    BudgetExceeded,
+    ContextThreadPoolExecutor,
+    Job,
+    Scheduler,
+    current_job,
+    set_scheduler
+)
+
+
+def load_jobs(path: str, plan_depth: int = 8, search_depth: int = 3, max_llm_calls: Optional[int] = None, max_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+    # Job specs from *path*, with defaults filled in for missing fields.
+    # Ids must be unique: a job's checkpoint is keyed on its id.
+    jobs = []
+    ids = set()
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            spec = json.loads(line)
+            prompt = spec.get("prompt", spec.get("body"))
+            if not prompt:
+                raise ValueError(f"{path}:{line_no}: no prompt")
+            job_id = str(spec.get("id", spec.get("request_id", line_no)))
+            if job_id in ids:
+                raise ValueError(f"{path}:{line_no}: duplicate job id {job_id}")
+            ids.add(job_id)
+            jobs.append({
+                "id": job_id,
+                "prompt": prompt,
+                "priority": int(spec.get("priority", 0)),
+                "plan_depth": int(spec.get("plan_depth", plan_depth)),
+                "search_depth": int(spec.get("search_depth", search_depth)),
+                "max_llm_calls": spec.get("max_llm_calls", max_llm_calls),
+                "max_tokens": spec.get("max_tokens", max_tokens),
+            })
+    return jobs
+
+
+def run_job(spec: Dict[str, Any], checkpoint_dir: Optional[str] = ".cache/checkpoints") -> Dict[str, Any]:
+    # Research + report for one job; failures are reported, not raised.
+    job = Job(spec["id"], spec["priority"], spec["max_llm_calls"], spec["max_tokens"])
+    current_job.set(job)
+    start = time.monotonic()
+    result: Dict[str, Any] = {"id": spec["id"], "prompt": spec["prompt"]}
+    try:
+        settings = {"prompt": spec["prompt"], "plan_depth": spec["plan_depth"], "search_depth": spec["search_depth"]}
+        # Keyed on the job id and its settings: jobs sharing a prompt never
+        # share (or resume) each other's checkpoint
+        checkpoint_path = checkpoint_path_for(spec["id"], settings, checkpoint_dir) if checkpoint_dir else None
+        research_plan, notes = research(
+            spec["prompt"], spec["plan_depth"], spec["search_depth"], initial_messages,
+            duplicates=DuplicateIndex(), registry=SessionRegistry(), checkpoint_path=checkpoint_path)
+        result.update(status="ok", report=write_report(spec["prompt"], research_plan, notes))
+    except BudgetExceeded as err:
+        result.update(status="budget_exceeded", error=str(err))
+    except Exception as err:
+        result.update(status="error", error=f"{type(err).__name__}: {err}")
+    result.update(seconds=round(time.monotonic() - start, 3), **job.usage())
+    return result
+
+
+def run_batch(input_path: str, output_path: str, max_jobs: int = 4, scheduler: Optional[Scheduler] = None, checkpoint_dir: Optional[str] = ".cache/checkpoints", **job_defaults) -> Dict[str, Any]:
+    # Run every job in *input_path*, at most *max_jobs* at a time, highest
+    # priority first. Returns a summary including jobs per hour.
+    jobs = sorted(load_jobs(input_path, **job_defaults), key=lambda spec: -spec["priority"])
+    scheduler = scheduler or Scheduler()
+    previous = set_scheduler(scheduler)
+    statuses: Dict[str, int] = {}
+    start = time.monotonic()
+    try:
+        with ContextThreadPoolExecutor(max_workers=max(1, max_jobs)) as pool, \
+                open(output_path, "a", encoding="utf-8") as out:
+            futures = [pool.submit(run_job, spec, checkpoint_dir) for spec in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+    finally:
+        set_scheduler(previous)
+    elapsed = time.monotonic() - start
+    return {
+        "jobs": len(jobs),
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "jobs_per_hour": round(len(jobs) * 3600 / elapsed, 2) if elapsed > 0 else 0.0,
+        "scheduler": scheduler.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run research + report jobs from a JSONL file.")
+    parser.add_argument("input", help="JSONL file of jobs")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--jobs", type=int, default=4, help="jobs run concurrently")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--llm-rpm", type=int, default=None, help="LLM requests per minute")
+    parser.add_argument("--tpm", type=int, default=None, help="LLM tokens (input + output) per minute")
+    parser.add_argument("--search-rpm", type=int, default=None, help="searches per minute")
+    parser.add_argument("--plan-depth", type=int, default=8)
+    parser.add_argument("--search-depth", type=int, default=3)
+    parser.add_argument("--max-llm-calls", type=int, default=None, help="default per-job LLM call budget")
+    parser.add_argument("--max-tokens", type=int, default=None, help="default per-job token budget")
+    parser.add_argument("--routes", default="routes.json", help="model routing config (see routing.py)")
+    args = parser.parse_args()
+
+    enable_page_cache(".cache/pages.sqlite")
+    enable_llm_cache(".cache/llm.sqlite", mode="readwrite")
+    set_token_budget(100_000)
+    router = enable_routing(args.routes)
+    tracer = enable_tracing(".cache/trace.jsonl")
+
+    summary = run_batch(
+        args.input, args.output, args.jobs,
+        Scheduler(max_concurrent_llm=args.llm_concurrency, llm_requests_per_minute=args.llm_rpm,
+                  tokens_per_minute=args.tpm, searches_per_minute=args.search_rpm),
+        plan_depth=args.plan_depth, search_depth=args.search_depth,
+        max_llm_calls=args.max_llm_calls, max_tokens=args.max_tokens)
+    print(f"{summary['jobs']} jobs in {summary['seconds']}s ({summary['jobs_per_hour']} jobs/hour): {summary['statuses']}")
+    print(f"Scheduler: {summary['scheduler']}")
+    print(f"Resilience: {get_resilience().stats()}")
+    print(f"Routes: {router.stats()}")
+    print(tracer.summary_table())
+    tracer.close()
@@ -0,0 +1,455 @@
+# ▸ Offline benchmark: run research + report end to end with no network and no
+#   API key. A scripted LLM backend (fixed replies, configurable latency), a
+#   canned search backend and a local HTTP server of generated HTML pages stand
+#   in for the real services, so runs are deterministic and comparable between
+#   commits.
+#
+#   python benchmark.py --plan-depth 2 4 --search-depth 1 3 --page-words 500 3000 \
+#       --repeats 3 --output .cache/bench.jsonl --compare .cache/bench-main.jsonl
+#
+# Each run appends one JSON line: the commit, the configuration, end‑to‑end
+# wall and CPU seconds, LLM calls, input/output tokens, and per‑stage totals
+# from the tracer (count, seconds, cpu_seconds, counters). --compare prints
+# the median ratio new/old for every configuration present in both files.
+#
+#   python benchmark.py --workers 1 2 4 8 --runs 8 --llm-latency 0.05
+#
+# instead runs *runs* research + report runs through the distributed job
+# queue (workers.py) once per worker count and prints the throughput of each.
+
+import argparse
+import ast
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from trafilatura.settings import DEFAULT_CONFIG
+
+import research as research_module
+
+from research import (
+    research
+)
+
+from report import (
+    write_report
+)
+
+from prompts import (
+    initial_messages
+)
+
+from llm import (
+    LLMBackend,
+    set_backend
+)
+
+from dedup import (
+    DuplicateIndex
+)
+
+from registry import (
+    SessionRegistry
+)
+
+from resilience import (
+    Resilience,
+    set_resilience
+)
+
+from tracing import (
+    Tracer,
+    set_tracer
+)
+
+from jobqueue import (
+    JobQueue
+)
+
+from workers import (
+    run_distributed,
+    run_worker
+)
+
+RESULTS_PER_QUERY = 5
+_METRICS = ("wall_seconds", "cpu_seconds", "llm_calls", "input_tokens", "output_tokens")
+
+# ---------------------------------------------------------------------------
+# Scripted LLM — recognises each prompt by its output schema and answers it.
+# ---------------------------------------------------------------------------
+
+class ScriptedBackend(LLMBackend):
+    # Deterministic stand‑in for the model. The plan has *plan_depth* steps
+    # and revisions keep it unchanged, the first remaining result is always
+    # chosen, notes are the first *note_words* words of the block and prose
+    # is *prose_words* words long. Every call sleeps *latency* seconds.
+
+    def __init__(self, plan_depth: int, latency: float = 0.0, sections: int = 4, note_words: int = 40, prose_words: int = 150):
+        self.plan_depth = plan_depth
+        self.latency = latency
+        self.sections = sections
+        self.note_words = note_words
+        self.prose_words = prose_words
+
+    def call(self, model, messages, response_model=None) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.reply(messages[-1]["content"])
+
+    async def acall(self, model, messages, response_model=None) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.reply(messages[-1]["content"])
+
+    def reply(self, prompt: str) -> str:
+        if "This is the rest of your research plan:" in prompt:
+            rest = _between(prompt, "This is the rest of your research plan:\n", "\n\nYour job is")
+            return json.dumps({"plan": [list(step) for step in ast.literal_eval(rest)]})
+        if '{"plan"' in prompt:
+            return json.dumps({"plan": [[f"benchmark query {i}", f"reasoning for step {i}"]
+                                        for i in range(self.plan_depth)]})
+        if '{"site"' in prompt:
+            return json.dumps({"site": [1, "first remaining result"]})
+        if '{"sections"' in prompt:
+            return json.dumps({"sections": [[f"Section {i}", f"description of section {i}"]
+                                            for i in range(self.sections)]})
+        if '{"decision"' in prompt:
+            return json.dumps({"decision": [1, "keep reading"]})
+        if '{"step_indices"' in prompt:
+            return json.dumps({"step_indices": [0]})
+        if "piece of text #" in prompt:
+            text = _between(prompt, "from the site:\n", "\n\nYour job is")
+            return " ".join(text.split()[:self.note_words]) or "..."
+        return " ".join(["lorem"] * self.prose_words)
+
+
+def _between(text: str, start: str, end: str) -> str:
+    head = text.split(start, 1)[-1]
+    return head.split(end, 1)[0]
+
+# ---------------------------------------------------------------------------
+# Local web fixtures — static pages served by a child http.server process, so
+# the server's CPU time never counts against the pipeline's.
+# ---------------------------------------------------------------------------
+
+def _slug(query: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", query.lower()).strip("-")
+
+
+class CannedSearch:
+    # Drop‑in for DDGS: RESULTS_PER_QUERY results per query, all on the
+    # local server, under the page size being benchmarked.
+
+    def __init__(self, base_url: str, timeout: Optional[float] = None):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def text(self, query: str, backend: str = "", max_results: int = RESULTS_PER_QUERY) -> List[Dict[str, str]]:
+        slug = _slug(query)
+        return [{"title": f"{query} — result {i}",
+                 "href": f"{self.base_url}/{slug}/{i}.html",
+                 "body": f"Snippet {i} for {query}."}
+                for i in range(min(max_results, RESULTS_PER_QUERY))]
+
+
+def _vocabulary(size: int = 4000) -> List[str]:
+    rng = random.Random(0)
+    syllables = ["ka", "lo", "mi", "ren", "tas", "vo", "pe", "dun", "sil", "ar", "no", "qui", "bet", "zo", "lin"]
+    return ["".join(rng.choice(syllables) for _ in range(rng.randint(1, 4))) for _ in range(size)]
+
+
+def write_page(path: str, seed: str, words: int, vocabulary: List[str]):
+    # A plain article of *words* words; the same seed always gives the same page.
+    rng = random.Random(seed)
+    paragraphs, written = [], 0
+    while written < words:
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            length = min(rng.randint(8, 20), words - written)
+            if length <= 0:
+                break
+            sentence = " ".join(rng.choice(vocabulary) for _ in range(length))
+            sentences.append(sentence.capitalize() + ".")
+            written += length
+        paragraphs.append(f"<p>{' '.join(sentences)}</p>")
+    links = "".join(f'<li><a href="/{seed.rsplit("/", 1)[0]}/{i}.html">Related {i}</a></li>' for i in range(3))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"<!doctype html><html><head><title>{seed}</title></head><body>"
+                f"<nav><ul>{links}</ul></nav><article><h1>{seed}</h1>{''.join(paragraphs)}</article>"
+                f"</body></html>")
+
+
+def build_fixtures(root: str, max_plan_depth: int, page_words: List[int]):
+    # /<words>/<query slug>/<i>.html for every query the scripted plan can make.
+    vocabulary = _vocabulary()
+    for words in page_words:
+        for step in range(max_plan_depth):
+            directory = os.path.join(root, str(words), _slug(f"benchmark query {step}"))
+            os.makedirs(directory, exist_ok=True)
+            for i in range(RESULTS_PER_QUERY):
+                write_page(os.path.join(directory, f"{i}.html"), f"{words}/{_slug(f'benchmark query {step}')}/{i}", words, vocabulary)
+
+
+@contextmanager
+def local_site(root: str) -> Iterator[str]:
+    # Serve *root* over HTTP on a free localhost port; yields the base URL.
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1", "--directory", root],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # trafilatura refuses private addresses by default
+    ssrf = DEFAULT_CONFIG.get("DEFAULT", "ssrf_protection", fallback="on")
+    DEFAULT_CONFIG.set("DEFAULT", "ssrf_protection", "off")
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError("benchmark web server did not start")
+                time.sleep(0.05)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        DEFAULT_CONFIG.set("DEFAULT", "ssrf_protection", ssrf)
+        server.terminate()
+        server.wait()
+
+# ---------------------------------------------------------------------------
+# Runs
+# ---------------------------------------------------------------------------
+
+def git_commit() -> Optional[str]:
+    # HEAD of the checkout this file lives in, with "-dirty" for local edits.
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def run_once(base_url: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    # One research + report run under *config*; returns its metrics.
+    tracer = Tracer(None)
+    previous_tracer = set_tracer(tracer)
+    previous_backend = set_backend(ScriptedBackend(config["plan_depth"], config["llm_latency"]))
+    previous_search = research_module.set_search_backend(
+        lambda timeout=None: CannedSearch(f"{base_url}/{config['page_words']}", timeout))
+    previous_resilience = set_resilience(Resilience())
+    registry = SessionRegistry()
+    try:
+        wall, cpu = time.perf_counter(), time.process_time()
+        research_plan, notes = research(
+            "Offline benchmark prompt", config["plan_depth"], config["search_depth"], initial_messages,
+            max_workers=config["max_workers"], note_mode=config["note_mode"],
+            duplicates=DuplicateIndex(), registry=registry)
+        write_report("Offline benchmark prompt", research_plan, notes, max_workers=config["max_workers"],
+                     section_mode=config["section_mode"])
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    finally:
+        set_resilience(previous_resilience)
+        research_module.set_search_backend(previous_search)
+        set_backend(previous_backend)
+        set_tracer(previous_tracer)
+
+    check_run(config, research_plan, notes, registry)
+    stages = tracer.summary()
+    top = [stages.get("research", {}), stages.get("write_report", {})]
+    return {
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        **{counter: int(sum(t.get(counter, 0) for t in top)) for counter in ("llm_calls", "input_tokens", "output_tokens")},
+        "stages": {key: {k: round(v, 4) if isinstance(v, float) else v for k, v in totals.items()}
+                   for key, totals in sorted(stages.items())},
+    }
+
+
+def check_run(config: Dict[str, Any], research_plan: list, notes: List[Dict[str, str]], registry: SessionRegistry):
+    # Every scripted step has its own query and pages: a run that skipped a
+    # search or read fewer pages would not measure the pipeline.
+    pages = min(config["search_depth"], RESULTS_PER_QUERY)
+    searches = registry.stats()["searches"]
+    if len(research_plan) != config["plan_depth"] or searches != config["plan_depth"]:
+        raise RuntimeError(f"expected {config['plan_depth']} steps and searches, got {len(research_plan)} and {searches}")
+    read = [len(step_notes) for step_notes in notes]
+    if read != [pages] * config["plan_depth"] or len({url for step_notes in notes for url in step_notes}) != pages * config["plan_depth"]:
+        raise RuntimeError(f"expected {pages} distinct pages per step, read {read}")
+
+
+def config_key(config: Dict[str, Any]) -> str:
+    return json.dumps(config, sort_keys=True)
+
+
+def _label(key: str) -> str:
+    config = json.loads(key)
+    return " ".join(f"{k}={config[k]}" for k in ("plan_depth", "search_depth", "page_words", "note_mode"))
+
+
+def medians(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    # {config key: {metric: median over repeats}}
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        grouped.setdefault(config_key(row["config"]), []).append(row)
+    return {key: {m: statistics.median(r[m] for r in group) for m in _METRICS} for key, group in grouped.items()}
+
+
+def load_rows(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_table(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> str:
+    # Median new/old ratio per metric for configurations present in both.
+    old_medians, new_medians = medians(old), medians(new)
+    lines = ["config".ljust(60) + "".join(f"{m:>15}" for m in _METRICS)]
+    for key, values in new_medians.items():
+        if key not in old_medians:
+            continue
+        cells = "".join(f"{values[m] / old_medians[key][m]:>15.3f}" if old_medians[key][m] else f"{'-':>15}"
+                        for m in _METRICS)
+        lines.append(_label(key).ljust(60) + cells)
+    return "\n".join(lines)
+
+
+def run_benchmark(plan_depths: List[int], search_depths: List[int], page_words: List[int], repeats: int = 3,
+                  llm_latency: float = 0.0, note_mode: str = "serial", section_mode: str = "sequential",
+                  max_workers: int = 3, output_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    # Every combination of the grid, *repeats* times each; rows are appended
+    # to *output_path* as they finish and returned.
+    commit = git_commit()
+    rows = []
+    fixtures = tempfile.mkdtemp(prefix="deep-research-bench-")
+    try:
+        build_fixtures(fixtures, max(plan_depths), page_words)
+        with local_site(fixtures) as base_url, \
+                open(output_path, "a", encoding="utf-8") if output_path else open(os.devnull, "w") as out:
+            for plan_depth in plan_depths:
+                for search_depth in search_depths:
+                    for words in page_words:
+                        config = {"plan_depth": plan_depth, "search_depth": search_depth, "page_words": words,
+                                  "llm_latency": llm_latency, "note_mode": note_mode,
+                                  "section_mode": section_mode, "max_workers": max_workers}
+                        for repeat in range(repeats):
+                            row = {"commit": commit, "config": config, "repeat": repeat, **run_once(base_url, config)}
+                            rows.append(row)
+                            out.write(json.dumps(row) + "\n")
+                            out.flush()
+    finally:
+        shutil.rmtree(fixtures, ignore_errors=True)
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# Worker scaling — the same offline runs, executed by N worker processes.
+# ---------------------------------------------------------------------------
+
+def offline_worker(queue_path: str, base_url: str, plan_depth: int, llm_latency: float, ready, stop):
+    # Worker process: the scripted LLM and canned search of run_once().
+    DEFAULT_CONFIG.set("DEFAULT", "ssrf_protection", "off")
+    set_backend(ScriptedBackend(plan_depth, llm_latency))
+    research_module.set_search_backend(lambda timeout=None: CannedSearch(base_url, timeout))
+    queue = JobQueue(queue_path)
+    ready.release()
+    run_worker(queue, poll=0.02, stop=stop)
+
+
+def run_scaling(worker_counts: List[int], runs: int = 8, plan_depth: int = 2, search_depth: int = 3,
+                page_words: int = 500, llm_latency: float = 0.05) -> List[Dict[str, Any]]:
+    # *runs* concurrent runs per worker count, each on a fresh queue; the
+    # clock starts once every worker process is up.
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    fixtures = tempfile.mkdtemp(prefix="deep-research-bench-")
+    try:
+        build_fixtures(fixtures, plan_depth, [page_words])
+        with local_site(fixtures) as base_url:
+            for workers in worker_counts:
+                queue_path = os.path.join(fixtures, f"jobs-{workers}.sqlite")
+                queue = JobQueue(queue_path)
+                ready, stop = context.Semaphore(0), context.Event()
+                processes = [context.Process(target=offline_worker, args=(
+                    queue_path, f"{base_url}/{page_words}", plan_depth, llm_latency, ready, stop)) for _ in range(workers)]
+                for process in processes:
+                    process.start()
+                for _ in processes:
+                    ready.acquire()
+                specs = [{"id": f"run-{i}", "prompt": f"Offline benchmark prompt {i}", "plan_depth": plan_depth,
+                          "search_depth": search_depth} for i in range(runs)]
+                wall = time.perf_counter()
+                results = list(run_distributed(queue, specs, max_runs=runs, timeout=600))
+                wall = time.perf_counter() - wall
+                stop.set()
+                for process in processes:
+                    process.join()
+                stats = queue.stats()
+                queue.close()
+                rows.append({
+                    "workers": workers,
+                    "runs": runs,
+                    "ok": sum(result["status"] == "ok" for result in results),
+                    "wall_seconds": round(wall, 3),
+                    "runs_per_hour": round(runs * 3600 / wall, 1),
+                    "jobs": stats["done"],
+                    "jobs_per_second": round(stats["done"] / wall, 2),
+                    "retries": stats["retries"],
+                    "speedup": round(rows[0]["wall_seconds"] / wall, 2) if rows else 1.0,
+                })
+    finally:
+        shutil.rmtree(fixtures, ignore_errors=True)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of research + report.")
+    parser.add_argument("--plan-depth", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--search-depth", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--page-words", type=int, nargs="+", default=[500, 3000], help="words per fixture page")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the scripted LLM sleeps per call")
+    parser.add_argument("--note-mode", choices=("serial", "mapreduce"), default="serial")
+    parser.add_argument("--section-mode", choices=("sequential", "parallel"), default="sequential")
+    parser.add_argument("--max-workers", type=int, default=3)
+    parser.add_argument("--output", default=".cache/benchmark.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="measure throughput through the job queue with these worker process counts")
+    parser.add_argument("--runs", type=int, default=8, help="concurrent runs per worker count (with --workers)")
+    args = parser.parse_args()
+
+    if args.workers:
+        columns = ("workers", "ok", "wall_seconds", "runs_per_hour", "jobs", "jobs_per_second", "retries", "speedup")
+        print("".join(f"{c:>16}" for c in columns))
+        for row in run_scaling(args.workers, args.runs, args.plan_depth[0], args.search_depth[0],
+                               args.page_words[0], args.llm_latency):
+            print("".join(f"{row[c]:>16}" for c in columns), flush=True)
+        sys.exit(0)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    rows = run_benchmark(args.plan_depth, args.search_depth, args.page_words, args.repeats, args.llm_latency,
+                         args.note_mode, args.section_mode, args.max_workers, args.output)
+    print("config".ljust(60) + "".join(f"{m:>15}" for m in _METRICS))
+    for key, values in medians(rows).items():
+        print(_label(key).ljust(60) + "".join(f"{values[m]:>15.3f}" if m.endswith("seconds") else f"{values[m]:>15.0f}"
+                                        for m in _METRICS))
+    if args.compare:
+        print(f"\nnew / old (medians) vs {args.compare}:")
+        print(compare_table(load_rows(args.compare), rows))
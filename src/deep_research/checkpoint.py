@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+# ---------------------------------------------------------------------------
+# Research checkpoints — one JSON file per run, replaced atomically.
+# ---------------------------------------------------------------------------
+# The state is written to a temporary file in the same directory, flushed to
+# disk and renamed over the previous checkpoint, so a crash mid‑write leaves
+# the last complete checkpoint in place. A finished run writes its final
+# state with "complete": true; that checkpoint is kept for inspection but
+# never resumed. The run's settings are saved with it, and research()
+# refuses to resume a checkpoint written with different ones.
+# ---------------------------------------------------------------------------
+
+CHECKPOINT_VERSION = 2
+
+
+def save_checkpoint(path: str, state: Dict[str, Any]):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".checkpoint-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": CHECKPOINT_VERSION, **state}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    # The saved state, or None when there is no unfinished run to resume.
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"unsupported checkpoint version in {path}: {state.get('version')}")
+    if state.get("complete"):
+        return None
+    # JSON has no tuples; plan steps are (query, reasoning) pairs everywhere else.
+    state["research_plan"] = [tuple(step) for step in state["research_plan"]]
+    return state
+
+
+def checkpoint_path_for(run_id: str, settings: Dict[str, Any], directory: str = ".cache/checkpoints") -> str:
+    # One checkpoint per run id and run *settings* (prompt, depths, modes…):
+    # re‑running with the same id and settings resumes the run, while other
+    # runs of the same prompt in the same process get files of their own.
+    key = json.dumps({"run": run_id, **settings}, sort_keys=True, ensure_ascii=False)
+    return os.path.join(directory, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.json")
@@ -0,0 +1,135 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from tracing import (
+    add_count
+)
+
+try:
+    import tiktoken                         # exact counts when available
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:                           # ImportError or missing encoding data
+    _ENCODING = None
+
+# ---------------------------------------------------------------------------
+# Token‑budgeted context — fit every request *before* it is sent.
+# ---------------------------------------------------------------------------
+# The research conversation is laid out as
+#   [system] [plan prompt] [plan] [revision / site / block exchanges ...] [request]
+# The first `pinned` messages (system prompt + original plan exchange) and the
+# final request are never dropped. When a request is over budget, the oldest
+# middle messages are evicted and folded into one compact summary message
+# (first `summary_words` words of each); if that is still too large the
+# summary itself is dropped oldest‑first.
+# ---------------------------------------------------------------------------
+
+DEFAULT_TOKEN_BUDGET = 100_000
+MESSAGE_OVERHEAD = 4                        # role / separator tokens per message
+
+
+def count_tokens(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    # ~4 characters per token for English prose
+    return (len(text) + 3) // 4
+
+
+def message_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(count_tokens(str(m.get("content") or "")) + MESSAGE_OVERHEAD for m in messages)
+
+
+def _compact(messages: List[Dict[str, Any]], summary_words: int) -> Optional[Dict[str, Any]]:
+    if not messages:
+        return None
+    lines = []
+    for m in messages:
+        words = str(m.get("content") or "").split()
+        text = " ".join(words[:summary_words]) + (" …" if len(words) > summary_words else "")
+        lines.append(f"[{m.get('role')}] {text}")
+    return {"role": "user", "content": "Summary of earlier exchanges (compacted to save context):\n" + "\n".join(lines)}
+
+
+def fit_messages(messages: List[Dict[str, Any]], budget: int, pinned: int = 3, summary_words: int = 40) -> Tuple[List[Dict[str, Any]], int]:
+    # Return (messages that fit *budget*, number of messages evicted).
+    # The input list is never modified.
+    if message_tokens(messages) <= budget or len(messages) <= pinned + 1:
+        return list(messages), 0
+
+    head, middle, tail = messages[:pinned], list(messages[pinned:-1]), messages[-1:]
+    fixed = message_tokens(head) + message_tokens(tail)
+
+    # Evict oldest middle messages until the remainder plus their summary fits.
+    evicted: List[Dict[str, Any]] = []
+    while middle:
+        summary = _compact(evicted, summary_words)
+        total = fixed + message_tokens(middle) + (message_tokens([summary]) if summary else 0)
+        if total <= budget:
+            break
+        evicted.append(middle.pop(0))
+
+    # Shrink the summary itself if even the fully compacted history is too big.
+    summarized = list(evicted)
+    summary = _compact(summarized, summary_words)
+    while summarized and fixed + message_tokens(middle) + message_tokens([summary]) > budget:
+        summarized.pop(0)
+        summary = _compact(summarized, summary_words)
+
+    fitted = head + ([summary] if summary else []) + middle + tail
+    return fitted, len(evicted)
+
+
+# ---------------------------------------------------------------------------
+# ContextManager — process‑wide budget plus per‑call‑site token accounting.
+# ---------------------------------------------------------------------------
+
+class ContextManager:
+    def __init__(self, budget: int = DEFAULT_TOKEN_BUDGET, pinned: int = 3, summary_words: int = 40):
+        self.budget = budget
+        self.pinned = pinned
+        self.summary_words = summary_words
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def fit(self, messages: List[Dict[str, Any]], call_site: Optional[str] = None, budget: Optional[int] = None) -> List[Dict[str, Any]]:
+        budget = budget or self.budget
+        before = message_tokens(messages)
+        fitted, evicted = fit_messages(messages, budget, self.pinned, self.summary_words)
+        after = message_tokens(fitted) if evicted else before
+        with self._lock:
+            stats = self._stats.setdefault(call_site or "untagged", {
+                "calls": 0, "messages": 0, "history_tokens": 0, "input_tokens": 0,
+                "output_tokens": 0, "max_input_tokens": 0, "evicted_messages": 0,
+            })
+            stats["calls"] += 1
+            stats["messages"] += len(messages)
+            stats["history_tokens"] += before
+            stats["input_tokens"] += after
+            stats["max_input_tokens"] = max(stats["max_input_tokens"], after)
+            stats["evicted_messages"] += evicted
+        add_count("input_tokens", after)
+        return fitted
+
+    def record_output(self, text: str, call_site: Optional[str] = None):
+        tokens = count_tokens(text or "")
+        add_count("output_tokens", tokens)
+        with self._lock:
+            stats = self._stats.get(call_site or "untagged")
+            if stats is not None:
+                stats["output_tokens"] += tokens
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        # Per call site: history_tokens is what the caller's message list
+        # weighed, input_tokens what was actually sent after fitting.
+        with self._lock:
+            return {site: dict(values) for site, values in self._stats.items()}
+
+
+_context_manager = ContextManager()
+
+
+def get_context_manager() -> ContextManager:
+    return _context_manager
+
+
+def set_token_budget(budget: int):
+    _context_manager.budget = budget
@@ -0,0 +1,292 @@
+import heapq
+import itertools
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urljoin, urlsplit
+from urllib.robotparser import RobotFileParser
+
+from relevance import (
+    tokenize
+)
+
+from dedup import (
+    DuplicateIndex,
+    normalize_url
+)
+
+from prefetch import (
+    PagePrefetcher
+)
+
+from scheduler import (
+    ContextThreadPoolExecutor
+)
+
+from text_processors import (
+    fetch_html
+)
+
+from tracing import (
+    annotate_span,
+    traced
+)
+
+# ---------------------------------------------------------------------------
+# Link crawler — follow the best outgoing links of a step's pages.
+# ---------------------------------------------------------------------------
+# After a step's picks are read, their hrefs ({target: anchor text}) seed a
+# per‑step Frontier: a priority queue ordered by how well a link's anchor
+# text and URL match the step query, plus a bonus for primary sources
+# (papers, DOIs, PDFs' abstract pages, .edu / .gov hosts). Links that match
+# nothing, point at files trafilatura cannot read, are disallowed by
+# robots.txt or were already read this session never leave the frontier.
+#
+# Each round pops the best links (at most `max_per_domain` per domain, and
+# only the seeds' own domains with same_domain_only=True), downloads them
+# concurrently and reads those that arrived. With a DuplicateIndex, a link
+# is claimed before it is downloaded and one that redirects to a page
+# already read is skipped. Budgets per step are strict: no more than
+# `max_fetches` requests (pages, robots.txt files and redirect lookups)
+# and `max_note_calls` note‑taking LLM calls; a page is read only up to the
+# note calls it has reserved, and links found on it are followed down to
+# `max_depth` hops from the seeds.
+# ---------------------------------------------------------------------------
+
+_SKIP_EXTENSIONS = re.compile(
+    r"\.(pdf|zip|gz|tar|rar|7z|exe|dmg|iso|png|jpe?g|gif|svg|webp|ico|mp[34]|avi|mov|wav|css|js|json|xml|rss|ppt|pptx|doc|docx|xls|xlsx)$", re.I)
+_PRIMARY_HOSTS = re.compile(r"(^|\.)(arxiv\.org|doi\.org|openreview\.net|aclanthology\.org|semanticscholar\.org|nature\.com|science\.org|acm\.org|ieee\.org|springer\.com|ncbi\.nlm\.nih\.gov|[\w-]+\.(edu|gov))$")
+_PRIMARY_TERMS = frozenset(("paper", "abs", "abstract", "proceedings", "journal", "pdf", "doi", "preprint", "study", "specification", "rfc", "documentation", "docs"))
+_NAVIGATION = frozenset(("login", "signin", "signup", "register", "subscribe", "share", "privacy", "cookie", "cookies", "terms", "contact", "advertise", "careers", "tag", "tags", "category", "author", "comments", "cart", "account"))
+
+CRAWL_FETCH_TIMEOUT = 30   # seconds a crawl round waits for its downloads
+
+
+@dataclass(order=True)
+class Link:
+    priority: float
+    seq: int
+    url: str = field(compare=False)
+    anchor: str = field(compare=False, default="")
+    depth: int = field(compare=False, default=1)
+    source: str = field(compare=False, default="")
+
+
+def score_link(query_terms: Set[str], url: str, anchor: str) -> float:
+    # Query terms in the anchor count double those in the URL; primary
+    # sources get a bonus and navigation links a penalty.
+    parts = urlsplit(url)
+    anchor_terms = set(tokenize(anchor))
+    url_terms = set(tokenize(f"{parts.path} {parts.query}"))
+    score = 2.0 * len(query_terms & anchor_terms) + 1.0 * len(query_terms & url_terms)
+    if _PRIMARY_HOSTS.search(parts.hostname or "") or _PRIMARY_TERMS & (anchor_terms | url_terms):
+        score += 1.5
+    if _NAVIGATION & (anchor_terms | url_terms):
+        score -= 3.0
+    return score
+
+
+def _domain(url: str) -> str:
+    host = urlsplit(url).netloc.lower().rsplit("@", 1)[-1]
+    return host[4:] if host.startswith("www.") else host
+
+
+class Frontier:
+    # Links for one step, best first; every URL is queued at most once.
+
+    def __init__(self, query: str, seen: Iterable[str] = (), min_score: float = 1.0):
+        self.query_terms = set(tokenize(query))
+        self.min_score = min_score
+        self.seen: Set[str] = {normalize_url(url) for url in seen}
+        self._heap: List[Link] = []
+        self._seq = itertools.count()
+
+    def add(self, page_url: str, hrefs: Dict[str, str], depth: int) -> int:
+        # Queue the links of *page_url* found *depth* hops from the seeds.
+        added = 0
+        for target, anchor in hrefs.items():
+            url = urljoin(page_url, target).split("#", 1)[0]
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or _SKIP_EXTENSIONS.search(parts.path):
+                continue
+            key = normalize_url(url)
+            if key in self.seen:
+                continue
+            score = score_link(self.query_terms, url, anchor or "")
+            if score < self.min_score:
+                continue
+            self.seen.add(key)
+            heapq.heappush(self._heap, Link(-score, next(self._seq), url, anchor or "", depth, page_url))
+            added += 1
+        return added
+
+    def pop(self) -> Optional[Link]:
+        return heapq.heappop(self._heap) if self._heap else None
+
+    def push(self, link: Link):
+        # Put back a popped link (its URL stays seen).
+        heapq.heappush(self._heap, link)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class RobotsCache:
+    # robots.txt rules per host, fetched once per session; hosts without a
+    # readable robots.txt allow everything.
+
+    def __init__(self, user_agent: str = "*"):
+        self.user_agent = user_agent
+        self._lock = threading.Lock()
+        self._parsers: Dict[str, RobotFileParser] = {}
+        self.fetches = 0
+
+    def known(self, url: str) -> bool:
+        # Whether allowed(url) can answer without fetching robots.txt.
+        parts = urlsplit(url)
+        with self._lock:
+            return f"{parts.scheme}://{parts.netloc}" in self._parsers
+
+    def allowed(self, url: str) -> bool:
+        parts = urlsplit(url)
+        root = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            parser = self._parsers.get(root)
+        if parser is None:
+            html, _ = fetch_html(f"{root}/robots.txt")
+            parser = RobotFileParser()
+            parser.parse((html or "").splitlines())
+            with self._lock:
+                self.fetches += 1
+                parser = self._parsers.setdefault(root, parser)
+        return parser.can_fetch(self.user_agent, url)
+
+
+class LinkCrawler:
+    def __init__(self, max_pages: int = 2, max_fetches: int = 6, max_note_calls: int = 8, max_depth: int = 1,
+                 max_per_domain: int = 2, same_domain_only: bool = False, respect_robots: bool = True,
+                 min_score: float = 1.0, max_workers: int = 3):
+        self.max_pages = max_pages
+        self.max_fetches = max_fetches
+        self.max_note_calls = max_note_calls
+        self.max_depth = max(1, max_depth)
+        self.max_per_domain = max_per_domain
+        self.same_domain_only = same_domain_only
+        self.min_score = min_score
+        self.max_workers = max(1, max_workers)
+        self.robots = RobotsCache() if respect_robots else None
+        self.prefetcher = PagePrefetcher(max_workers=self.max_workers)
+        self._lock = threading.Lock()
+        self.steps: List[dict] = []
+
+    def _admissible(self, link: Link, seed_domains: Set[str], per_domain: Dict[str, int], stats: dict) -> bool:
+        domain = _domain(link.url)
+        if self.same_domain_only and domain not in seed_domains:
+            return False
+        if per_domain.get(domain, 0) >= self.max_per_domain:
+            return False
+        if self.robots is not None:
+            if not self.robots.known(link.url):
+                stats["fetches"] += 1   # robots.txt
+            if not self.robots.allowed(link.url):
+                stats["robots_blocked"] += 1
+                return False
+        return True
+
+    def _cost(self, link: Link, duplicates: Optional[DuplicateIndex]) -> int:
+        # Requests *link* needs: the page, plus robots.txt for a new host and
+        # a redirect lookup when duplicates are resolved.
+        cost = 1
+        if self.robots is not None and not self.robots.known(link.url):
+            cost += 1
+        if duplicates is not None and duplicates.resolve_redirects:
+            cost += 1
+        return cost
+
+    @traced("crawl")
+    def crawl(self, query: str, seeds: Dict[str, Dict[str, str]], read: Callable[[str, int], Tuple[str, Dict[str, str]]], seen: Iterable[str] = (), duplicates: Optional[DuplicateIndex] = None) -> Dict[str, str]:
+        # Follow the links of *seeds* ({page url: hrefs}) for the step *query*.
+        # read(url, max_note_calls) reads a page downloaded by self.prefetcher
+        # and returns (notes, hrefs). URLs in *seen* (and the seeds) are
+        # skipped, and so are links *duplicates* resolves to a page already
+        # claimed. Returns {url: notes} in the order pages were chosen.
+        frontier = Frontier(query, list(seen) + list(seeds), self.min_score)
+        for page_url, hrefs in seeds.items():
+            frontier.add(page_url, hrefs or {}, 1)
+        seed_domains = {_domain(url) for url in seeds}
+        per_domain: Dict[str, int] = {}
+        stats = {"query": query, "queued": len(frontier), "fetches": 0, "dead": 0, "note_calls": 0,
+                 "pages": 0, "robots_blocked": 0, "duplicates": 0, "left": 0}
+        notes: Dict[str, str] = {}
+
+        with ContextThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(notes) < self.max_pages and stats["fetches"] < self.max_fetches \
+                    and stats["note_calls"] < self.max_note_calls:
+                # Next round: the best admissible links the fetch budget allows
+                room = min(self.max_workers, self.max_pages - len(notes))
+                batch: List[Link] = []
+                unaffordable: List[Link] = []
+                while len(batch) < room:
+                    link = frontier.pop()
+                    if link is None:
+                        break
+                    # The batch's downloads are still to come
+                    if stats["fetches"] + len(batch) + self._cost(link, duplicates) > self.max_fetches:
+                        unaffordable.append(link)
+                        continue
+                    if not self._admissible(link, seed_domains, per_domain, stats):
+                        continue
+                    if duplicates is not None:
+                        if duplicates.resolve_redirects:
+                            stats["fetches"] += 1   # HEAD request
+                        if duplicates.claim_url(link.url):
+                            stats["duplicates"] += 1
+                            continue
+                    batch.append(link)
+                    domain = _domain(link.url)
+                    per_domain[domain] = per_domain.get(domain, 0) + 1
+                for link in unaffordable:
+                    frontier.push(link)
+                if not batch:
+                    break
+                urls = [link.url for link in batch]
+                stats["fetches"] += len(urls)
+                self.prefetcher.prefetch(urls)
+                pages = self.prefetcher.ready(urls, CRAWL_FETCH_TIMEOUT)
+                self.prefetcher.drop([url for url in urls if pages.get(url) is None])
+
+                # Reserve note calls in rank order, then read concurrently
+                reads = []
+                for link in batch:
+                    page = pages.get(link.url)
+                    if page is None:
+                        stats["dead"] += 1
+                        continue
+                    calls = min(len(page[0]), self.max_note_calls - stats["note_calls"])
+                    if calls <= 0:
+                        self.prefetcher.drop([link.url])
+                        continue
+                    stats["note_calls"] += calls
+                    reads.append((link, pool.submit(read, link.url, calls)))
+                for link, future in reads:
+                    page_notes, hrefs = future.result()
+                    notes[link.url] = page_notes
+                    if link.depth < self.max_depth:
+                        frontier.add(link.url, hrefs or {}, link.depth + 1)
+        stats["pages"] = len(notes)
+        stats["left"] = len(frontier)
+        annotate_span(**{k: v for k, v in stats.items() if k != "query"})
+        with self._lock:
+            self.steps.append(stats)
+        return notes
+
+    def stats(self) -> dict:
+        with self._lock:
+            steps = [dict(step) for step in self.steps]
+        totals = {key: sum(step[key] for step in steps)
+                  for key in ("fetches", "dead", "note_calls", "pages", "robots_blocked", "duplicates")}
+        return {**totals, "robots_fetches": self.robots.fetches if self.robots else 0, "steps": steps}
+
+    def close(self):
+        self.prefetcher.close()
@@ -0,0 +1,152 @@
+import hashlib
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from text_processors import (
+    resolve_redirects
+)
+
+# ---------------------------------------------------------------------------
+# Near‑duplicate detection across sites and steps.
+# ---------------------------------------------------------------------------
+# • URLs are normalised (scheme/host case, www., default ports, fragments,
+#   tracking parameters, trailing slash) and, optionally, resolved through
+#   redirects so mirrors that land on the same canonical URL collapse.
+# • Pages and blocks are fingerprinted with a 64‑bit SimHash over 3‑word
+#   shingles. Fingerprints within `max_distance` bits are near‑duplicates;
+#   a 4×16‑bit band index finds candidates without scanning everything
+#   (pigeonhole: distance ≤ 3 ⇒ at least one band matches exactly).
+# ---------------------------------------------------------------------------
+
+_WORD = re.compile(r"\w+")
+_TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|mc_cid|mc_eid|ref|ref_src)$")
+_BANDS = 4
+_BAND_BITS = 64 // _BANDS
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    port = parts.port
+    if port and not ((parts.scheme == "http" and port == 80) or (parts.scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                             if not _TRACKING_PARAMS.match(k)))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower() or "http", host, path, query, ""))
+
+
+def resolve_url(url: str) -> str:
+    # Follow redirects (see text_processors.resolve_redirects); falls back to
+    # the URL itself when its host cannot be reached.
+    return normalize_url(resolve_redirects(url) or url)
+
+
+def simhash(text: str) -> int:
+    words = _WORD.findall(text.lower())
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    weights = [0] * 64
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def _bands(fingerprint: int) -> List[Tuple[int, int]]:
+    mask = (1 << _BAND_BITS) - 1
+    return [(band, fingerprint >> (band * _BAND_BITS) & mask) for band in range(_BANDS)]
+
+
+class SimHashIndex:
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        self._bands: Dict[Tuple[int, int], List[Tuple[int, object]]] = {}
+
+    def find(self, fingerprint: int, exclude: Optional[Callable[[object], bool]] = None) -> Optional[object]:
+        # First near‑duplicate's ref, skipping refs for which exclude(ref) is true.
+        for key in _bands(fingerprint):
+            for other, ref in self._bands.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance and not (exclude and exclude(ref)):
+                    return ref
+        return None
+
+    def add(self, fingerprint: int, ref: object):
+        for key in _bands(fingerprint):
+            self._bands.setdefault(key, []).append((fingerprint, ref))
+
+
+class DuplicateIndex:
+    # Session‑wide register of canonical URLs, pages and blocks already read.
+    # Every claim_* call is atomic: the first caller registers the item and
+    # gets None back, later callers get a reference to the first one.
+
+    def __init__(self, max_distance: int = 3, resolve_redirects: bool = True, min_block_words: int = 50):
+        self.resolve_redirects = resolve_redirects
+        self.min_block_words = min_block_words
+        self._lock = threading.Lock()
+        self._urls: Dict[str, str] = {}
+        self._canonical: Dict[str, str] = {}   # URL → canonical URL, resolved once
+        self._pages = SimHashIndex(max_distance)
+        self._blocks = SimHashIndex(max_distance)
+        self.duplicate_urls = 0
+        self.duplicate_pages = 0
+        self.duplicate_blocks = 0
+
+    def claim_url(self, url: str) -> Optional[str]:
+        with self._lock:
+            canonical = self._canonical.get(url)
+        if canonical is None:
+            canonical = resolve_url(url) if self.resolve_redirects else normalize_url(url)
+        with self._lock:
+            canonical = self._canonical.setdefault(url, canonical)
+            if canonical in self._urls and self._urls[canonical] != url:
+                self.duplicate_urls += 1
+                return self._urls[canonical]
+            self._urls.setdefault(canonical, url)
+            return None
+
+    def claim_page(self, url: str, blocks: List[str]) -> Optional[str]:
+        if not blocks:
+            return None
+        fingerprint = simhash(" ".join(blocks))
+        with self._lock:
+            other = self._pages.find(fingerprint)
+            if other is not None and other != url:
+                self.duplicate_pages += 1
+                return other
+            self._pages.add(fingerprint, url)
+            return None
+
+    def claim_block(self, url: str, block_idx: int, text: str) -> Optional[Tuple[str, int]]:
+        # Short blocks (page tails) fingerprint poorly; never treat them as copies.
+        # Blocks of the same canonical URL are not copies either: a page read
+        # again in a later step must not match its own earlier reading.
+        if len(text.split()) < self.min_block_words:
+            return None
+        fingerprint = simhash(text)
+        with self._lock:
+            canonical = self._canonical_of(url)
+            other = self._blocks.find(fingerprint, lambda ref: self._canonical_of(ref[0]) == canonical)
+            if other is not None:
+                self.duplicate_blocks += 1
+                return other
+            self._blocks.add(fingerprint, (url, block_idx))
+            return None
+
+    def _canonical_of(self, url: str) -> str:
+        # Caller holds the lock. The URL claim_url resolved *url* to, if any.
+        return self._canonical.get(url) or normalize_url(url)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "urls": len(self._urls),
+                "duplicate_urls": self.duplicate_urls,
+                "duplicate_pages": self.duplicate_pages,
+                "duplicate_blocks": self.duplicate_blocks,
+            }
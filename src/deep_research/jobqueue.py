@@ -0,0 +1,237 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+# JobQueue — durable SQLite job queue shared by coordinators and workers.
+# ---------------------------------------------------------------------------
+# A job is (run, kind, JSON payload) with an optional unique key. Submitting
+# a key that already exists with the same payload returns the existing job,
+# so a coordinator that is restarted with the same run id re‑attaches to the
+# jobs it already submitted (finished ones are not run again); the same key
+# with a different payload is rejected.
+#
+# • claim     – a worker takes the oldest queued job of the highest priority
+#               and holds a lease on it for `lease_seconds`
+# • heartbeat – long jobs extend their lease while they run
+# • expiry    – a lease that runs out (the worker died or hung) puts the job
+#               back in the queue; each claim counts as an attempt and a job
+#               whose attempts reach `max_attempts` fails for good
+# • fail      – an error re‑queues the job after `retry_delay` seconds
+#               (doubling per attempt) until its attempts are used up
+#
+# Results of a lease that was lost are discarded, so a job that was taken
+# over by another worker is only completed once. Any process can open the
+# same file; SQLite serialises the writers (WAL mode).
+# ---------------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    key           TEXT UNIQUE,
+    run           TEXT NOT NULL,
+    kind          TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    priority      INTEGER NOT NULL DEFAULT 0,
+    status        TEXT NOT NULL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL,
+    worker        TEXT,
+    lease_expires REAL,
+    not_before    REAL NOT NULL,
+    result        TEXT,
+    error         TEXT,
+    created_at    REAL NOT NULL,
+    finished_at   REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, id);
+CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run);
+"""
+
+QUEUED, LEASED, DONE, FAILED = "queued", "leased", "done", "failed"
+
+
+class JobFailed(RuntimeError):
+    """A job used up its attempts (or was failed without retry)."""
+
+
+@dataclass
+class QueuedJob:
+    id: int
+    run: str
+    kind: str
+    payload: Dict[str, Any]
+    attempt: int
+    worker: str
+
+
+class JobQueue:
+    def __init__(self, path: str = ".cache/jobs.sqlite", lease_seconds: float = 60.0, max_attempts: int = 3, retry_delay: float = 1.0):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self.expired = 0   # leases this process found expired and re‑queued
+
+    def submit(self, run: str, kind: str, payload: Dict[str, Any], key: Optional[str] = None, priority: int = 0, max_attempts: Optional[int] = None) -> int:
+        # Queue a job and return its id. An existing *key* returns that job
+        # (ValueError if its payload differs); if it had failed for good it
+        # is queued again with fresh attempts.
+        now = time.time()
+        encoded = json.dumps(payload, sort_keys=True)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT id, status, payload FROM jobs WHERE key = ?", (key,)).fetchone() if key else None
+                if row is not None:
+                    job_id, status, stored = row
+                    if stored != encoded:
+                        raise ValueError(f"job key {key} already used for a different {kind} payload")
+                    if status == FAILED:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = ?, attempts = 0, worker = NULL, lease_expires = NULL, "
+                            "not_before = ?, error = NULL WHERE id = ?", (QUEUED, now, job_id))
+                else:
+                    job_id = self._conn.execute(
+                        "INSERT INTO jobs (key, run, kind, payload, priority, status, max_attempts, not_before, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, run, kind, encoded, priority, QUEUED,
+                         max_attempts or self.max_attempts, now, now)).lastrowid
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim(self, worker: str, kinds: Optional[Iterable[str]] = None) -> Optional[QueuedJob]:
+        # Lease the next runnable job (of *kinds*, if given) to *worker*.
+        now = time.time()
+        kinds = list(kinds or [])
+        kind_filter = f" AND kind IN ({', '.join('?' * len(kinds))})" if kinds else ""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(now)
+                row = self._conn.execute(
+                    f"SELECT id, run, kind, payload, attempts FROM jobs WHERE status = ? AND not_before <= ?{kind_filter} "
+                    "ORDER BY priority DESC, id LIMIT 1", (QUEUED, now, *kinds)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, worker = ?, lease_expires = ? WHERE id = ?",
+                        (LEASED, worker, now + self.lease_seconds, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job_id, run, kind, payload, attempts = row
+        return QueuedJob(job_id, run, kind, json.loads(payload), attempts + 1, worker)
+
+    def heartbeat(self, job: QueuedJob) -> bool:
+        # Extend *job*'s lease; False when the lease was lost.
+        return self._update(job, "lease_expires = ?", (time.time() + self.lease_seconds,))
+
+    def complete(self, job: QueuedJob, result: Any) -> bool:
+        # Store *job*'s result; False (result dropped) when the lease was lost.
+        return self._update(job, "status = ?, result = ?, error = NULL, lease_expires = NULL, finished_at = ?",
+                            (DONE, json.dumps(result), time.time()))
+
+    def fail(self, job: QueuedJob, error: str, retry: bool = True) -> bool:
+        # Record an error; the job is queued again while it has attempts left.
+        now = time.time()
+        with self._lock:
+            max_attempts = self._conn.execute("SELECT max_attempts FROM jobs WHERE id = ?", (job.id,)).fetchone()[0]
+        if retry and job.attempt < max_attempts:
+            delay = self.retry_delay * 2 ** (job.attempt - 1)
+            return self._update(job, "status = ?, error = ?, worker = NULL, lease_expires = NULL, not_before = ?",
+                                (QUEUED, error, now + delay))
+        return self._update(job, "status = ?, error = ?, lease_expires = NULL, finished_at = ?", (FAILED, error, now))
+
+    def as_completed(self, job_ids: Iterable[int], timeout: Optional[float] = None, poll: float = 0.05) -> Iterator[Tuple[int, Any]]:
+        # Yield (job id, result) for *job_ids* as they finish. Raises
+        # JobFailed for a job that failed for good and TimeoutError when
+        # *timeout* seconds pass first.
+        pending = set(job_ids)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while pending:
+            with self._lock:
+                self._expire_if_due()
+                ids = list(pending)
+                rows = self._conn.execute(
+                    f"SELECT id, status, result, error, kind FROM jobs WHERE id IN ({', '.join('?' * len(ids))}) AND status IN (?, ?)",
+                    (*ids, DONE, FAILED)).fetchall()
+            for job_id, status, result, error, kind in sorted(rows):
+                pending.discard(job_id)
+                if status == FAILED:
+                    raise JobFailed(f"{kind} job {job_id}: {error}")
+                yield job_id, json.loads(result)
+            if pending:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"{len(pending)} jobs still pending")
+                time.sleep(poll)
+
+    def wait(self, job_ids: Iterable[int], timeout: Optional[float] = None, poll: float = 0.05) -> Dict[int, Any]:
+        # {job id: result} once every job in *job_ids* has finished.
+        return dict(self.as_completed(job_ids, timeout, poll))
+
+    def stats(self, run: Optional[str] = None) -> Dict[str, Any]:
+        # Jobs per status (and per kind) with their attempts, optionally for one run.
+        where, params = ("WHERE run = ?", (run,)) if run is not None else ("", ())
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT kind, status, COUNT(*), SUM(attempts), SUM(MAX(attempts - 1, 0)) FROM jobs {where} "
+                "GROUP BY kind, status", params).fetchall()
+        stats: Dict[str, Any] = {status: 0 for status in (QUEUED, LEASED, DONE, FAILED)}
+        stats.update(attempts=0, retries=0, kinds={}, expired_leases=self.expired)
+        for kind, status, count, attempts, retries in rows:
+            stats[status] += count
+            stats["attempts"] += attempts
+            stats["retries"] += retries
+            stats["kinds"].setdefault(kind, {})[status] = count
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _expire(self, now: float):
+        # Caller holds the lock inside a transaction. Re‑queue (or fail)
+        # the jobs whose lease ran out.
+        expired = self._conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL, lease_expires = NULL, error = 'lease expired' "
+            "WHERE status = ? AND lease_expires < ? AND attempts < max_attempts", (QUEUED, LEASED, now)).rowcount
+        expired += self._conn.execute(
+            "UPDATE jobs SET status = ?, lease_expires = NULL, error = 'lease expired', finished_at = ? "
+            "WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts", (FAILED, now, LEASED, now)).rowcount
+        self.expired += expired
+
+    def _expire_if_due(self):
+        # Caller holds the lock. Lets waiting coordinators notice dead
+        # workers' jobs; the write transaction is only taken when needed.
+        now = time.time()
+        if self._conn.execute("SELECT 1 FROM jobs WHERE status = ? AND lease_expires < ? LIMIT 1", (LEASED, now)).fetchone():
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _update(self, job: QueuedJob, assignments: str, params: tuple) -> bool:
+        # Apply *assignments* only while *job*'s lease (worker and attempt) holds.
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status = ? AND worker = ? AND attempts = ?",
+                (*params, job.id, LEASED, job.worker, job.attempt))
+        return cursor.rowcount == 1
@@ -1,20 +1,409 @@
-from typing import List, Tuple, Dict, Any
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import List, Tuple, Dict, Any, Callable, Optional, Type
+from pydantic import BaseModel
 from crewai import LLM
+from crewai.events import LLMStreamChunkEvent, crewai_event_bus
 
+from context import (
+    count_tokens,
+    get_context_manager,
+    message_tokens
+)
 
-def call_llm(messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
-    for _ in range(3):
+from llm_cache import (
+    CacheMiss,
+    canonical_key,
+    get_llm_cache
+)
+
+from scheduler import (
+    get_scheduler
+)
+
+from resilience import (
+    CircuitOpenError,
+    DeadlineExceeded,
+    classify,
+    get_resilience,
+    queueing
+)
+
+from routing import (
+    LLM_TIMEOUT,
+    ModelProfile,
+    Router,
+    get_router
+)
+
+from tracing import (
+    add_count,
+    annotate_span,
+    span
+)
+
+# ---------------------------------------------------------------------------
+# Backends — call_llm / acall_llm only ever talk to an LLMBackend, so a fake
+# or a local stand‑in server can be injected with set_backend().
+# ---------------------------------------------------------------------------
+
+class LLMBackend:
+    # Interface: return the assistant's text for *messages* sent to *model*.
+    # Backends that set structured_output = True accept a pydantic
+    # *response_model* and have the provider enforce its JSON schema.
+    # Backends that set model_profiles = True also accept the routed
+    # ModelProfile as *profile* (reasoning effort, output cap, timeout) in
+    # every method; the others only see its model.
+
+    structured_output = False
+    model_profiles = False
+
+    def call(self, model: str, messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]] = None) -> str:
+        raise NotImplementedError
+
+    async def acall(self, model: str, messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]] = None, **options) -> str:
+        # Backends without native async support run the sync call on a thread.
+        return await asyncio.to_thread(self.call, model, messages, response_model, **options)
+
+    def stream(self, model: str, messages: List[Dict[str, Any]], on_token: Callable[[str], None], **options) -> str:
+        # Pass each text chunk to *on_token* as it arrives and return the whole
+        # reply. Backends without token streaming deliver it as one chunk.
+        text = self.call(model, messages, **options)
+        on_token(text)
+        return text
+
+
+class CrewAIBackend(LLMBackend):
+    # One configured crewai.LLM per model, built once and reused, so every call
+    # shares the client's HTTP connection pool (keep‑alive) instead of
+    # resolving configuration and opening connections on each request.
+    # Async clients are bound to the event loop that first uses them, so they
+    # are kept per loop. Streaming uses a separate stream=True client per model.
+    # Each distinct ModelProfile gets clients of its own.
+
+    model_profiles = True
+
+    def __init__(self, structured_output: bool = True, **llm_kwargs):
+        self.structured_output = structured_output
+        self.llm_kwargs = llm_kwargs
+        self._lock = threading.Lock()
+        self._clients: Dict[tuple, LLM] = {}
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, LLM]]" = weakref.WeakKeyDictionary()
+
+    def _options(self, model: str, profile: Optional[ModelProfile]) -> Dict[str, Any]:
+        options = dict(self.llm_kwargs)
+        if profile is not None:
+            options["timeout"] = profile.timeout
+            if profile.reasoning_effort:
+                options["reasoning_effort"] = profile.reasoning_effort
+            if profile.max_output_tokens:
+                # OpenAI reasoning models only accept max_completion_tokens
+                cap = "max_completion_tokens" if model.startswith("openai/") else "max_tokens"
+                options[cap] = profile.max_output_tokens
+        return options
+
+    def client(self, model: str, stream: bool = False, profile: Optional[ModelProfile] = None) -> LLM:
+        key = (model, stream, profile)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = LLM(model=model, stream=stream, **self._options(model, profile))
+            return self._clients[key]
+
+    def async_client(self, model: str, profile: Optional[ModelProfile] = None) -> LLM:
+        loop = asyncio.get_running_loop()
+        key = (model, profile)
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            if key not in clients:
+                clients[key] = LLM(model=model, **self._options(model, profile))
+            return clients[key]
+
+    def call(self, model: str, messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]] = None, profile: Optional[ModelProfile] = None) -> str:
+        return _as_text(self.client(model, profile=profile).call(messages=messages, response_model=response_model))
+
+    async def acall(self, model: str, messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]] = None, profile: Optional[ModelProfile] = None) -> str:
+        return _as_text(await self.async_client(model, profile).acall(messages=messages, response_model=response_model))
+
+    def stream(self, model: str, messages: List[Dict[str, Any]], on_token: Callable[[str], None], profile: Optional[ModelProfile] = None) -> str:
+        _listen_for_chunks()
+        token = _token_sink.set(on_token)
         try:
-            raw = LLM(model="openai/o3-mini").call(messages=messages)
-            return raw
+            return _as_text(self.client(model, stream=True, profile=profile).call(messages=messages))
+        finally:
+            _token_sink.reset(token)
+
+
+# crewai publishes streamed chunks on its global event bus and calls chunk
+# handlers synchronously on the thread making the request, so the sink for
+# the request in flight is found through a context variable.
+_token_sink: "contextvars.ContextVar[Optional[Callable[[str], None]]]" = contextvars.ContextVar("token_sink", default=None)
+_listening = False
+_listening_lock = threading.Lock()
+
+
+def _forward_chunk(source: Any, event: LLMStreamChunkEvent):
+    sink = _token_sink.get()
+    if sink is not None and event.chunk and event.tool_call is None:
+        sink(event.chunk)
+
+
+def _listen_for_chunks():
+    global _listening
+    with _listening_lock:
+        if not _listening:
+            crewai_event_bus.on(LLMStreamChunkEvent)(_forward_chunk)
+            _listening = True
+
+
+def _as_text(response: Any) -> str:
+    # Structured calls come back as parsed models; callers always get text.
+    return response.model_dump_json() if isinstance(response, BaseModel) else response
+
+
+_backend: LLMBackend = CrewAIBackend(timeout=LLM_TIMEOUT)
+
+
+def set_backend(backend: LLMBackend) -> LLMBackend:
+    # Swap the process‑wide backend; returns the previous one so callers
+    # (tests, benchmarks) can restore it.
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+
+def get_backend() -> LLMBackend:
+    return _backend
+
+# ---------------------------------------------------------------------------
+# call_llm / acall_llm — cached, token‑budgeted entry points.
+# ---------------------------------------------------------------------------
+
+def _cache_lookup(messages: List[Dict[str, Any]], call_site: Optional[str], response_model: Optional[Type[BaseModel]] = None, profile: ModelProfile = ModelProfile()):
+    # Returns (cache, key, cached response); cache is None when not in use.
+    cache = get_llm_cache()
+    if cache is None or not cache.enabled_for(call_site):
+        return None, None, None
+    # Key on the messages as given, before any context fitting, and on the
+    # routed profile (not a fallback); schema‑enforced answers are stored
+    # apart from free‑text ones.
+    model = f"{profile.cache_model}#{response_model.__name__}" if response_model else profile.cache_model
+    key = canonical_key(model, messages)
+    cached = cache.get(key)
+    if cached is None and cache.mode == "replay":
+        raise CacheMiss(f"no recorded response for {call_site or 'untagged'} call {key[:12]}")
+    return cache, key, cached
+
+
+def _is_context_error(err: Exception) -> bool:
+    return "context_length_exceeded" in str(err).lower()
+
+
+@contextmanager
+def _slot(messages: List[Dict[str, Any]]):
+    # Global rate limits / job budgets, when a scheduler is installed. The
+    # wait for the slot does not count against the call's retry deadline.
+    scheduler = get_scheduler()
+    slot_cm = scheduler.llm_slot(messages) if scheduler is not None else nullcontext()
+    with queueing():
+        slot = slot_cm.__enter__()
+    try:
+        yield slot
+    finally:
+        slot_cm.__exit__(None, None, None)
+
+
+@asynccontextmanager
+async def _async_slot(messages: List[Dict[str, Any]]):
+    # Waiting for a slot blocks, so it happens off the event loop.
+    slot_cm = _slot(messages)
+    slot = await asyncio.to_thread(slot_cm.__enter__)
+    try:
+        yield slot
+    finally:
+        slot_cm.__exit__(None, None, None)
+
+
+def _profile_kwargs(profile: ModelProfile) -> Dict[str, Any]:
+    return {"profile": profile} if _backend.model_profiles else {}
+
+
+class _AttemptSink:
+    # on_token for one call_llm(): forwards chunks, and calls on_restart
+    # before an attempt that streams again after chunks were already sent
+    # (a retry, a fallback model or a refitted request).
+
+    def __init__(self, on_token: Callable[[str], None], on_restart: Optional[Callable[[], None]] = None):
+        self.on_token = on_token
+        self.on_restart = on_restart
+        self.streamed = False
+
+    def __call__(self, chunk: str):
+        self.streamed = True
+        self.on_token(chunk)
+
+    def start(self):
+        if self.streamed and self.on_restart is not None:
+            self.on_restart()
+        self.streamed = False
+
+
+def _send(messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]], on_token: Optional[Callable[[str], None]] = None, profile: ModelProfile = ModelProfile()) -> str:
+    # One attempt: wait for a scheduler slot, then call the backend.
+    add_count("llm_calls")
+    with _slot(messages) as slot:
+        if isinstance(on_token, _AttemptSink):
+            on_token.start()
+        if on_token is not None:
+            raw = _backend.stream(profile.model, messages, on_token, **_profile_kwargs(profile))
+        else:
+            raw = _backend.call(profile.model, messages, response_model, **_profile_kwargs(profile))
+        if slot is not None:
+            slot.record_output(raw)
+    return raw
+
+
+async def _asend(messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]], profile: ModelProfile = ModelProfile()) -> str:
+    add_count("llm_calls")
+    async with _async_slot(messages) as slot:
+        raw = await _backend.acall(profile.model, messages, response_model, **_profile_kwargs(profile))
+        if slot is not None:
+            slot.record_output(raw)
+    return raw
+
+
+def _provider(model: str) -> str:
+    # Circuit breaker key for LLM calls: one per model, so an overloaded
+    # model does not cut off the fallback next to it.
+    return model
+
+
+def _is_overload(err: Exception) -> bool:
+    # Failures a fallback model may get past: transient errors left after
+    # the retries, an open circuit or a passed deadline.
+    return isinstance(err, (CircuitOpenError, DeadlineExceeded)) or classify(err)[0]
+
+
+def _next_route(router: Router, call_site: Optional[str], route: str, err: Exception, tried: set, seconds: float, input_tokens: int) -> Tuple[str, ModelProfile]:
+    # Record a failed attempt on *route*; return the fallback to try next or
+    # re‑raise *err*.
+    router.record(call_site, route, seconds, input_tokens, 0, error=True)
+    fallback = router.fallback(route) if _is_overload(err) else None
+    if fallback is None or fallback[0] in tried:
+        raise err
+    tried.add(fallback[0])
+    annotate_span(fallback=fallback[0])
+    return fallback
+
+
+def _no_fallback(router: Router, route: str, tried: set) -> bool:
+    # With nowhere left to fall back to, an open circuit is waited out.
+    fallback = router.fallback(route)
+    return fallback is None or fallback[0] in tried
+
+
+def _routed_call(call_site: Optional[str], route: str, profile: ModelProfile, messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]], on_token: Optional[Callable[[str], None]]) -> Tuple[str, ModelProfile]:
+    # Send to the routed profile, then down its fallback chain while the
+    # model is overloaded. Returns (reply, profile that answered).
+    router = get_router()
+    input_tokens = message_tokens(messages)
+    tried = {route}
+    while True:
+        start = time.perf_counter()
+        try:
+            raw = get_resilience().call("llm", _provider(profile.model), _send, messages, response_model, on_token, profile,
+                                        wait_open=_no_fallback(router, route, tried))
+        except Exception as err:
+            route, profile = _next_route(router, call_site, route, err, tried, time.perf_counter() - start, input_tokens)
+            continue
+        router.record(call_site, route, time.perf_counter() - start, input_tokens, count_tokens(raw), fallback=len(tried) > 1)
+        return raw, profile
+
+
+async def _arouted_call(call_site: Optional[str], route: str, profile: ModelProfile, messages: List[Dict[str, Any]], response_model: Optional[Type[BaseModel]]) -> Tuple[str, ModelProfile]:
+    router = get_router()
+    input_tokens = message_tokens(messages)
+    tried = {route}
+    while True:
+        start = time.perf_counter()
+        try:
+            raw = await get_resilience().acall("llm", _provider(profile.model), _asend, messages, response_model, profile,
+                                               wait_open=_no_fallback(router, route, tried))
         except Exception as err:
-            # If we exceeded the context window, trim oldest middle messages.
-            err_msg = str(err).lower()
+            route, profile = _next_route(router, call_site, route, err, tried, time.perf_counter() - start, input_tokens)
+            continue
+        router.record(call_site, route, time.perf_counter() - start, input_tokens, count_tokens(raw), fallback=len(tried) > 1)
+        return raw, profile
+
+
+def call_llm(messages: List[Dict[str, Any]], call_site: Optional[str] = None, response_model: Optional[Type[BaseModel]] = None, on_token: Optional[Callable[[str], None]] = None, on_restart: Optional[Callable[[], None]] = None) -> Tuple[str, List[Dict[str, Any]]]:
+    # call_site tags the request (one of routing.CALL_SITES) so the response
+    # cache can be enabled per call site and the router can send it to the
+    # model configured for it (routing.py).
+    # response_model asks a structured_output backend to enforce a schema.
+    # on_token receives the reply chunk by chunk as the backend streams it
+    # (free text only); a retried attempt streams again from its start, so
+    # the returned text is the authoritative reply. on_restart is called
+    # before such an attempt: the chunks streamed so far are void.
+    with span("call_llm", call_site):
+        route, profile = get_router().route(call_site)
+        annotate_span(route=route, model=profile.model)
+        cache, key, cached = _cache_lookup(messages, call_site, response_model, profile)
+        if cached is not None:
+            add_count("cache_hits")
+            if on_token is not None:
+                on_token(cached)
+            return cached
+
+        # Fit the request to the token budget before sending it; the caller's
+        # history is left intact and the plan prefix is never evicted.
+        context = get_context_manager()
+        budget = context.budget
+        sink = _AttemptSink(on_token, on_restart) if on_token is not None else None
+        for attempt in range(3):
+            fitted = context.fit(messages, call_site, budget)
+            try:
+                # Rate limits, timeouts and 5xx are retried with backoff here;
+                # context‑length errors come straight back to be refitted.
+                raw, answered_by = _routed_call(call_site, route, profile, fitted, response_model, sink)
+                context.record_output(raw, call_site)
+                if cache is not None:
+                    cache.put(key, answered_by.model, call_site, raw)
+                return raw
+            except Exception as err:
+                # Local counts are estimates; if the provider still rejects the
+                # request, refit it to a tighter budget instead of failing.
+                if _is_context_error(err) and attempt < 2:
+                    budget = int(budget * 0.75)
+                    continue
+                raise
 
-            is_ctx = "context_length_exceeded" in err_msg
 
-            if is_ctx and len(messages) > 6:
-                del messages[1:6]
-                continue
+async def acall_llm(messages: List[Dict[str, Any]], call_site: Optional[str] = None, response_model: Optional[Type[BaseModel]] = None) -> str:
+    # Async twin of call_llm for callers running inside an event loop.
+    with span("call_llm", call_site):
+        route, profile = get_router().route(call_site)
+        annotate_span(route=route, model=profile.model)
+        cache, key, cached = _cache_lookup(messages, call_site, response_model, profile)
+        if cached is not None:
+            add_count("cache_hits")
+            return cached
 
-            raise
\ No newline at end of file
+        context = get_context_manager()
+        budget = context.budget
+        for attempt in range(3):
+            fitted = context.fit(messages, call_site, budget)
+            try:
+                raw, answered_by = await _arouted_call(call_site, route, profile, fitted, response_model)
+                context.record_output(raw, call_site)
+                if cache is not None:
+                    cache.put(key, answered_by.model, call_site, raw)
+                return raw
+            except Exception as err:
+                if _is_context_error(err) and attempt < 2:
+                    budget = int(budget * 0.75)
+                    continue
+                raise
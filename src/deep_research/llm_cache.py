@@ -0,0 +1,145 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from routing import (
+    CALL_SITES
+)
+
+# ---------------------------------------------------------------------------
+# ResponseCache — content‑addressed cache for call_llm responses.
+# ---------------------------------------------------------------------------
+# key = sha256(model + canonicalised messages). Two tiers:
+# • memory – bounded LRU, shared by every thread in the process
+# • disk   – SQLite file that survives crashes and re‑runs
+#
+# Modes:
+# • "readwrite" – serve hits, call the provider on a miss and store the answer
+# • "replay"    – serve hits, raise CacheMiss on a miss (fully offline runs);
+#                 every call is looked up, whatever its call site
+# • "off"       – bypass the cache entirely
+#
+# Only call sites listed in `sites` are read from / written to in readwrite
+# mode, so e.g. plan generation can be cached while note‑taking is not. By
+# default that is every call site the router knows (routing.CALL_SITES).
+# ---------------------------------------------------------------------------
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT PRIMARY KEY,
+    model      TEXT NOT NULL,
+    call_site  TEXT,
+    response   TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+def canonical_key(model: str, messages: List[Dict[str, Any]]) -> str:
+    # Only role and content affect the answer; key order and extra fields do not.
+    canonical = [{"role": m.get("role"), "content": m.get("content")} for m in messages]
+    payload = json.dumps([model, canonical], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: Optional[str] = ".cache/llm.sqlite", mode: str = "readwrite", sites: Iterable[str] = CALL_SITES, memory_size: int = 1024):
+        if mode not in ("readwrite", "replay", "off"):
+            raise ValueError(f"unknown cache mode: {mode}")
+        self.mode = mode
+        self.sites = set(sites)
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def enabled_for(self, call_site: Optional[str]) -> bool:
+        if self.mode == "off":
+            return False
+        return self.mode == "replay" or call_site in self.sites
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+            row = None
+            if self._conn is not None:
+                row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key: str, model: str, call_site: Optional[str], response: str):
+        with self._lock:
+            self._remember(key, response)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, model, call_site, response, time.time()))
+                self._conn.commit()
+            self.writes += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "mode": self.mode,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _remember(self, key: str, response: str):
+        # Caller holds the lock.
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+
+# ---------------------------------------------------------------------------
+# Process‑wide default cache used by call_llm (disabled until enabled).
+# ---------------------------------------------------------------------------
+
+_default_cache: Optional[ResponseCache] = None
+
+
+def enable_llm_cache(path: Optional[str] = ".cache/llm.sqlite", **kwargs) -> ResponseCache:
+    global _default_cache
+    _default_cache = ResponseCache(path, **kwargs)
+    return _default_cache
+
+
+def get_llm_cache() -> Optional[ResponseCache]:
+    return _default_cache
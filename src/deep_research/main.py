@@ -2,26 +2,192 @@
 #   the plan (search → choose sites → read text blocks → take notes) and finally
 #   generate a multi‑section report (intro, body, conclusion).
 
+import sys
+import uuid
+
 from research import (
     research
 )
 
 from report import (
-    write_report
+    stream_report
 )
 
 from prompts import (
     initial_messages
 )
 
+from page_cache import (
+    enable_page_cache
+)
+
+from llm_cache import (
+    enable_llm_cache
+)
+
+from context import (
+    get_context_manager,
+    set_token_budget
+)
+
+from structured import (
+    structured_stats
+)
+
+from relevance import (
+    BlockFilter
+)
+
+from dedup import (
+    DuplicateIndex
+)
+
+from registry import (
+    SessionRegistry
+)
+
+from reading import (
+    ReadingPolicy
+)
+
+from prefetch import (
+    PagePrefetcher,
+    Speculator
+)
+
+from crawler import (
+    LinkCrawler
+)
+
+from checkpoint import (
+    checkpoint_path_for
+)
+
+from resilience import (
+    get_resilience
+)
+
+from routing import (
+    enable_routing
+)
+
+from tracing import (
+    enable_tracing
+)
+
 if __name__ == "__main__":
     user_prompt = "I want to understand how PPO reinforcement learning works. I want to understand the formulation of policy gradients and how step by step we get to PPO"
 
     plan_depth = 8
     search_depth = 3
+
+    # Re‑runs and repeated pages across steps are served from disk
+    page_cache = enable_page_cache(".cache/pages.sqlite")
+    # Identical requests (e.g. re‑running after a crash) are answered from disk.
+    # Use mode="replay" to re‑run a recorded pipeline offline.
+    llm_cache = enable_llm_cache(".cache/llm.sqlite", mode="readwrite")
+    # Every request is fitted to this many input tokens before it is sent
+    set_token_budget(100_000)
+    # Call sites (planning, note‑taking, repairs, report…) are sent to the
+    # model profiles configured in routes.json, with fallbacks on overload;
+    # without that file every call uses DEFAULT_MODEL.
+    router = enable_routing("routes.json")
+    # Spans for every stage, LLM call and page are appended to this file and
+    # summarised per stage at the end of the run
+    tracer = enable_tracing(".cache/trace.jsonl")
+
+    # Lexical block pre‑filter. In shadow mode every block is still read and
+    # the outcomes are logged as labels for relevance.evaluate_labels();
+    # set shadow=False to actually skip low‑scoring blocks.
+    block_filter = BlockFilter(min_relative_score=0.15, shadow=True)
+    # Mirrored/syndicated copies and redirects to pages already read this
+    # session are linked to the first copy instead of being noted again.
+    duplicates = DuplicateIndex()
+    # Searches are cached by normalised query and pages read in one step are
+    # offered (and reused) in later steps instead of being fetched again.
+    registry = SessionRegistry()
+    # Progress is checkpointed after every step and site. Each run gets a new
+    # id; passing a crashed run's id as the first argument resumes it from
+    # its last checkpoint.
+    run_id = sys.argv[1] if len(sys.argv) > 1 else uuid.uuid4().hex[:12]
+    print(f"Run id: {run_id}", file=sys.stderr, flush=True)
+    checkpoint_path = checkpoint_path_for(run_id, {"prompt": user_prompt, "plan_depth": plan_depth, "search_depth": search_depth})
+    # A page is given up after two empty blocks in a row once nothing left on
+    # it scores higher than what was already read. In shadow mode pages are
+    # still read to the end and the notes abandonment would lose are counted;
+    # set shadow=False to actually stop early.
+    reading_policy = ReadingPolicy(min_blocks=2, max_empty_streak=2, shadow=True)
+    # While each plan revision is in flight, the next step's search and page
+    # downloads already run; they are kept when the revision keeps the query.
+    # Every search result is downloaded as soon as the search is back: dead
+    # pages never reach the site choice and the others are shown with a
+    # preview. The speculator shares the same downloads.
+    prefetcher = PagePrefetcher(max_workers=5)
+    speculator = Speculator(prefetcher)
+    # After each step's picks are read, up to two of the pages they link to
+    # (best anchor text / URL match with the query, papers and primary
+    # sources first) are read too, within 8 requests (pages, robots.txt and
+    # redirect lookups) and 8 note‑taking calls per step and following
+    # robots.txt.
+    crawler = LinkCrawler(max_pages=2, max_fetches=8, max_note_calls=8, max_depth=1)
+
+    research_plan, notes = research(user_prompt, plan_depth, search_depth, initial_messages, block_filter=block_filter, duplicates=duplicates, registry=registry, checkpoint_path=checkpoint_path, reading_policy=reading_policy, speculator=speculator, prefetcher=prefetcher, crawler=crawler)
+    block_filter.dump_labels(".cache/block_labels.jsonl")
     
-    
-    research_plan, notes = research(user_prompt, plan_depth, search_depth, initial_messages)
-    
-    report = write_report(user_prompt, research_plan, notes)
+    # report_context="digest" passes a rolling digest of earlier sections
+    # instead of their full text to every later writing prompt.
+    # notes_mode="retrieval" gives the section mapping and writing prompts
+    # only the note passages most relevant to each section (notes_budget
+    # tokens of them) instead of the whole notes of every step.
+    # The report is previewed on stderr as it is written: the outline
+    # first, then each part token by token (body sections before the
+    # introduction, which is written from them); a part whose attempt
+    # failed is marked and streams again. The assembled report is printed
+    # to stdout once it is complete.
+    report_token_usage = []
+    part = None
+    report = ""
+    for event in stream_report(user_prompt, research_plan, notes, report_context="full", token_usage=report_token_usage, notes_mode="retrieval", notes_budget=3000):
+        if event.kind == "outline":
+            print("Outline:\n" + "\n".join(f"{i + 1}. {title}" for i, (title, _) in enumerate(event.sections)), file=sys.stderr, flush=True)
+        elif event.kind == "token":
+            if part != (event.title, event.index):
+                part = (event.title, event.index)
+                print(f"\n\n## {event.title}\n", file=sys.stderr, flush=True)
+            print(event.text, end="", file=sys.stderr, flush=True)
+        elif event.kind == "restart":
+            part = (event.title, event.index)
+            print(f"\n\n[retrying]\n## {event.title}\n", file=sys.stderr, flush=True)
+        elif event.kind == "report":
+            report = event.text
+    print(file=sys.stderr)
     print(report)
+    print()
+    print(f"Page cache: {page_cache.stats()}")
+    print(f"LLM cache: {llm_cache.stats()}")
+    for call_site, stats in get_context_manager().stats().items():
+        print(f"Tokens [{call_site}]: {stats}")
+    for schema, stats in structured_stats.snapshot().items():
+        print(f"Structured [{schema}]: {stats}")
+    block_stats = block_filter.stats()
+    print(f"Block filter: {block_stats['llm_calls_saved']} of {block_stats['blocks']} note-taking calls saved")
+    print(f"Duplicates: {duplicates.stats()}")
+    speculation_stats = speculator.stats()
+    print(f"Speculation: {speculation_stats['hits']} hits, {speculation_stats['misses']} misses, {speculation_stats['seconds_saved']}s saved, {speculation_stats['wasted_pages']} pages and {speculation_stats['wasted_seconds']}s wasted")
+    print(f"Prefetch: {prefetcher.stats()}")
+    crawl_stats = crawler.stats()
+    print(f"Crawl: {crawl_stats['pages']} linked pages read, {crawl_stats['fetches']} fetches, {crawl_stats['note_calls']} note calls, {crawl_stats['robots_blocked']} blocked by robots.txt, {crawl_stats['duplicates']} duplicates skipped")
+    crawler.close()
+    speculator.close()
+    reading_stats = reading_policy.stats()
+    print(f"Early abandonment: {reading_stats['abandoned']} of {reading_stats['pages']} pages, {reading_stats['blocks_avoided']} of {reading_stats['blocks']} blocks avoided, note recall {reading_stats['note_recall']}")
+    for kind, stats in get_resilience().stats().items():
+        print(f"Resilience [{kind}]: {stats}")
+    for route, stats in router.stats().items():
+        print(f"Route [{route}]: {stats}")
+    print(tracer.summary_table())
+    tracer.close()
+    session_stats = registry.stats()
+    print(f"Session: {session_stats['searches_avoided']} searches, {session_stats['fetches_avoided']} fetches and {session_stats['llm_calls_avoided']} LLM calls avoided")
+    for usage in report_token_usage:
+        print(f"Report tokens [{usage['stage']}] {usage['section']}: {usage['input_tokens']} input, {usage['report_context_tokens']} report context")
@@ -0,0 +1,159 @@
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from relevance import (
+    tokenize
+)
+
+from context import (
+    count_tokens
+)
+
+from text_processors import (
+    is_empty_note,
+    parse_plan_and_notes,
+    parse_section_notes
+)
+
+# ---------------------------------------------------------------------------
+# Notes store — research notes as indexed passages for the report stages.
+# ---------------------------------------------------------------------------
+# Every step's {url: notes} is split into paragraphs (passages) tagged with
+# the step, the URL and the paragraph's position in that URL's notes; empty
+# ("...") paragraphs are left out. An in‑process inverted index (term →
+# {passage: term frequency}) ranks passages against a query with BM25.
+#
+# search(query, steps=…, token_budget=…) returns the best passages in rank
+# order until the budget (passage text tokens) is spent; the best one is
+# always returned. render_plan() / render_section() lay chosen passages out
+# exactly like parse_plan_and_notes() / parse_section_notes() lay out whole
+# steps. Every rendering is memoized until the next add_step().
+# ---------------------------------------------------------------------------
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+
+
+@dataclass(frozen=True)
+class Passage:
+    step: int
+    url: str
+    paragraph: int
+    text: str
+    tokens: int
+
+
+class NotesStore:
+    def __init__(self, research_plan: Optional[List[tuple[str, str]]] = None, notes: Optional[List[Dict[str, str]]] = None, k1: float = 1.5, b: float = 0.75):
+        self.research_plan = list(research_plan or [])
+        self.notes: List[Dict[str, str]] = []
+        self.passages: List[Passage] = []
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: List[int] = []
+        self._lock = threading.Lock()
+        self._rendered: Dict[tuple, str] = {}
+        self._stats = dict.fromkeys(("searches", "renders", "render_hits"), 0)
+        for step_notes in notes or []:
+            self.add_step(step_notes)
+
+    def add_step(self, step_notes: Dict[str, str]) -> int:
+        # Index the next research step's notes; returns its step index.
+        with self._lock:
+            step = len(self.notes)
+            self.notes.append(dict(step_notes))
+            for url, text in step_notes.items():
+                paragraphs = [p.strip() for p in _PARAGRAPH.split(text) if not is_empty_note(p)]
+                for paragraph, passage_text in enumerate(paragraphs):
+                    passage_id = len(self.passages)
+                    self.passages.append(Passage(step, url, paragraph, passage_text, count_tokens(passage_text)))
+                    terms = Counter(tokenize(passage_text))
+                    self._lengths.append(sum(terms.values()))
+                    for term, tf in terms.items():
+                        self._postings.setdefault(term, {})[passage_id] = tf
+            self._rendered.clear()
+        return step
+
+    def search(self, query: str, k: Optional[int] = None, token_budget: Optional[int] = None, steps: Optional[Iterable[int]] = None) -> List[Passage]:
+        # Passages matching *query* (restricted to *steps*), best first, at
+        # most *k* of them and *token_budget* tokens of passage text. With no
+        # matching term at all the passages come back in document order.
+        allowed = set(steps) if steps is not None else None
+        with self._lock:
+            self._stats["searches"] += 1
+            n = len(self.passages)
+            if not n:
+                return []
+            avg_len = sum(self._lengths) / n or 1.0
+            scores: Dict[int, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log((n - len(postings) + 0.5) / (len(postings) + 0.5) + 1.0)
+                for passage_id, tf in postings.items():
+                    if allowed is not None and self.passages[passage_id].step not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[passage_id] / avg_len)
+                    scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            if scores:
+                ranked = sorted(scores, key=lambda i: (-scores[i], i))
+            else:
+                ranked = [i for i, p in enumerate(self.passages) if allowed is None or p.step in allowed]
+            candidates = [self.passages[i] for i in ranked]
+
+        chosen: List[Passage] = []
+        spent = 0
+        for passage in candidates:
+            if k is not None and len(chosen) >= k:
+                break
+            if token_budget is not None and chosen and spent + passage.tokens > token_budget:
+                continue
+            chosen.append(passage)
+            spent += passage.tokens
+        return chosen
+
+    def _select(self, passages: List[Passage]) -> List[Dict[str, str]]:
+        # Per‑step {url: notes} holding only *passages*, in document order.
+        selected: List[Dict[str, List[Passage]]] = [{} for _ in self.notes]
+        for passage in sorted(passages, key=lambda p: (p.step, p.paragraph)):
+            selected[passage.step].setdefault(passage.url, []).append(passage)
+        return [{url: "\n\n".join(p.text for p in kept) for url, kept in step.items()} for step in selected]
+
+    def _render(self, key: tuple, build: Callable[[], str]) -> str:
+        with self._lock:
+            self._stats["renders"] += 1
+            if key in self._rendered:
+                self._stats["render_hits"] += 1
+                return self._rendered[key]
+        text = build()
+        with self._lock:
+            self._rendered[key] = text
+        return text
+
+    def plan_and_notes(self) -> str:
+        # parse_plan_and_notes() over every step.
+        return self._render(("plan",), lambda: parse_plan_and_notes(self.research_plan, self.notes))
+
+    def section_notes(self, step_indices: List[int]) -> str:
+        # parse_section_notes() for whole steps.
+        return self._render(("steps", tuple(step_indices)), lambda: parse_section_notes(step_indices, self.notes))
+
+    def render_plan(self, passages: List[Passage]) -> str:
+        # Every plan step, each with only its passages among *passages*.
+        key = ("plan", tuple(sorted((p.step, p.url, p.paragraph) for p in passages)))
+        return self._render(key, lambda: parse_plan_and_notes(self.research_plan, self._select(passages)))
+
+    def render_section(self, passages: List[Passage]) -> str:
+        # *passages* grouped by step and URL, as for a section's notes.
+        key = ("section", tuple(sorted((p.step, p.url, p.paragraph) for p in passages)))
+        steps = sorted({p.step for p in passages})
+        return self._render(key, lambda: parse_section_notes(steps, self._select(passages)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "steps": len(self.notes), "passages": len(self.passages), "terms": len(self._postings)}
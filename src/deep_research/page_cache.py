@@ -0,0 +1,167 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import urllib3
+
+# ---------------------------------------------------------------------------
+# PageCache — persistent fetch + extraction cache for extract_blocks.
+# ---------------------------------------------------------------------------
+# Rows are keyed by (url, extraction parameters) and hold the compressed raw
+# HTML, the extracted text and the outgoing hrefs, plus the validators
+# (ETag / Last‑Modified) the server sent with the page.
+#
+# • fresh hit   – younger than `ttl` seconds: no network, no HTML parsing
+# • stale entry – revalidated with a conditional GET; a 304 refreshes the
+#                 row and is served like a hit, anything else is a miss
+# • eviction    – least‑recently‑used rows go first once the stored payload
+#                 exceeds `max_bytes`
+# ---------------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key           TEXT PRIMARY KEY,
+    url           TEXT NOT NULL,
+    html          BLOB,
+    text          TEXT NOT NULL,
+    hrefs         TEXT NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    fetched_at    REAL NOT NULL,
+    accessed_at   REAL NOT NULL,
+    size          INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at);
+"""
+
+
+class PageCache:
+    def __init__(self, path: str = ".cache/pages.sqlite", ttl: float = 7 * 24 * 3600, max_bytes: int = 512 * 1024 * 1024, revalidate_timeout: float = 10.0):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.revalidate_timeout = revalidate_timeout
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._http = urllib3.PoolManager()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(url: str, params: str) -> str:
+        return f"{params}|{url}"
+
+    def get(self, url: str, params: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        # Return (text, hrefs) for a fresh or successfully revalidated entry.
+        key = self.make_key(url, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, hrefs, etag, last_modified, fetched_at FROM pages WHERE key = ?",
+                (key,)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+
+        text, hrefs, etag, last_modified, fetched_at = row
+        now = time.time()
+        if now - fetched_at > self.ttl:
+            if not (etag or last_modified) or not self._not_modified(url, etag, last_modified):
+                self._count("misses")
+                return None
+            self._count("revalidated")
+            with self._lock:
+                self._conn.execute("UPDATE pages SET fetched_at = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return text, json.loads(hrefs)
+
+    def put(self, url: str, params: str, html: Optional[str], text: str, hrefs: Dict[str, str], headers: Optional[dict] = None):
+        headers = headers or {}
+        blob = zlib.compress(html.encode("utf-8")) if html else None
+        size = len(blob or b"") + len(text.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.make_key(url, params), url, blob, text, json.dumps(hrefs),
+                 headers.get("etag"), headers.get("last-modified"), now, now, size))
+            self._evict()
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": total,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _evict(self):
+        # Caller holds the lock. Drop least‑recently‑used rows until under budget.
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM pages ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def _not_modified(self, url: str, etag: Optional[str], last_modified: Optional[str]) -> bool:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            response = self._http.request(
+                "HEAD", url, headers=headers, redirect=True, retries=False,
+                timeout=self.revalidate_timeout)
+        except urllib3.exceptions.HTTPError:
+            return False
+        return response.status == 304
+
+
+# ---------------------------------------------------------------------------
+# Process‑wide default cache used by extract_blocks (disabled until enabled).
+# ---------------------------------------------------------------------------
+
+_default_cache: Optional[PageCache] = None
+
+
+def enable_page_cache(path: str = ".cache/pages.sqlite", **kwargs) -> PageCache:
+    global _default_cache
+    _default_cache = PageCache(path, **kwargs)
+    return _default_cache
+
+
+def get_page_cache() -> Optional[PageCache]:
+    return _default_cache
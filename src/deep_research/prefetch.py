@@ -0,0 +1,207 @@
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from text_processors import (
+    extract_blocks
+)
+
+from scheduler import (
+    ContextThreadPoolExecutor
+)
+
+from tracing import (
+    span
+)
+
+# ---------------------------------------------------------------------------
+# Page prefetching — fetch and extract pages before anyone asks to read them.
+# ---------------------------------------------------------------------------
+# PagePrefetcher runs extract_blocks() for URLs that are likely to be read
+# soon on a small pool of its own and holds the (blocks, hrefs) in memory
+# until a reader take()s them or they are drop()ped. A reader that arrives
+# while its page is still downloading waits for that download instead of
+# starting another. With a page cache enabled, dropped pages stay on disk.
+# ready() lets the site choice see which candidates are dead or empty (and
+# drops them) and what the others say, before any of them is picked.
+#
+# Speculator uses it for speculative plan steps: while the plan revision call
+# is in flight, the search and page prefetch for the step currently next in
+# the plan are already running. If the revision keeps that query the work is
+# committed, otherwise it is cancelled (pages not yet started) and dropped.
+# ---------------------------------------------------------------------------
+
+Page = Tuple[List[str], Dict[str, str]]
+
+
+class PagePrefetcher:
+    def __init__(self, max_workers: int = 5):
+        self._pool = ContextThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._lock = threading.Lock()
+        self._pages: Dict[str, Future] = {}
+        self._stats = dict.fromkeys(("prefetched", "used", "waited", "dead", "dropped", "cancelled"), 0)
+
+    def prefetch(self, urls: Iterable[str]) -> List[Future]:
+        # Start fetching every URL not already held; returns their futures.
+        futures = []
+        with self._lock:
+            for url in urls:
+                if not url:
+                    continue
+                if url not in self._pages:
+                    self._pages[url] = self._pool.submit(self._fetch, url)
+                    self._stats["prefetched"] += 1
+                futures.append(self._pages[url])
+        return futures
+
+    @staticmethod
+    def _fetch(url: str) -> Page:
+        with span("prefetch"):
+            return extract_blocks(url)
+
+    def ready(self, urls: List[str], timeout: Optional[float] = None) -> Dict[str, Optional[Page]]:
+        # Wait up to *timeout* seconds for *urls*. Returns {url: page} for
+        # pages that arrived and {url: None} for failed or empty ones, which
+        # are dropped; pages still downloading are left out.
+        with self._lock:
+            futures = {url: self._pages[url] for url in urls if url in self._pages}
+        wait(list(futures.values()), timeout=timeout)
+        pages: Dict[str, Optional[Page]] = {}
+        for url, future in futures.items():
+            if not future.done():
+                continue
+            try:
+                page = future.result()
+            except Exception:
+                page = None
+            pages[url] = page if page and page[0] else None
+        dead = [url for url, page in pages.items() if page is None]
+        with self._lock:
+            for url in dead:
+                self._pages.pop(url, None)
+            self._stats["dead"] += len(dead)
+        return pages
+
+    def take(self, url: str) -> Optional[Page]:
+        # The prefetched page (waiting for it if still in flight), or None
+        # when *url* was never prefetched or its download failed.
+        with self._lock:
+            future = self._pages.pop(url, None)
+            if future is None:
+                return None
+            self._stats["used"] += 1
+            self._stats["waited"] += not future.done()
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def drop(self, urls: Iterable[str]) -> int:
+        # Forget pages nobody read; those not started yet are cancelled.
+        dropped = 0
+        with self._lock:
+            for url in urls:
+                future = self._pages.pop(url, None)
+                if future is not None:
+                    dropped += 1
+                    self._stats["cancelled"] += future.cancel()
+            self._stats["dropped"] += dropped
+        return dropped
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "held": len(self._pages)}
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Speculation:
+    # One speculative step: the query it bet on and the work started for it.
+
+    def __init__(self, query: str):
+        self.query = query
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.urls: List[str] = []
+        self.cancelled = threading.Event()
+        self.future: Optional[Future] = None
+
+
+class Speculator:
+    def __init__(self, prefetcher: Optional[PagePrefetcher] = None):
+        self.prefetcher = prefetcher or PagePrefetcher()
+        self._pool = ContextThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "seconds_saved": 0.0, "wasted_searches": 0,
+                       "wasted_pages": 0, "wasted_seconds": 0.0, "unused_pages": 0}
+        self.steps: List[dict] = []
+
+    def start(self, query: str, search: Callable[[str], List[dict]], pick_urls: Callable[[List[dict]], List[str]]) -> Speculation:
+        # Run search(query), then prefetch pick_urls(results), in the background.
+        speculation = Speculation(query)
+
+        def run() -> List[dict]:
+            with span("speculate"):
+                try:
+                    results = search(query)
+                    if not speculation.cancelled.is_set():
+                        speculation.urls = pick_urls(results)
+                        wait(self.prefetcher.prefetch(speculation.urls))
+                    return results
+                finally:
+                    speculation.finished = time.monotonic()
+
+        speculation.future = self._pool.submit(run)
+        return speculation
+
+    def resolve(self, speculation: Speculation, query: Optional[str]) -> Optional[List[dict]]:
+        # Called once the revision is back: the speculative search results
+        # when *query* is the one speculated on, else None (work discarded).
+        now = time.monotonic()
+        overlapped = min(speculation.finished or now, now) - speculation.started
+        if query == speculation.query:
+            results = speculation.future.result()
+            with self._lock:
+                self._stats["hits"] += 1
+                self._stats["seconds_saved"] += overlapped
+                self.steps.append({"query": query, "hit": True, "seconds_saved": round(overlapped, 3)})
+            return [dict(r) for r in results]
+        self.cancel(speculation)
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["wasted_searches"] += 1
+            self._stats["wasted_seconds"] += overlapped
+            self.steps.append({"query": speculation.query, "hit": False, "revised_to": query,
+                               "seconds_wasted": round(overlapped, 3)})
+        return None
+
+    def cancel(self, speculation: Speculation):
+        # Stop a speculation whose step will not run: pages already queued
+        # are cancelled now, the rest are dropped when the job ends.
+        speculation.cancelled.set()
+
+        def discard(_=None):
+            dropped = self.prefetcher.drop(speculation.urls)
+            with self._lock:
+                self._stats["wasted_pages"] += dropped
+
+        discard()
+        speculation.future.add_done_callback(discard)
+
+    def finish_step(self, speculation: Speculation):
+        # After a committed step is read: drop prefetched pages it never used.
+        unused = self.prefetcher.drop(speculation.urls)
+        with self._lock:
+            self._stats["unused_pages"] += unused
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {k: round(v, 3) if isinstance(v, float) else v for k, v in self._stats.items()}
+            stats["steps"] = [dict(step) for step in self.steps]
+        return stats
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.prefetcher.close()
@@ -84,6 +84,8 @@ Your job is to choose which website you would like to explore based on your reas
 - Output the website you want to explore with valid JSON matching the schema: {{"site": [int, str]}}
 - The **int** should be the number of the website you want to explore.
 - The **str** should be your reasoning for choosing the website. You should choose the website that will be most reliable and fruitful with information relevant to your reasoning for the search query.
+- A website marked as already read will not be read again; its earlier notes are reused. Prefer a new website unless the one already read is clearly the best source for this query.
+- A page preview gives the page's length in words and its opening text. Use it to judge what the page actually contains, not only its title and snippet.
 - Do not include any extra text
 </Important Guidelines>
 
@@ -108,6 +110,61 @@ Your job is to take notes on the text
 With all this in mind, output your notes.
 """
 
+block_note_taking_prompt = """
+We are reading from {site_url} for this reason: {step_reasoning}.
+This is a short summary of the notes taken so far:
+{running_summary}
+
+This is piece of text #{block_idx} from the site:
+{text}
+
+Your job is to take notes on the text
+
+<Instructions>
+- Take notes on information from the text that is relevant to the reasoning for exploring the website.
+- After you read this piece of text, you will not see it again, so your notes should be detailed, clear, and understandable.
+- Do not take notes that are not relevant to your reasoning for exploring the website or that are already covered by the summary.
+- Output your notes as plain text, and do not include any other text.
+- If you dont believe you should take notes on any of the text, simply output "..."
+</Instructions>
+
+With all this in mind, output your notes.
+"""
+
+note_merging_prompt = """
+We read {site_url} for this reason: {step_reasoning}.
+These are the notes taken on each piece of text from the site, in reading order:
+{block_notes}
+
+Your job is to merge these notes into a single set of notes
+
+<Instructions>
+- Keep every detail that is relevant to the reasoning for exploring the website.
+- Remove notes that repeat information already stated earlier.
+- Keep the reading order of the notes.
+- Output the merged notes as plain text, and do not include any other text.
+</Instructions>
+
+With all this in mind, output the merged notes.
+"""
+
+page_decision_prompt = """
+We are reading from {site_url} for this reason: {step_reasoning}.
+You have read {blocks_read} pieces of text from the site and {blocks_left} remain. Your notes on them are above.
+
+Your job is to decide whether the rest of the site is worth reading.
+
+<Important Guidelines>
+- Output your decision with valid JSON matching the schema: {{"decision": [int, str]}}
+- The **int** should be 1 to keep reading the site or 0 to abandon it.
+- The **str** should be your reasoning for the decision.
+- Abandon the site if what you have read is off topic or of low quality, or if the rest is unlikely to add information relevant to the reason for exploring it.
+- Do not include any extra text
+</Important Guidelines>
+
+With all this in mind, output your decision along with your reasoning.
+"""
+
 section_drafting_prompt = """
 This was the users request: {user_prompt}.
 These are my research steps and associated notes:
@@ -198,6 +255,30 @@ With all this in mind, write the section.
 
 """
 
+outline_section_writing_prompt = """
+This was the users request: {user_prompt}.
+
+Now, I want to help me write the report.
+This is the outline of my report (not including the introduction and conclusion). The other sections are being written at the same time by other writers:
+{report_outline}
+
+Your job is to write the section {section_title}, which is about this: {section_description}
+
+While writing, reference these research steps and associated notes:
+{reference_steps_and_notes}
+
+<Important Guidelines>
+- Reference the notes from the research steps when writing the section, and only add context outside the notes when you are extremely confident in your validity.
+- Include all details from the notes relevant to the section. Do not worry about the section being too long. Use as much detail and depth as needed.
+- Only focus on details/topics that are relevant to this section and that would not be better focused on in another section of the outline (although it is okay to breifly mention them for context if neccesary).
+- Write in a professional, detailed, and clear style.
+- Output the section title, followed by 2 new lines, followed by the text for the section, all as plain text. Do not include any other text.
+</Important Guidelines>
+
+With all this in mind, write the section.
+
+"""
+
 intro_writing_prompt = """
 This was the users request: {user_prompt}.
 This is the report body:
@@ -0,0 +1,105 @@
+import threading
+from typing import Callable, List, Optional
+
+from text_processors import (
+    is_empty_note
+)
+
+# ---------------------------------------------------------------------------
+# Early page abandonment — stop reading a page once it has stopped paying off.
+# ---------------------------------------------------------------------------
+# After at least `min_blocks` blocks, a page is abandoned when the last
+# `max_empty_streak` blocks all came back empty ("...") and no block left
+# scores higher than the best block already read (BM25 scores, when a
+# BlockFilter scored the page; without one every block scores 0 and only the
+# streak counts). With ask_llm=True an empty block that does not meet that
+# rule asks the model instead (ExploreDecision) whether to keep reading.
+#
+# shadow=True makes every decision but keeps reading, so the notes the
+# skipped blocks would have lost are counted before the policy is switched on.
+# ---------------------------------------------------------------------------
+
+
+class PageReading:
+    # Decisions and outcomes for one page; blocks are reported in read order.
+
+    def __init__(self, policy: "ReadingPolicy", site_url: str, scores: List[float]):
+        self.policy = policy
+        self.site_url = site_url
+        self.scores = scores
+        self.produced_notes: List[bool] = []
+        self.stop_at: Optional[int] = None
+        self.decision_calls = 0
+
+    def record(self, subnotes: str):
+        # Count a block that was read without deciding anything.
+        self.produced_notes.append(not is_empty_note(subnotes))
+
+    def after_block(self, subnotes: str, ask: Optional[Callable[[], bool]] = None) -> bool:
+        # Record the block just read; False means stop reading the page.
+        # *ask* returns the model's keep‑reading decision (ask_llm only).
+        self.record(subnotes)
+        if self.stop_at is not None:
+            return True     # shadow mode, already decided
+        if self._should_stop(ask):
+            self.stop_at = len(self.produced_notes)
+            return self.policy.shadow
+        return True
+
+    def _should_stop(self, ask: Optional[Callable[[], bool]]) -> bool:
+        read = len(self.produced_notes)
+        left = self.scores[read:]
+        if read < self.policy.min_blocks or not left or self.produced_notes[-1]:
+            return False
+        streak = read - max((i + 1 for i, noted in enumerate(self.produced_notes) if noted), default=0)
+        if streak >= self.policy.max_empty_streak and max(left) <= max(self.scores[:read]):
+            return True
+        if self.policy.ask_llm and ask is not None:
+            self.decision_calls += 1
+            return not ask()
+        return False
+
+    def finish(self):
+        self.policy._record(self)
+
+
+class ReadingPolicy:
+    def __init__(self, min_blocks: int = 2, max_empty_streak: int = 2, ask_llm: bool = False, shadow: bool = False):
+        self.min_blocks = max(1, min_blocks)
+        self.max_empty_streak = max(1, max_empty_streak)
+        self.ask_llm = ask_llm
+        self.shadow = shadow
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys((
+            "pages", "abandoned", "blocks", "blocks_read", "blocks_avoided",
+            "decision_calls", "notes", "notes_lost"), 0)
+
+    def page(self, site_url: str, scores: List[float]) -> PageReading:
+        # Start reading a page whose blocks, in read order, have *scores*.
+        return PageReading(self, site_url, scores)
+
+    def _record(self, reading: PageReading):
+        stop_at = reading.stop_at
+        with self._lock:
+            stats = self._stats
+            stats["pages"] += 1
+            stats["blocks"] += len(reading.scores)
+            stats["blocks_read"] += len(reading.produced_notes)
+            stats["decision_calls"] += reading.decision_calls
+            stats["notes"] += sum(reading.produced_notes[:stop_at])
+            if stop_at is not None:
+                stats["abandoned"] += 1
+                stats["blocks_avoided"] += len(reading.scores) - stop_at
+                # Only shadow mode reads past the stop and sees what was lost
+                stats["notes_lost"] += sum(reading.produced_notes[stop_at:])
+
+    def stats(self) -> dict:
+        # Blocks avoided, and note yield: blocks with notes among those kept,
+        # and (shadow) the share of all notes the policy would have kept.
+        with self._lock:
+            stats = dict(self._stats)
+        kept = stats["blocks"] - stats["blocks_avoided"]
+        stats["notes_per_block"] = round(stats["notes"] / kept, 3) if kept else 0.0
+        total_notes = stats["notes"] + stats["notes_lost"]
+        stats["note_recall"] = round(stats["notes"] / total_notes, 3) if total_notes else 1.0
+        return stats
@@ -0,0 +1,79 @@
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+from dedup import normalize_url
+
+# ---------------------------------------------------------------------------
+# Session registry — what this research session has already searched and read.
+# ---------------------------------------------------------------------------
+# • search results are cached by normalised query (case, whitespace and
+#   punctuation ignored; every word, digit and the word order kept), so plan
+#   revisions that re‑issue the same query do not hit the search engine
+#   again while "GPT 3" and "GPT 4" stay separate searches
+# • every explored URL is recorded with its notes and the number of LLM calls
+#   it took, so a later step that picks it again reuses the notes
+# • stats() reports the searches, fetches and LLM calls avoided
+# ---------------------------------------------------------------------------
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(_PUNCTUATION.sub(" ", query.lower()).split())
+
+
+class SessionRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._searches: Dict[str, List[dict]] = {}
+        self._pages: Dict[str, dict] = {}
+        self.searches = 0
+        self.searches_avoided = 0
+        self.fetches_avoided = 0
+        self.llm_calls_avoided = 0
+
+    def search(self, query: str, run: Callable[[str], List[dict]]) -> List[dict]:
+        # Results of *run(query)*, cached per session. Callers get their own
+        # copy since explore_step pops the results it picks.
+        key = normalize_query(query)
+        with self._lock:
+            cached = self._searches.get(key)
+            if cached is not None:
+                self.searches_avoided += 1
+        if cached is None:
+            cached = list(run(query) or [])
+            with self._lock:
+                self.searches += 1
+                self._searches.setdefault(key, cached)
+        return [dict(r) for r in cached]
+
+    def record_page(self, url: str, notes: str, llm_calls: int):
+        with self._lock:
+            self._pages.setdefault(normalize_url(url), {"url": url, "notes": notes, "llm_calls": llm_calls})
+
+    def read_urls(self, results: List[dict]) -> Set[str]:
+        # hrefs among *results* that were already explored this session.
+        with self._lock:
+            return {r.get("href", "") for r in results if normalize_url(r.get("href", "")) in self._pages}
+
+    def reuse(self, url: str) -> Optional[str]:
+        # Notes recorded for *url*, counting the fetch and LLM calls avoided.
+        with self._lock:
+            page = self._pages.get(normalize_url(url))
+            if page is None:
+                return None
+            self.fetches_avoided += 1
+            self.llm_calls_avoided += page["llm_calls"]
+            return page["notes"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "searches": self.searches,
+                "searches_avoided": self.searches_avoided,
+                "pages": len(self._pages),
+                "fetches_avoided": self.fetches_avoided,
+                "llm_calls_avoided": self.llm_calls_avoided,
+            }
@@ -1,16 +1,24 @@
-from typing import List, Dict
-from pydantic_core import ValidationError
-from crewai import LLM 
+import asyncio
+import contextvars
+import queue
+import threading
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Optional
 
 from text_processors import (
-    parse_plan_and_notes,
-    parse_section_notes
+    digest_section
+)
+
+from notes_store import (
+    NotesStore
 )
 
 from prompts import (
     section_drafting_prompt,
     reference_steps_for_sections_prompt,
     section_writing_prompt,
+    outline_section_writing_prompt,
     intro_writing_prompt,
     conclusion_writing_prompt
 )
@@ -19,127 +27,161 @@ from llm import (
     call_llm
 )
 
+from structured import (
+    structured_call
+)
+
+from context import (
+    count_tokens
+)
+
 from json_schemas import (
     Sections,
     Step_Indices
 )
 
+from scheduler import (
+    ContextThreadPoolExecutor
+)
+
+from tracing import (
+    span,
+    traced
+)
+
 # ---------------------------------------------------------------------------
-# write_report — convert plan & notes into a structured written report.
+# Report events — what write_report(on_event=…) and stream_report() deliver.
+# ---------------------------------------------------------------------------
+# "outline"       sections = [(title, description)] once the outline exists
+# "token"         text = next chunk of the part being written (title, index);
+#                 previews only: the part's own event carries the final text
+# "restart"       the part's attempt failed and is being retried: the tokens
+#                 streamed for it so far are void and it streams again
+# "section"       a finished body section: index, title, text, sources
+# "introduction"  / "conclusion"  the finished introduction / conclusion
+# "report"        text = the assembled report, exactly as write_report returns
+#
+# Body sections come before the introduction, which is written from them.
+# With section_mode="parallel" sections arrive in completion order.
 # ---------------------------------------------------------------------------
 
-def write_report(user_prompt: str, research_plan: List[tuple[str,str]], notes: List[Dict[str, str]], steps_allowed_per_section = 3):
+@dataclass
+class ReportEvent:
+    kind: str
+    text: str = ""
+    title: str = ""
+    index: Optional[int] = None
+    sources: List[str] = field(default_factory=list)
+    sections: List[tuple] = field(default_factory=list)
 
-    # Orchestrates creation of a full report from research notes.
 
-    # Step‑by‑step:
-    #  1. Ask the LLM to propose section headings.
-    #  2. For each section, request which research steps to reference.
-    #  3. Draft each section using its reference notes.
-    #  4. Generate introduction and conclusion.
-    #  5. Assemble and return the fully‑titled report as plain text.
-    
+class ReportCancelled(Exception):
+    """The consumer of stream_report() stopped reading."""
+
+# ---------------------------------------------------------------------------
+# reference_steps_for_section — which research steps a section should cite.
+# ---------------------------------------------------------------------------
+
+def reference_steps_for_section(user_prompt: str, research_steps_and_notes: str, section_titles: str, section: tuple[str, str], steps_allowed: int, token_usage: Optional[List[dict]] = None) -> List[int]:
     messages = []
-    
-    # 1) SECTION OUTLINE
-    messages.append({"role": "user", "content": section_drafting_prompt.format(
+    messages.append({"role": "user", "content": reference_steps_for_sections_prompt.format(
         user_prompt = user_prompt,
-        research_steps_and_notes = parse_plan_and_notes(research_plan, notes)
+        research_steps_and_notes = research_steps_and_notes,
+        section_titles = section_titles,
+        section_title = section[0],
+        section_description = section[1],
+        steps_allowed = steps_allowed
     )
     }
     )
-    raw_sections = call_llm(messages)
-    
-    # Validate until JSON is correct
-    while True:
-        try:
-            sections = Sections.model_validate_json(raw_sections).sections
-            messages.append({"role": "assistant", "content": raw_sections})
-            break
-        except ValidationError:
-            raw_sections = LLM(model="openai/o3-mini").call(messages=[{
-                "role": "user",
-                "content": (
-                    "Output this:\n"
-                    f"{raw_sections}\n"
-                    "correctly in the valid JSON schema: {\"sections\": [[str, str]]}\n"
-                    "Do not include any other text"
-                )
-            }])
-
-    # 2) MAP SECTIONS → RESEARCH STEPS
-    reference_steps_for_sections = []
-    for i, section in enumerate(sections):
-        messages = []
-        messages.append({"role": "user", "content": reference_steps_for_sections_prompt.format(
-            user_prompt = user_prompt,
-            research_steps_and_notes = parse_plan_and_notes(research_plan, notes),
-            section_titles = ", ".join(title[0] for title in sections),
-            section_title = section[0],
-            section_description = section[1],
-            steps_allowed = min(steps_allowed_per_section, len(research_plan))
-        )
-        }
-        )
-        raw_step_indices = call_llm(messages)
-        # Validate until JSON is correct
-        while True:
-            try:
-                step_indices = Step_Indices.model_validate_json(raw_step_indices).step_indices
-                break
-            except ValidationError:
-                raw_step_indices = LLM(model="openai/o3-mini").call(messages=[{
-                    "role": "user",
-                    "content": (
-                        "Output this:\n"
-                        f"{raw_step_indices}\n"
-                        "correctly in the valid JSON schema: {\"step_indices\": [int]}\n"
-                        "Do not include any other text"
-                    )
-                }])
-        reference_steps_for_sections.append(step_indices)
-    
-    # 3) DRAFT EACH SECTION
-    written_sections = []
-    for i, section in enumerate(sections):
-        messages = []
-        messages.append({"role": "user", "content": section_writing_prompt.format(
-            user_prompt = user_prompt,
-            section_titles = ", ".join(title[0] for title in sections),
-            current_report = "\n\n".join(written_sections),
-            section_title = section[0],
-            section_description = section[1],
-            reference_steps_and_notes = parse_section_notes(reference_steps_for_sections[i], notes)
-        )
-        }
-        )
-        written_section = call_llm(messages).strip()
-        written_sections.append(written_section)
-    
-    # 4) INTRODUCTION & CONCLUSION
-    messages = []
-    messages.append({"role": "user", "content": intro_writing_prompt.format(
+    _record_tokens(token_usage, "mapping", section[0], messages, "")
+    step_indices, _ = structured_call(messages, Step_Indices, "report")
+    return step_indices.step_indices
+
+
+def section_sources(step_indices: List[int], notes: List[Dict[str, str]]) -> List[str]:
+    # Unique URLs of the research steps a section references, sorted.
+    urls: set[str] = set()
+    for step_idx in step_indices:
+        if 0 <= step_idx < len(notes):
+            urls.update(notes[step_idx].keys())  # notes[idx] → {url: text}
+    return sorted(urls)
+
+
+def section_notes_for(user_prompt: str, store: NotesStore, section: tuple[str, str], section_titles: str, steps_allowed: int, notes_mode: str = "steps", notes_budget: int = 3000, token_usage: Optional[List[dict]] = None) -> tuple[str, List[str]]:
+    # The notes a section is written from, and the URLs it cites.
+    query = f"{section[0]} {section[1]}"
+    if notes_mode == "retrieval":
+        research_steps_and_notes = store.render_plan(store.search(query, token_budget=notes_budget))
+    else:
+        research_steps_and_notes = store.plan_and_notes()
+    step_indices = reference_steps_for_section(
+        user_prompt, research_steps_and_notes, section_titles, section, steps_allowed, token_usage)
+    if notes_mode == "retrieval":
+        passages = store.search(query, token_budget=notes_budget, steps=step_indices or None)
+        return store.render_section(passages), sorted({p.url for p in passages})
+    return store.section_notes(step_indices), section_sources(step_indices, store.notes)
+
+
+def _record_tokens(token_usage: Optional[List[dict]], stage: str, title: str, messages: list, current_report: str):
+    if token_usage is not None:
+        token_usage.append({
+            "stage": stage,
+            "section": title,
+            "input_tokens": sum(count_tokens(m["content"]) for m in messages),
+            "report_context_tokens": count_tokens(current_report),
+        })
+
+# ---------------------------------------------------------------------------
+# Report stages — one LLM call each; write_report() and the distributed
+# coordinator (workers.py) are both built from them.
+# ---------------------------------------------------------------------------
+
+def draft_outline(user_prompt: str, research_steps_and_notes: str) -> tuple[List[tuple], str]:
+    # (sections [(title, description)], raw response) for the report body.
+    messages = [{"role": "user", "content": section_drafting_prompt.format(
         user_prompt = user_prompt,
-        current_report = "\n\n".join(written_sections)
+        research_steps_and_notes = research_steps_and_notes
     )
-    }
-    )
-    introduction = call_llm(messages).strip()
-    written_sections.insert(0, introduction)
+    }]
+    outline, raw_sections = structured_call(messages, Sections, "report")
+    return [tuple(section) for section in outline.sections], raw_sections
 
-    messages = []
-    messages.append({"role": "user", "content": conclusion_writing_prompt.format(
+
+def outline_text(sections: List[tuple]) -> str:
+    return "\n".join(f"{i+1}/ {title}: {description}" for i, (title, description) in enumerate(sections))
+
+
+def draft_section_from_outline(user_prompt: str, report_outline: str, section: tuple[str, str], section_notes: str, token_usage: Optional[List[dict]] = None, on_token: Optional[Callable[[str], None]] = None, on_restart: Optional[Callable[[], None]] = None) -> str:
+    # A body section written from the outline alone (section_mode="parallel").
+    messages = [{"role": "user", "content": outline_section_writing_prompt.format(
         user_prompt = user_prompt,
-        current_report = "\n\n".join(written_sections)
+        report_outline = report_outline,
+        section_title = section[0],
+        section_description = section[1],
+        reference_steps_and_notes = section_notes
     )
-    }
+    }]
+    # No earlier section is in the prompt, only the outline
+    _record_tokens(token_usage, "section", section[0], messages, "")
+    return call_llm(messages, "report", on_token=on_token, on_restart=on_restart).strip()
+
+
+def write_closing(kind: str, user_prompt: str, current_report: str, token_usage: Optional[List[dict]] = None, on_token: Optional[Callable[[str], None]] = None, on_restart: Optional[Callable[[], None]] = None) -> str:
+    # The "introduction" or "conclusion" of the report written so far.
+    prompt = intro_writing_prompt if kind == "introduction" else conclusion_writing_prompt
+    messages = [{"role": "user", "content": prompt.format(
+        user_prompt = user_prompt,
+        current_report = current_report
     )
-    conclusion = call_llm(messages).strip()
-    written_sections.append(conclusion)
+    }]
+    _record_tokens(token_usage, kind, kind.capitalize(), messages, current_report)
+    return call_llm(messages, "report", on_token=on_token, on_restart=on_restart).strip()
 
-    # ----------------------------------------------------------
-    # 5) APPEND SOURCE URLS AFTER EACH BODY SECTION
-    # ----------------------------------------------------------
+
+def assemble_report(written_sections: List[str], sources: List[List[str]]) -> str:
+    # Introduction, body sections (each followed by its sources) and
+    # conclusion as plain text.
     sections_with_sources: list[str] = []
 
     for i, section_text in enumerate(written_sections):
@@ -147,16 +189,224 @@ def write_report(user_prompt: str, research_plan: List[tuple[str,str]], notes: L
 
         # body sections start at index 1 (0 = Intro) and end before the last
         body_idx = i - 1
-        if 0 <= body_idx < len(reference_steps_for_sections):
-            # gather unique URLs referenced by this section
-            urls: set[str] = set()
-            for step_idx in reference_steps_for_sections[body_idx]:
-                if 0 <= step_idx < len(notes):
-                    urls.update(notes[step_idx].keys())  # notes[idx] → {url: text} :contentReference[oaicite:0]{index=0}
-
-            if urls:
-                sources_block = "Sources:\n" + "\n".join(f"- {u}" for u in sorted(urls))
-                sections_with_sources.append(sources_block)
-
-    full_report = "\n\n".join(sections_with_sources)
+        if 0 <= body_idx < len(sources) and sources[body_idx]:
+            sources_block = "Sources:\n" + "\n".join(f"- {u}" for u in sources[body_idx])
+            sections_with_sources.append(sources_block)
+
+    return "\n\n".join(sections_with_sources)
+
+# ---------------------------------------------------------------------------
+# write_report — convert plan & notes into a structured written report.
+# ---------------------------------------------------------------------------
+
+@traced("write_report")
+def write_report(user_prompt: str, research_plan: List[tuple[str,str]], notes: List[Dict[str, str]], steps_allowed_per_section = 3, max_workers: int = 4, section_mode: str = "sequential", report_context: str = "full", token_usage: Optional[List[dict]] = None, on_event: Optional[Callable[[ReportEvent], None]] = None, notes_mode: str = "steps", notes_budget: int = 3000, notes_store: Optional[NotesStore] = None):
+
+    # Orchestrates creation of a full report from research notes.
+
+    # Step‑by‑step:
+    #  1. Ask the LLM to propose section headings.
+    #  2. For each section, request which research steps to reference.
+    #  3. Draft each section using its reference notes.
+    #  4. Generate introduction and conclusion.
+    #  5. Assemble and return the fully‑titled report as plain text.
+    #
+    # Stage 2 runs up to *max_workers* mapping calls at once. section_mode
+    # "sequential" drafts each section with the report so far as context;
+    # "parallel" drafts all body sections concurrently from the outline only.
+    # report_context "full" shows later stages the raw text written so far;
+    # "digest" shows a rolling digest instead (headings, key claims, defined
+    # terms), so prompt size stays flat as sections accumulate. Pass a list as
+    # *token_usage* to collect the input tokens of every writing prompt.
+    # *on_event* receives a ReportEvent for each part as soon as it exists,
+    # and the writing calls stream their tokens to it (see stream_report).
+    # notes_mode "steps" gives the mapping prompt every step's notes and each
+    # section the whole notes of its steps; "retrieval" gives both only the
+    # passages of the notes store that best match the section's title and
+    # description, at most *notes_budget* tokens of them, and cites the URLs
+    # of the passages the section was given. Pass *notes_store* to reuse an
+    # index (and its rendered notes) across reports.
+
+    store = notes_store or NotesStore(research_plan, notes)
+
+    def emit(event: ReportEvent):
+        if on_event is not None:
+            on_event(event)
+
+    def token_sink(title: str, index: Optional[int] = None) -> Optional[Callable[[str], None]]:
+        if on_event is None:
+            return None
+        return lambda chunk: on_event(ReportEvent("token", text=chunk, title=title, index=index))
+
+    def restart_sink(title: str, index: Optional[int] = None) -> Optional[Callable[[], None]]:
+        if on_event is None:
+            return None
+        return lambda: on_event(ReportEvent("restart", title=title, index=index))
+
+    # 1) SECTION OUTLINE
+    with span("report_stage", "outline"):
+        sections, _ = draft_outline(user_prompt, store.plan_and_notes())
+        emit(ReportEvent("outline", sections=list(sections)))
+
+    # 2) MAP SECTIONS → RESEARCH STEPS (independent calls, bounded concurrency)
+    with span("report_stage", "mapping"):
+        section_titles = ", ".join(title[0] for title in sections)
+        steps_allowed = min(steps_allowed_per_section, len(research_plan))
+
+        def map_section(section: tuple[str, str]) -> tuple[str, List[str]]:
+            return section_notes_for(user_prompt, store, section, section_titles, steps_allowed,
+                                     notes_mode, notes_budget, token_usage)
+
+        with ContextThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sections)))) as pool:
+            mapped = list(pool.map(map_section, sections))
+        section_notes = [notes_text for notes_text, _ in mapped]
+        sources = [urls for _, urls in mapped]
+
+    # 3) DRAFT EACH SECTION
+    with span("report_stage", "sections"):
+        digests: List[str] = []
+
+        def report_so_far() -> str:
+            if report_context == "digest":
+                return "\n\n".join(digests)
+            return "\n\n".join(written_sections)
+
+        if section_mode == "parallel":
+            # Every body section is drafted at once from the outline alone.
+            report_outline = outline_text(sections)
+
+            def draft_section(i: int) -> str:
+                return draft_section_from_outline(
+                    user_prompt, report_outline, sections[i], section_notes[i], token_usage,
+                    token_sink(sections[i][0], i), restart_sink(sections[i][0], i))
+
+            written_sections = [""] * len(sections)
+            with ContextThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sections)))) as pool:
+                futures = {pool.submit(draft_section, i): i for i in range(len(sections))}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    written_sections[i] = future.result()
+                    emit(ReportEvent("section", text=written_sections[i], title=sections[i][0], index=i, sources=sources[i]))
+            digests = [digest_section(text) for text in written_sections]
+        else:
+            # Each section sees everything written before it.
+            written_sections = []
+            for i, section in enumerate(sections):
+                current_report = report_so_far()
+                messages = []
+                messages.append({"role": "user", "content": section_writing_prompt.format(
+                    user_prompt = user_prompt,
+                    section_titles = section_titles,
+                    current_report = current_report,
+                    section_title = section[0],
+                    section_description = section[1],
+                    reference_steps_and_notes = section_notes[i]
+                )
+                }
+                )
+                _record_tokens(token_usage, "section", section[0], messages, current_report)
+                written_section = call_llm(messages, "report", on_token=token_sink(section[0], i),
+                                           on_restart=restart_sink(section[0], i)).strip()
+                written_sections.append(written_section)
+                emit(ReportEvent("section", text=written_section, title=section[0], index=i, sources=sources[i]))
+                digests.append(digest_section(written_section))
+    
+    # 4) INTRODUCTION & CONCLUSION
+    with span("report_stage", "intro_conclusion"):
+        introduction = write_closing("introduction", user_prompt, report_so_far(), token_usage,
+                                     token_sink("Introduction"), restart_sink("Introduction"))
+        written_sections.insert(0, introduction)
+        emit(ReportEvent("introduction", text=introduction, title="Introduction"))
+        digests.insert(0, digest_section(introduction))
+
+        conclusion = write_closing("conclusion", user_prompt, report_so_far(), token_usage,
+                                   token_sink("Conclusion"), restart_sink("Conclusion"))
+        written_sections.append(conclusion)
+        emit(ReportEvent("conclusion", text=conclusion, title="Conclusion"))
+
+    # ----------------------------------------------------------
+    # 5) APPEND SOURCE URLS AFTER EACH BODY SECTION
+    # ----------------------------------------------------------
+    with span("report_stage", "sources"):
+        full_report = assemble_report(written_sections, sources)
+    emit(ReportEvent("report", text=full_report))
     return full_report
+
+# ---------------------------------------------------------------------------
+# stream_report / astream_report — the same report, delivered as it is written.
+# ---------------------------------------------------------------------------
+
+_DONE = object()
+
+
+def _start_writer(user_prompt: str, research_plan: List[tuple[str,str]], notes: List[Dict[str, str]], put: Callable[[object], None], kwargs: dict) -> threading.Event:
+    # Run write_report on a daemon thread, handing put() each event, then the
+    # error if one is raised, then _DONE. Returns the flag that cancels the
+    # writer: once it is set, the writer stops at its next event. A daemon
+    # thread rather than a pool, so nothing waits for the writer's in‑flight
+    # LLM call once the consumer has gone.
+    closed = threading.Event()
+
+    def on_event(event: ReportEvent):
+        if closed.is_set():
+            raise ReportCancelled()
+        put(event)
+
+    def produce():
+        try:
+            write_report(user_prompt, research_plan, notes, on_event=on_event, **kwargs)
+        except ReportCancelled:
+            pass
+        except BaseException as err:
+            put(err)
+        finally:
+            put(_DONE)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), name="stream_report", daemon=True).start()
+    return closed
+
+
+def stream_report(user_prompt: str, research_plan: List[tuple[str,str]], notes: List[Dict[str, str]], **kwargs) -> Iterator[ReportEvent]:
+    # Yield write_report's events (outline, tokens, sections, introduction,
+    # conclusion, report) while it runs on a worker thread; keyword arguments
+    # are passed through. Errors are re‑raised here. Closing the iterator
+    # early returns at once; the writer stops at its next event in the
+    # background.
+    events: "queue.Queue" = queue.Queue()
+    closed = _start_writer(user_prompt, research_plan, notes, events.put, kwargs)
+    try:
+        while True:
+            item = events.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        closed.set()
+
+
+async def astream_report(user_prompt: str, research_plan: List[tuple[str,str]], notes: List[Dict[str, str]], **kwargs) -> AsyncIterator[ReportEvent]:
+    # Async iterator over the same events. The writer hands them to the
+    # event loop, so no thread waits on the consumer's behalf and closing or
+    # cancelling the consumer only sets the writer's cancel flag.
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue" = asyncio.Queue()
+
+    def put(item: object):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, item)
+        except RuntimeError:
+            pass   # the loop is closed: nobody is listening any more
+
+    closed = _start_writer(user_prompt, research_plan, notes, put, kwargs)
+    try:
+        while True:
+            item = await events.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        closed.set()
@@ -1,17 +1,22 @@
-from typing import List, Dict
-from pydantic_core import ValidationError
-from crewai import LLM 
+from typing import Callable, List, Dict, Optional
+from contextlib import nullcontext
+from concurrent.futures import as_completed
 from ddgs import DDGS                       # DuckDuckGo Search (Google backend)
+from ddgs.exceptions import DDGSException
 
 from json_schemas import (
+    ExploreDecision,
     ResearchPlan,
     Site
 )
 
 from text_processors import(
     extract_blocks,
+    is_empty_note,
+    page_preview,
     parse_notes,
-    parse_search_results
+    parse_search_results,
+    summarize_notes
 )
 
 from prompts import (
@@ -19,22 +24,106 @@ from prompts import (
     successive_research_plan_prompt,
     website_choosing_prompt,
     note_taking_prompt,
+    block_note_taking_prompt,
+    note_merging_prompt,
+    page_decision_prompt
 )
 
 from llm import (
     call_llm
 )
 
+from structured import (
+    structured_call
+)
+
+from relevance import (
+    BlockFilter
+)
+
+from dedup import (
+    DuplicateIndex
+)
+
+from registry import (
+    SessionRegistry
+)
+
+from reading import (
+    ReadingPolicy
+)
+
+from prefetch import (
+    PagePrefetcher,
+    Speculator
+)
+
+from crawler import (
+    LinkCrawler
+)
+
+from checkpoint import (
+    load_checkpoint,
+    save_checkpoint
+)
+
+from scheduler import (
+    ContextThreadPoolExecutor,
+    get_scheduler
+)
+
+from resilience import (
+    CircuitOpenError,
+    DeadlineExceeded,
+    get_resilience
+)
+
+from tracing import (
+    annotate_span,
+    span,
+    traced
+)
+
+SEARCH_TIMEOUT = 10   # seconds per search attempt
+
+# Search client factory: called as factory(timeout=…) and must return an object
+# with DDGS's .text(query, backend=…, max_results=…) method.
+_search_backend: Callable = DDGS
+
+
+def set_search_backend(factory: Callable) -> Callable:
+    # Swap the search client (e.g. canned results for benchmarks); returns
+    # the previous factory so it can be restored.
+    global _search_backend
+    previous, _search_backend = _search_backend, factory
+    return previous
+
 # ---------------------------------------------------------------------------
 # explore_page — interactive per‑URL reading loop.
 # ---------------------------------------------------------------------------
 
-def explore_page(explore_messages: list, site_url: str, step_reasoning: str):
+@traced("explore_page")
+def explore_page(explore_messages: list, site_url: str, step_reasoning: str, step_query: str = "", block_filter: Optional[BlockFilter] = None, duplicates: Optional[DuplicateIndex] = None, registry: Optional[SessionRegistry] = None, reading_policy: Optional[ReadingPolicy] = None, prefetcher: Optional[PagePrefetcher] = None, max_blocks: Optional[int] = None):
     # Interactively read *site_url* block‑by‑block asking the LLM for notes.
+    # With a *block_filter*, only blocks lexically relevant to the step are read.
+    # With *duplicates*, copies of pages/blocks already read are skipped.
+    # With a *registry*, the page's notes are recorded for reuse by later steps.
+    # With a *reading_policy*, a page that stops yielding notes is abandoned.
+    # With a *prefetcher*, a page it already downloaded is not fetched again.
+    # With *max_blocks*, at most that many blocks (the best scoring) are read.
 
+    annotate_span(url=site_url, mode="serial")
     notes = ""
-    blocks, hrefs = extract_blocks(site_url)
-    for block_idx, text in enumerate(blocks):
+    blocks, hrefs, duplicate_of = fetch_unread(site_url, duplicates, prefetcher)
+    if duplicate_of:
+        return explore_messages, duplicate_note(duplicate_of), hrefs
+    selected, scores = filter_blocks(block_filter, site_url, blocks, step_query, step_reasoning, duplicates)
+    if max_blocks is not None and len(selected) > max_blocks:
+        selected = sorted(sorted(selected, key=lambda i: -scores[i])[:max(0, max_blocks)])
+    reading = reading_policy.page(site_url, [scores[i] for i in selected]) if reading_policy is not None else None
+    llm_calls = 0
+    for n, block_idx in enumerate(selected):
+        text = blocks[block_idx]
         # Ask the LLM whether to take notes on this block.
         explore_messages.append(
             {"role": "user", "content": note_taking_prompt.format(
@@ -44,13 +133,277 @@ def explore_page(explore_messages: list, site_url: str, step_reasoning: str):
                 text = text)
             }
         )
-        subnotes = call_llm(explore_messages).strip()
+        subnotes = call_llm(explore_messages, "notes").strip()
+        llm_calls += 1
         explore_messages.append({"role": "assistant", "content": subnotes})
         notes = notes + "\n\n" + subnotes
+        if block_filter is not None:
+            block_filter.record_outcome(site_url, step_query, block_idx, scores[block_idx], not is_empty_note(subnotes))
+        if reading is not None:
+            calls_before = reading.decision_calls
+            keep = reading.after_block(subnotes, lambda: keep_reading(
+                explore_messages, site_url, step_reasoning, n + 1, len(selected) - n - 1))
+            llm_calls += reading.decision_calls - calls_before
+            if not keep:
+                annotate_span(abandoned_after=n + 1)
+                break
+    if reading is not None:
+        reading.finish()
+    if registry is not None:
+        registry.record_page(site_url, notes, llm_calls)
     return explore_messages, notes, hrefs
 
+
+def keep_reading(explore_messages: list, site_url: str, step_reasoning: str, blocks_read: int, blocks_left: int) -> bool:
+    # Ask the model (ExploreDecision) whether the rest of the page is worth
+    # reading; the question is not kept in the page's conversation.
+    decision, _ = structured_call(explore_messages + [
+        {"role": "user", "content": page_decision_prompt.format(
+            site_url = site_url,
+            step_reasoning = step_reasoning,
+            blocks_read = blocks_read,
+            blocks_left = blocks_left)
+        }
+    ], ExploreDecision, "page_decision")
+    return decision.decision[0] != 0
+
+
+def fetch_unread(site_url: str, duplicates: Optional[DuplicateIndex] = None, prefetcher: Optional[PagePrefetcher] = None):
+    # (blocks, hrefs, URL of an already‑read copy or None). A URL redirecting to
+    # a page already claimed this session is not fetched at all, and its
+    # prefetched download is dropped.
+    if duplicates is not None:
+        same_url = duplicates.claim_url(site_url)
+        if same_url:
+            if prefetcher is not None:
+                prefetcher.drop([site_url])
+            return [], {}, same_url
+    page = prefetcher.take(site_url) if prefetcher is not None else None
+    blocks, hrefs = page if page is not None else extract_blocks(site_url)
+    if duplicates is None:
+        return blocks, hrefs, None
+    return blocks, hrefs, duplicates.claim_page(site_url, blocks)
+
+
+def duplicate_note(duplicate_of: str) -> str:
+    return f"\n\n(Near‑duplicate of {duplicate_of}; see the notes taken there.)"
+
+
+def filter_blocks(block_filter: Optional[BlockFilter], site_url: str, blocks: List[str], step_query: str, step_reasoning: str, duplicates: Optional[DuplicateIndex] = None):
+    # (indices of blocks to read, BM25 score per block); everything when unfiltered.
+    if block_filter is None:
+        selected, scores = list(range(len(blocks))), [0.0] * len(blocks)
+    else:
+        selected, scores = block_filter.select(site_url, blocks, f"{step_query} {step_reasoning}")
+    if duplicates is not None:
+        # Blocks already read on another page (syndicated copies) are dropped.
+        selected = [i for i in selected if duplicates.claim_block(site_url, i, blocks[i]) is None]
+    return selected, scores
+
 # ---------------------------------------------------------------------------
-# research() — master controller for plan generation + execution (recursive).
+# explore_page_mapreduce — every block in parallel, then one merge pass.
+# ---------------------------------------------------------------------------
+
+@traced("explore_page")
+def explore_page_mapreduce(explore_messages: list, site_url: str, step_reasoning: str, running_summary: str = "", max_workers: int = 4, step_query: str = "", block_filter: Optional[BlockFilter] = None, duplicates: Optional[DuplicateIndex] = None, registry: Optional[SessionRegistry] = None, reading_policy: Optional[ReadingPolicy] = None, prefetcher: Optional[PagePrefetcher] = None):
+    # Map: each block gets only the system prompt plus a compact prefix
+    # (step reasoning + running summary), so input tokens grow linearly with
+    # page length and no block waits for the one before it.
+    # Reduce: one cheap call merges the non‑empty block notes in order.
+    # With a *reading_policy* the first min_blocks blocks are mapped first and
+    # the rest only if the policy keeps the page (no ExploreDecision calls).
+
+    annotate_span(url=site_url, mode="mapreduce")
+    blocks, hrefs, duplicate_of = fetch_unread(site_url, duplicates, prefetcher)
+    if duplicate_of:
+        return explore_messages, duplicate_note(duplicate_of), hrefs
+    selected, scores = filter_blocks(block_filter, site_url, blocks, step_query, step_reasoning, duplicates)
+    if not selected:
+        return explore_messages, "", hrefs
+
+    prefix = [m for m in explore_messages[:1] if m["role"] == "system"]
+
+    def take_block_notes(block_idx: int, text: str) -> str:
+        return call_llm(prefix + [
+            {"role": "user", "content": block_note_taking_prompt.format(
+                site_url = site_url,
+                step_reasoning = step_reasoning,
+                running_summary = running_summary or "(no notes yet)",
+                block_idx = block_idx,
+                text = text)
+            }
+        ], "notes").strip()
+
+    with ContextThreadPoolExecutor(max_workers=max(1, min(max_workers, len(selected)))) as pool:
+        if reading_policy is None:
+            block_notes = list(pool.map(take_block_notes, selected, [blocks[i] for i in selected]))
+        else:
+            reading = reading_policy.page(site_url, [scores[i] for i in selected])
+            first, rest = selected[:reading_policy.min_blocks], selected[reading_policy.min_blocks:]
+            block_notes = list(pool.map(take_block_notes, first, [blocks[i] for i in first]))
+            keep = all([reading.after_block(subnotes) for subnotes in block_notes])
+            if keep:
+                rest_notes = list(pool.map(take_block_notes, rest, [blocks[i] for i in rest]))
+                for subnotes in rest_notes:
+                    reading.record(subnotes)
+                block_notes += rest_notes
+            else:
+                annotate_span(abandoned_after=len(first))
+                selected = first
+            reading.finish()
+    if block_filter is not None:
+        for block_idx, subnotes in zip(selected, block_notes):
+            block_filter.record_outcome(site_url, step_query, block_idx, scores[block_idx], not is_empty_note(subnotes))
+
+    kept = [n for n in block_notes if not is_empty_note(n)]
+    notes = ("\n\n" + kept[0]) if kept else ""
+    if len(kept) > 1:
+        notes = "\n\n" + call_llm([
+            {"role": "user", "content": note_merging_prompt.format(
+                site_url = site_url,
+                step_reasoning = step_reasoning,
+                block_notes = "\n\n".join(f"Piece #{i}:\n{n}" for i, n in enumerate(kept)))
+            }
+        ], "notes").strip()
+    if registry is not None:
+        registry.record_page(site_url, notes, len(selected) + (len(kept) > 1))
+    return explore_messages, notes, hrefs
+
+# ---------------------------------------------------------------------------
+# choose_site / explore_step — pick every site for a step, then read in parallel.
+# ---------------------------------------------------------------------------
+
+@traced("site_choice")
+def choose_site(messages: list, step: tuple[str, str], results: list[dict], already_read: Optional[set] = None, previews: Optional[Dict[str, str]] = None):
+    # Ask the LLM which of the remaining *results* to read; returns the
+    # conversation used for the choice and the 0‑based index of the pick.
+    # Results in *already_read* are marked so the LLM can skip or reuse them;
+    # *previews* show the start and length of prefetched pages.
+
+    explore_messages = messages.copy()
+    explore_messages.append(
+        {"role": "user", "content": website_choosing_prompt.format(
+            search_query = step[0],
+            query_reasoning = step[1],
+            website_results = parse_search_results(results, already_read, previews)
+        )
+        }
+    )
+    site, raw_site_idx = structured_call(explore_messages, Site, "site_choice")
+    explore_messages.append({"role": "assistant", "content": raw_site_idx})
+    site_idx = site.site[0] - 1
+    # Out‑of‑range picks fall back to the top remaining result
+    if not 0 <= site_idx < len(results):
+        site_idx = 0
+    return explore_messages, site_idx
+
+
+def pick_sites(messages: list, step: tuple[str, str], results: list[dict], search_depth: int, registry: Optional[SessionRegistry] = None, previews: Optional[Dict[str, str]] = None):
+    # Choose up to *search_depth* sites for *step*. Returns the picks as
+    # [(conversation used for the choice, url)] and {url: notes} for picks
+    # already read in an earlier step (only with a *registry*).
+
+    # Site choices stay sequential: each pick removes a result from the list
+    # the next choice is made from. They are cheap next to reading a page.
+    picks = []
+    reused: Dict[str, str] = {}
+    for _ in range(min(search_depth, len(results))):
+        already_read = registry.read_urls(results) if registry is not None else None
+        explore_messages, site_idx = choose_site(messages, step, results, already_read, previews)
+        site_url = results.pop(site_idx).get("href", "")
+        if already_read and site_url in already_read:
+            reused[site_url] = registry.reuse(site_url)
+        picks.append((explore_messages, site_url))
+    return picks, reused
+
+
+def read_sites(picks: list, done: Dict[str, str], step: tuple[str, str], max_workers: int = 3, note_mode: str = "serial", running_summary: str = "", block_filter: Optional[BlockFilter] = None, duplicates: Optional[DuplicateIndex] = None, registry: Optional[SessionRegistry] = None, on_site: Optional[Callable[[str, str], None]] = None, reading_policy: Optional[ReadingPolicy] = None, prefetcher: Optional[PagePrefetcher] = None, on_links: Optional[Callable[[str, Dict[str, str]], None]] = None) -> Dict[str, str]:
+    # Read every pick not already in *done* concurrently and return {url: notes}
+    # in pick order. *on_site(url, notes)* runs on the calling thread as each
+    # site finishes (used for per‑site checkpoints); *on_links(url, hrefs)*
+    # then receives the page's outgoing links (used to seed the crawler).
+
+    to_read = [(m, url) for m, url in picks if url not in done]
+    notes = dict(done)
+    if to_read:
+        # Step latency tracks the slowest site instead of the sum of all sites.
+        with ContextThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_read)))) as pool:
+            if note_mode == "mapreduce":
+                futures = {pool.submit(explore_page_mapreduce, explore_messages, site_url, step[1], running_summary,
+                                       step_query=step[0], block_filter=block_filter, duplicates=duplicates,
+                                       registry=registry, reading_policy=reading_policy, prefetcher=prefetcher): site_url
+                           for explore_messages, site_url in to_read}
+            else:
+                futures = {pool.submit(explore_page, explore_messages, site_url, step[1], step[0],
+                                       block_filter, duplicates, registry, reading_policy, prefetcher): site_url
+                           for explore_messages, site_url in to_read}
+            for future in as_completed(futures):
+                site_url = futures[future]
+                _, notes[site_url], hrefs = future.result()
+                if on_site is not None:
+                    on_site(site_url, notes[site_url])
+                if on_links is not None and hrefs:
+                    on_links(site_url, hrefs)
+    # Merge in pick order so notes are deterministic regardless of timing
+    return {url: notes[url] for _, url in picks}
+
+
+def explore_step(messages: list, step: tuple[str, str], results: list[dict], search_depth: int, max_workers: int = 3, note_mode: str = "serial", running_summary: str = "", block_filter: Optional[BlockFilter] = None, duplicates: Optional[DuplicateIndex] = None, registry: Optional[SessionRegistry] = None, reading_policy: Optional[ReadingPolicy] = None, prefetcher: Optional[PagePrefetcher] = None) -> Dict[str, str]:
+    # Choose up to *search_depth* sites for *step*, read them concurrently and
+    # return {url: notes} in the order the sites were chosen.
+    # note_mode: "serial" (one growing conversation per page) or "mapreduce".
+    # block_filter: optional lexical pre‑filter applied to every page.
+    # duplicates: optional session‑wide index of pages/blocks already read.
+    # registry: optional session registry; picks read in an earlier step
+    # reuse their recorded notes instead of being fetched again.
+    # reading_policy: optional ReadingPolicy that abandons unproductive pages.
+    # prefetcher: optional PagePrefetcher holding pages downloaded ahead of time.
+    picks, reused = pick_sites(messages, step, results, search_depth, registry)
+    return read_sites(picks, reused, step, max_workers, note_mode, running_summary, block_filter, duplicates, registry,
+                      reading_policy=reading_policy, prefetcher=prefetcher)
+
+
+PREVIEW_TIMEOUT = 2    # seconds the site choice waits for prefetched pages
+
+
+@traced("preview_results")
+def preview_results(results: list[dict], prefetcher: PagePrefetcher, registry: Optional[SessionRegistry] = None):
+    # Start downloading every result not read yet as soon as the search is
+    # back. Returns the results without dead or empty pages, a preview per
+    # page that arrived within PREVIEW_TIMEOUT, and the URLs prefetched.
+    # The wait is short so one slow server does not hold up the step: pages
+    # still downloading stay in the results, marked as pending, and keep
+    # downloading for the sites that are picked.
+    already_read = registry.read_urls(results) if registry is not None else set()
+    urls = [r.get("href", "") for r in results if r.get("href") and r.get("href") not in already_read]
+    prefetcher.prefetch(urls)
+    pages = prefetcher.ready(urls, PREVIEW_TIMEOUT)
+    kept = [r for r in results if pages.get(r.get("href", ""), ()) is not None]
+    previews = {url: page_preview(page[0]) for url, page in pages.items() if page is not None}
+    return kept, previews, urls
+
+
+@traced("search")
+def search(query: str, registry: Optional[SessionRegistry] = None) -> list[dict]:
+    # DuckDuckGo search with Google backend, first 5 results; memoised per
+    # session by normalised query when a *registry* is given. Rate limits and
+    # timeouts are retried; a search that still fails yields no results (and
+    # is not memoised) rather than ending the run.
+    def once(q: str) -> list[dict]:
+        scheduler = get_scheduler()
+        with scheduler.search_slot() if scheduler is not None else nullcontext():
+            return _search_backend(timeout=SEARCH_TIMEOUT).text(q, backend="google", max_results=5)
+
+    def run(q: str) -> list[dict]:
+        return get_resilience().call("search", "ddgs", once, q)
+
+    try:
+        return registry.search(query, run) if registry is not None else run(query)
+    except (DDGSException, CircuitOpenError, DeadlineExceeded):
+        return []
+
+# ---------------------------------------------------------------------------
+# research() — master controller for plan generation + execution.
 # ---------------------------------------------------------------------------
 # Signature legend:
 # • plan_depth   – maximum number of research steps the user will allow
@@ -59,109 +412,166 @@ def explore_page(explore_messages: list, site_url: str, step_reasoning: str):
 # • research_plan – list[ (query:str, reasoning:str) ] generated/updated by LLM
 # • notes        – list[ {url:str → extract:str} ] collected for each step
 # • plan_idx     – index of the current step being executed (0‑based)
+# • max_workers  – cap on the number of sites read concurrently per step
+# • note_mode    – "serial" block‑by‑block conversation or "mapreduce"
+# • block_filter – optional BlockFilter that skips lexically irrelevant blocks
+# • duplicates   – optional DuplicateIndex shared by every step of the session
+# • registry     – optional SessionRegistry: cached searches, pages already read
+# • checkpoint_path – optional JSON file written after every step and site;
+#                  when it holds an unfinished run, the run resumes from it
+#                  (ValueError if that run had another prompt, plan_depth,
+#                  search_depth or note_mode)
+# • reading_policy – optional ReadingPolicy that abandons pages early
+# • speculator   – optional Speculator: while a plan revision is in flight,
+#                  search and prefetch the step that is next in the current
+#                  plan; kept if the revision keeps that query
+# • prefetcher   – optional PagePrefetcher: every search result is downloaded
+#                  as soon as the search is back, dead pages are dropped and
+#                  the site choice sees a preview of the others (share it with
+#                  the speculator)
+# • crawler      – optional LinkCrawler: after a step's picks are read, the
+#                  best links found on them are followed and read too, within
+#                  the crawler's per‑step fetch and note‑call budgets
+#
+# The inputs are copied, never mutated, and all run state lives in locals, so
+# several research() calls can share one process. The block filter, duplicate
+# index, registry, reading policy, speculator and crawler are not
+# checkpointed; a resumed run starts them afresh, and a step resumed after
+# its picks were read is not crawled.
 # ---------------------------------------------------------------------------
 
-def research(user_prompt: str, plan_depth: int, search_depth: int, messages = [], research_plan: List[tuple[str,str]] = [], notes: List[Dict[str, str]] = [], plan_idx = 0):
-    # Generate (or continue) a research plan and execute step *plan_idx*.
-
-    # If no plan exists *or* we still have un‑executed steps, keep working.
-    if len(research_plan) == 0 or plan_idx < len(research_plan):
-        # 1. initial plan generation
-        if len(research_plan) == 0:
-            # Ask the LLM to create a step‑by‑step research plan
-            messages.append(
-                {"role": "user", "content": initial_research_plan_prompt.format(user_prompt = user_prompt)})
-            raw_plan = call_llm(messages)
-            while True:
-                try:
-                    research_plan = ResearchPlan.model_validate_json(raw_plan).plan
-                    messages.append({"role": "assistant", "content": raw_plan})
-                    break
-                except ValidationError:
-                    raw_plan = LLM(model="openai/o3-mini").call(messages=[{
-                        "role": "user",
-                        "content": (
-                            "Output this:\n"
-                            f"{raw_plan}\n"
-                            "correctly in the valid JSON schema: {\"plan\": [[str, str]]}\n"
-                            "Do not include any other text"
-                        )
-                    }])
-        # 2. optional plan revision
-        else:
-            # Supply the LLM with context about the previous step’s results
-            messages.append(
-                {"role": "user", "content": successive_research_plan_prompt.format(
-                    user_prompt = user_prompt,
-                    previous_query = research_plan[plan_idx - 1][0],
-                    query_reasoning=research_plan[plan_idx - 1][1],
-                    notes=parse_notes(notes[plan_idx - 1]),
-                    rest_of_plan=research_plan[plan_idx:],
-                    steps_left=min(plan_depth - plan_idx, 5)
-                )
-                }
-            )
-            raw_new_plan = call_llm(messages)
-            # Keep requesting fixes until the JSON validates
-            while True:
-                try:
-                    new_plan = ResearchPlan.model_validate_json(raw_new_plan).plan
-                    messages.append({"role": "assistant", "content": raw_new_plan})
+@traced("research")
+def research(user_prompt: str, plan_depth: int, search_depth: int, messages: Optional[list] = None, research_plan: Optional[List[tuple[str,str]]] = None, notes: Optional[List[Dict[str, str]]] = None, plan_idx = 0, max_workers: int = 3, note_mode: str = "serial", block_filter: Optional[BlockFilter] = None, duplicates: Optional[DuplicateIndex] = None, registry: Optional[SessionRegistry] = None, checkpoint_path: Optional[str] = None, reading_policy: Optional[ReadingPolicy] = None, speculator: Optional[Speculator] = None, prefetcher: Optional[PagePrefetcher] = None, crawler: Optional[LinkCrawler] = None):
+    # Generate (or continue) a research plan and execute it step by step.
+
+    messages = list(messages or [])
+    research_plan = list(research_plan or [])
+    notes = [dict(step_notes) for step_notes in notes or []]
+    # In‑progress step: {"picks": [[choice messages, url]], "done": {url: notes}}
+    step_state = None
+
+    settings = {"plan_depth": plan_depth, "search_depth": search_depth, "note_mode": note_mode}
+    state = load_checkpoint(checkpoint_path) if checkpoint_path else None
+    if state is not None:
+        if state["user_prompt"] != user_prompt:
+            raise ValueError(f"checkpoint {checkpoint_path} belongs to a different prompt")
+        if state["settings"] != settings:
+            raise ValueError(f"checkpoint {checkpoint_path} was written with {state['settings']}, not {settings}")
+        messages, research_plan, notes = state["messages"], state["research_plan"], state["notes"]
+        plan_idx, step_state = state["plan_idx"], state["step"]
+
+    def save(complete: bool = False):
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, {
+                "user_prompt": user_prompt,
+                "settings": settings,
+                "messages": messages,
+                "research_plan": research_plan,
+                "notes": notes,
+                "plan_idx": plan_idx,
+                "step": step_state,
+                "complete": complete,
+            })
+
+    def prefetch_urls(results: list[dict]) -> List[str]:
+        # The pages a step is most likely to read: the top `search_depth`
+        # results not already read this session.
+        already_read = registry.read_urls(results) if registry is not None else set()
+        return [r.get("href", "") for r in results[:search_depth] if r.get("href", "") not in already_read]
+
+    # Keep working while no plan exists *or* there are un‑executed steps.
+    while len(research_plan) == 0 or plan_idx < len(research_plan):
+        speculation = None
+        prefetched: List[str] = []
+        if step_state is None:
+            results = None
+            # 1. initial plan generation
+            if len(research_plan) == 0:
+                # Ask the LLM to create a step‑by‑step research plan
+                messages.append(
+                    {"role": "user", "content": initial_research_plan_prompt.format(user_prompt = user_prompt)})
+                with span("plan"):
+                    plan, raw_plan = structured_call(messages, ResearchPlan, "plan")
+                research_plan = list(plan.plan)
+                messages.append({"role": "assistant", "content": raw_plan})
+                if not research_plan:
                     break
-                except ValidationError:
-                    raw_new_plan = LLM(model="openai/o3-mini").call(messages=[{
-                        "role": "user",
-                        "content": (
-                            "Output this:\n"
-                            f"{raw_new_plan}\n"
-                            "correctly in the valid JSON schema: {\"plan\": [[str, str]]}\n"
-                            "Do not include any other text"
-                        )
-                    }])
-                
-            research_plan = research_plan[0:plan_idx] + new_plan
-        
-        notes.append({})   # Prepare an empty dict to store this step’s notes
-
-        # Run a DuckDuckGo search with Google backend and capture the first 5 results
-        results = DDGS().text(research_plan[plan_idx][0], backend="google", max_results=5)
-
-        # Explore up to `search_depth` URLs chosen by the LLM
-        for _ in range(search_depth):
-            explore_messages = messages.copy()
-            explore_messages.append(
-                {"role": "user", "content": website_choosing_prompt.format(
-                    search_query = research_plan[plan_idx][0],
-                    query_reasoning=research_plan[plan_idx][1],
-                    website_results=parse_search_results(results)
+            # 2. optional plan revision
+            elif plan_idx > 0:
+                # Most revisions keep the next query: start its search and page
+                # downloads now, while the revision call is in flight.
+                if speculator is not None:
+                    speculation = speculator.start(
+                        research_plan[plan_idx][0], lambda q: search(q, registry), prefetch_urls)
+                # Supply the LLM with context about the previous step’s results
+                messages.append(
+                    {"role": "user", "content": successive_research_plan_prompt.format(
+                        user_prompt = user_prompt,
+                        previous_query = research_plan[plan_idx - 1][0],
+                        query_reasoning=research_plan[plan_idx - 1][1],
+                        notes=parse_notes(notes[plan_idx - 1]),
+                        rest_of_plan=research_plan[plan_idx:],
+                        steps_left=min(plan_depth - plan_idx, 5)
+                    )
+                    }
                 )
-                }
-            )
-            raw_site_idx = call_llm(explore_messages)
-            # Validate until JSON is correct
-            while True:
-                try:
-                    site_idx = Site.model_validate_json(raw_site_idx).site[0] - 1
-                    explore_messages.append({"role": "assistant", "content": raw_site_idx})
+                with span("plan"):
+                    plan, raw_new_plan = structured_call(messages, ResearchPlan, "plan")
+                messages.append({"role": "assistant", "content": raw_new_plan})
+                research_plan = research_plan[0:plan_idx] + list(plan.plan)
+                # The revision may end the plan here
+                if plan_idx >= len(research_plan):
+                    if speculation is not None:
+                        speculator.resolve(speculation, None)
                     break
-                except ValidationError:
-                    raw_site_idx = LLM(model="openai/o3-mini").call(messages=[{
-                        "role": "user",
-                        "content": (
-                            "Output this:\n"
-                            f"{raw_new_plan}\n"
-                            "correctly in the valid JSON schema: {\"site\": [int, str]}\n"
-                            "Do not include any other text"
-                        )
-                    }])
-            explore_messages.append({"role": "assistant", "content": raw_site_idx})
-            # Retrieve the selected URL, remove it from further consideration,
-            # and extract the page’s content into notes[plan_idx]
-            site_idx = Site.model_validate_json(raw_site_idx).site[0] - 1
-            site_url = results[site_idx].get("href", "")
-            results.pop(site_idx)
-            _, notes[plan_idx][site_url], _ = explore_page(explore_messages, site_url, research_plan[plan_idx][1])
-        # Recurse to the next step
-        return research(user_prompt, plan_depth, search_depth, messages, research_plan, notes, plan_idx + 1)
-    # All steps complete – return final plan & notes
+                if speculation is not None:
+                    results = speculator.resolve(speculation, research_plan[plan_idx][0])
+                    if results is None:
+                        speculation = None
+
+            # Run a DuckDuckGo search with Google backend and capture the first 5 results
+            if results is None:
+                results = search(research_plan[plan_idx][0], registry)
+            previews = None
+            if prefetcher is not None:
+                results, previews, prefetched = preview_results(results, prefetcher, registry)
+            # Choose up to `search_depth` URLs up front, then read them concurrently
+            picks, reused = pick_sites(messages, research_plan[plan_idx], results, search_depth, registry, previews)
+            step_state = {"picks": [[m[len(messages):], url] for m, url in picks], "done": reused}
+            save()
+
+        notes = notes[:plan_idx] + [{}]   # This step’s notes, filled in below
+        picks = [(messages + choice, url) for choice, url in step_state["picks"]]
+
+        def on_site(site_url: str, site_notes: str):
+            step_state["done"][site_url] = site_notes
+            save()
+
+        links: Dict[str, Dict[str, str]] = {}
+        notes[plan_idx] = read_sites(
+            picks, step_state["done"], research_plan[plan_idx], max_workers, note_mode,
+            summarize_notes(notes[:plan_idx]), block_filter, duplicates, registry, on_site, reading_policy,
+            prefetcher or (speculator.prefetcher if speculator is not None else None), links.__setitem__)
+        if crawler is not None and links:
+            # Linked pages are read without another search or plan step
+            step = research_plan[plan_idx]
+
+            def read_linked(site_url: str, max_blocks: int):
+                _, page_notes, hrefs = explore_page(
+                    list(messages), site_url, step[1], step[0], block_filter, duplicates, registry,
+                    prefetcher=crawler.prefetcher, max_blocks=max_blocks)
+                return page_notes, hrefs
+
+            read_before = [url for step_notes in notes for url in step_notes]
+            notes[plan_idx].update(crawler.crawl(step[0], links, read_linked, read_before, duplicates))
+        if speculation is not None:
+            speculator.finish_step(speculation)
+        if prefetched:
+            prefetcher.drop(prefetched)   # candidates that were not picked
+        plan_idx += 1
+        step_state = None
+        save()
+    # All steps complete (or the plan ended early) – mark the checkpoint
+    # finished so it is never resumed
+    save(complete=True)
     return research_plan, notes
@@ -0,0 +1,323 @@
+import asyncio
+import contextvars
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from tracing import (
+    add_count
+)
+
+# ---------------------------------------------------------------------------
+# Resilience — retries, backoff and circuit breaking for every I/O path.
+# ---------------------------------------------------------------------------
+# call_llm, search and fetch_html all go through one Resilience instance:
+# • transient failures (timeouts, connection errors, 408/425/429/5xx) are
+#   retried with full‑jitter exponential backoff, or after Retry‑After when
+#   the server sends one; anything else is raised at once
+# • every call has a deadline covering all of its attempts and backoff
+#   waits; the clock starts once the call holds a host slot, and time spent
+#   queueing inside an attempt (see queueing()) does not count
+# • at most `max_per_host` calls run against one host at a time; kinds in
+#   `host_limits` have their own cap, None for none (LLM calls by default:
+#   the Scheduler already bounds them)
+# • a host that fails `failure_threshold` times in a row is cut off for
+#   `cooldown` seconds, then a single probe call decides whether it recovered.
+#   Calls made with wait_open=True wait the cooldown out instead of failing
+# Retries, waits, failures and rejections are counted per kind of call.
+# ---------------------------------------------------------------------------
+
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+_RETRYABLE_NAMES = ("ratelimit", "timeout", "connection", "unavailable", "internalserver", "overloaded")
+
+
+class TransientError(Exception):
+    """A failure worth retrying, optionally with the server's Retry‑After."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(RuntimeError):
+    """The host has failed repeatedly and is not being called for now."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call's deadline passed before it could succeed."""
+
+
+def retry_after_seconds(value: Any) -> Optional[float]:
+    # Retry‑After is either delay‑seconds or an HTTP date.
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(err: BaseException) -> Tuple[bool, Optional[float]]:
+    # (retryable?, Retry‑After seconds) for an exception from any I/O path.
+    if isinstance(err, TransientError):
+        return True, err.retry_after
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = retry_after_seconds(headers.get("retry-after") if hasattr(headers, "get") else None)
+    if isinstance(err, (TimeoutError, ConnectionError)):
+        return True, retry_after
+    status = getattr(err, "status_code", None) or getattr(response, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS, retry_after
+    name = type(err).__name__.lower()
+    return any(s in name for s in _RETRYABLE_NAMES), retry_after
+
+
+# The running call's deadline as a one‑item list, so queueing() can push it back
+_deadline: contextvars.ContextVar[Optional[List[Optional[float]]]] = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def queueing() -> Iterator[None]:
+    # Time spent in this block (e.g. waiting for a Scheduler slot) is not
+    # counted against the deadline of the call it runs in.
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        end = _deadline.get()
+        if end is not None and end[0] is not None:
+            end[0] += time.monotonic() - start
+
+
+async def _acquire_polling(slot: threading.BoundedSemaphore, timeout: Optional[float]) -> bool:
+    # Acquire *slot* from the event loop by polling: unlike a blocking acquire
+    # in a worker thread, a cancelled waiter can never end up holding it.
+    end = None if timeout is None else time.monotonic() + timeout
+    delay = 0.005
+    while not slot.acquire(blocking=False):
+        now = time.monotonic()
+        if end is not None and now >= end:
+            return False
+        await asyncio.sleep(delay if end is None else min(delay, end - now))
+        delay = min(delay * 2, 0.1)
+    return True
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        self._probing: set = set()
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.monotonic() - opened_at < self.cooldown or host in self._probing:
+                return False
+            # Half‑open: let exactly one call through to test the host
+            self._probing.add(host)
+            return True
+
+    def retry_in(self, host: str) -> float:
+        # Seconds until allow() may admit a call to *host* again.
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return 0.0
+            return max(0.05, self.cooldown - (time.monotonic() - opened_at)) if host not in self._probing else 0.5
+
+    def success(self, host: str):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._probing.discard(host)
+
+    def failure(self, host: str):
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if host in self._probing or self._failures[host] >= self.failure_threshold:
+                self._opened_at[host] = time.monotonic()
+                self._probing.discard(host)
+
+    def open_hosts(self):
+        with self._lock:
+            return sorted(self._opened_at)
+
+
+class Resilience:
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 deadline: float = 180.0, max_per_host: int = 4, failure_threshold: int = 5,
+                 cooldown: float = 60.0, host_limits: Optional[Dict[str, Optional[int]]] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.max_per_host = max_per_host
+        self.host_limits = {"llm": None} if host_limits is None else dict(host_limits)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self._lock = threading.Lock()
+        self._host_slots: Dict[Tuple[str, str], threading.BoundedSemaphore] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _count(self, kind: str, counter: str, amount: float = 1):
+        with self._lock:
+            stats = self._stats.setdefault(kind, {
+                "calls": 0, "attempts": 0, "retries": 0, "wait_seconds": 0.0,
+                "failures": 0, "circuit_rejections": 0, "circuit_wait_seconds": 0.0, "deadline_exceeded": 0,
+            })
+            stats[counter] += amount
+
+    def _host_slot(self, kind: str, host: str) -> Optional[threading.BoundedSemaphore]:
+        # None when calls of *kind* are not capped per host.
+        limit = self.host_limits.get(kind, self.max_per_host)
+        if limit is None:
+            return None
+        with self._lock:
+            if (kind, host) not in self._host_slots:
+                self._host_slots[kind, host] = threading.BoundedSemaphore(limit)
+            return self._host_slots[kind, host]
+
+    def _circuit_wait(self, kind: str, host: str, wait_open: bool) -> float:
+        # 0 when *host* may be called now, else seconds to wait before asking
+        # again (wait_open) — or CircuitOpenError.
+        if self.breaker.allow(host):
+            self._count(kind, "attempts")
+            return 0.0
+        if not wait_open:
+            self._count(kind, "circuit_rejections")
+            raise CircuitOpenError(f"circuit open for {host}")
+        delay = self.breaker.retry_in(host)
+        self._count(kind, "circuit_wait_seconds", delay)
+        return delay
+
+    def _backoff(self, kind: str, host: str, err: Exception, attempt: int, end: float) -> float:
+        # Seconds to wait before the next attempt; re‑raises *err* to give up.
+        retryable, retry_after = classify(err)
+        if not retryable:
+            # The host answered; the request itself was at fault
+            self.breaker.success(host)
+            raise err
+        self.breaker.failure(host)
+        if attempt + 1 >= self.max_attempts:
+            self._count(kind, "failures")
+            raise err
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.base_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if time.monotonic() + delay > end:
+            self._count(kind, "deadline_exceeded")
+            raise DeadlineExceeded(f"{kind} call to {host} would pass its deadline") from err
+        self._count(kind, "retries")
+        self._count(kind, "wait_seconds", delay)
+        add_count("retries")
+        return delay
+
+    def _deadline_miss(self, kind: str, host: str):
+        self._count(kind, "deadline_exceeded")
+        return DeadlineExceeded(f"no free {kind} slot for {host} before the deadline")
+
+    def call(self, kind: str, host: str, fn: Callable[..., Any], *args, deadline: Optional[float] = None, wait_open: bool = False, **kwargs) -> Any:
+        # Run fn(*args, **kwargs) under the retry, host‑limit and breaker
+        # rules. wait_open=True waits out an open circuit instead of raising.
+        self._count(kind, "calls")
+        slot = self._host_slot(kind, host)
+        end: List[Optional[float]] = [None]
+        token = _deadline.set(end)
+        try:
+            for attempt in range(self.max_attempts):
+                while True:
+                    wait = self._circuit_wait(kind, host, wait_open)
+                    if not wait:
+                        break
+                    time.sleep(wait)
+                    if end[0] is not None:
+                        end[0] += wait
+                if slot is not None:
+                    timeout = None if end[0] is None else max(0.0, end[0] - time.monotonic())
+                    if not slot.acquire(timeout=timeout):
+                        raise self._deadline_miss(kind, host)
+                if end[0] is None:
+                    end[0] = time.monotonic() + (deadline or self.deadline)
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as err:
+                    delay = self._backoff(kind, host, err, attempt, end[0])
+                else:
+                    self.breaker.success(host)
+                    return result
+                finally:
+                    if slot is not None:
+                        slot.release()
+                time.sleep(delay)
+        finally:
+            _deadline.reset(token)
+
+    async def acall(self, kind: str, host: str, fn: Callable[..., Awaitable[Any]], *args, deadline: Optional[float] = None, wait_open: bool = False, **kwargs) -> Any:
+        # Async twin of call(); waits never block the event loop.
+        self._count(kind, "calls")
+        slot = self._host_slot(kind, host)
+        end: List[Optional[float]] = [None]
+        token = _deadline.set(end)
+        try:
+            for attempt in range(self.max_attempts):
+                while True:
+                    wait = self._circuit_wait(kind, host, wait_open)
+                    if not wait:
+                        break
+                    await asyncio.sleep(wait)
+                    if end[0] is not None:
+                        end[0] += wait
+                if slot is not None:
+                    timeout = None if end[0] is None else max(0.0, end[0] - time.monotonic())
+                    if not await _acquire_polling(slot, timeout):
+                        raise self._deadline_miss(kind, host)
+                if end[0] is None:
+                    end[0] = time.monotonic() + (deadline or self.deadline)
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as err:
+                    delay = self._backoff(kind, host, err, attempt, end[0])
+                else:
+                    self.breaker.success(host)
+                    return result
+                finally:
+                    if slot is not None:
+                        slot.release()
+                await asyncio.sleep(delay)
+        finally:
+            _deadline.reset(token)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {kind: {k: round(v, 3) if isinstance(v, float) else v for k, v in values.items()}
+                                     for kind, values in self._stats.items()}
+        stats["open_circuits"] = self.breaker.open_hosts()
+        return stats
+
+
+_resilience = Resilience()
+
+
+def set_resilience(resilience: Resilience) -> Resilience:
+    # Swap the process‑wide policy; returns the previous one.
+    global _resilience
+    previous, _resilience = _resilience, resilience
+    return previous
+
+
+def get_resilience() -> Resilience:
+    return _resilience
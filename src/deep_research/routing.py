@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_MODEL = "openai/o3-mini"
+LLM_TIMEOUT = 120   # seconds per request attempt; retries are in resilience.py
+CALL_SITES = ("plan", "site_choice", "notes", "page_decision", "report", "repair")
+
+# ---------------------------------------------------------------------------
+# Model routing — which model (and how) answers each call site.
+# ---------------------------------------------------------------------------
+# Every call_llm() is tagged with one of CALL_SITES. A Router maps call
+# sites to named ModelProfiles (model, reasoning effort, output cap, timeout); untagged or
+# unrouted sites use the "default" profile, which is DEFAULT_MODEL unless
+# configured. A profile may name a fallback profile: when its model is
+# overloaded (retries exhausted, circuit open, deadline passed) the call is
+# sent once more to the fallback. Latency and tokens are recorded per
+# call site and profile. Configuration is a JSON file:
+#
+#   {"profiles": {"default": {"model": "openai/o3-mini", "reasoning_effort": "medium"},
+#                 "fast": {"model": "openai/gpt-4.1-mini", "max_output_tokens": 4000, "timeout": 60}},
+#    "routes": {"notes": "fast", "repair": "fast", "page_decision": "fast"},
+#    "fallbacks": {"default": "fast"}}
+# ---------------------------------------------------------------------------
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    model: str = DEFAULT_MODEL
+    reasoning_effort: Optional[str] = None      # "low" | "medium" | "high", reasoning models only
+    max_output_tokens: Optional[int] = None
+    timeout: float = LLM_TIMEOUT
+
+    @property
+    def cache_model(self) -> str:
+        # Response‑cache key: the reasoning effort changes the answer.
+        return f"{self.model}@{self.reasoning_effort}" if self.reasoning_effort else self.model
+
+
+class Router:
+    def __init__(self, profiles: Optional[Dict[str, ModelProfile]] = None, routes: Optional[Dict[str, str]] = None, fallbacks: Optional[Dict[str, str]] = None):
+        self.profiles = {"default": ModelProfile(), **(profiles or {})}
+        self.routes = dict(routes or {})
+        self.fallbacks = dict(fallbacks or {})
+        for name in list(self.routes.values()) + list(self.fallbacks) + list(self.fallbacks.values()):
+            if name not in self.profiles:
+                raise ValueError(f"unknown model profile: {name}")
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "Router":
+        known = {f.name for f in fields(ModelProfile)}
+        profiles = {}
+        for name, options in config.get("profiles", {}).items():
+            unknown = set(options) - known
+            if unknown:
+                raise ValueError(f"profile {name}: unknown options {sorted(unknown)}")
+            profiles[name] = ModelProfile(**options)
+        return cls(profiles, config.get("routes"), config.get("fallbacks"))
+
+    def route(self, call_site: Optional[str]) -> Tuple[str, ModelProfile]:
+        # (profile name, profile) for a call site.
+        name = self.routes.get(call_site or "", "default")
+        return name, self.profiles[name]
+
+    def fallback(self, name: str) -> Optional[Tuple[str, ModelProfile]]:
+        fallback = self.fallbacks.get(name)
+        return (fallback, self.profiles[fallback]) if fallback else None
+
+    def record(self, call_site: Optional[str], name: str, seconds: float, input_tokens: int, output_tokens: int, error: bool = False, fallback: bool = False):
+        # One attempt (after its retries) of *call_site* on profile *name*;
+        # fallback=True when it stood in for an overloaded profile.
+        key = f"{call_site or 'untagged'}[{name}]"
+        with self._lock:
+            stats = self._stats.setdefault(key, {
+                "model": self.profiles[name].model, "calls": 0, "errors": 0, "fallbacks": 0,
+                "seconds": 0.0, "input_tokens": 0, "output_tokens": 0,
+            })
+            stats["calls"] += 1
+            stats["errors"] += error
+            stats["fallbacks"] += fallback
+            stats["seconds"] += seconds
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        # Per "call_site[profile]": calls, errors, fallbacks served, tokens,
+        # total and mean seconds per call.
+        with self._lock:
+            stats = {key: dict(values) for key, values in self._stats.items()}
+        for values in stats.values():
+            values["mean_seconds"] = round(values["seconds"] / values["calls"], 3) if values["calls"] else 0.0
+            values["seconds"] = round(values["seconds"], 3)
+        return stats
+
+
+_router = Router()
+
+
+def load_router(path: str) -> Router:
+    with open(path, encoding="utf-8") as f:
+        return Router.from_config(json.load(f))
+
+
+def enable_routing(path: str = "routes.json") -> Router:
+    # Route calls as configured in *path*; without that file every call
+    # site uses DEFAULT_MODEL (and routing stats are still recorded).
+    router = load_router(path) if os.path.exists(path) else Router()
+    set_router(router)
+    return router
+
+
+def set_router(router: Router) -> Router:
+    # Swap the process‑wide router; returns the previous one.
+    global _router
+    previous, _router = _router, router
+    return previous
+
+
+def get_router() -> Router:
+    return _router
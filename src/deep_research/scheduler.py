@@ -0,0 +1,224 @@
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from context import (
+    count_tokens,
+    message_tokens
+)
+
+# ---------------------------------------------------------------------------
+# Scheduler — one process‑wide gate for LLM requests and searches.
+# ---------------------------------------------------------------------------
+# • concurrency caps and sliding 60 s windows for LLM requests, LLM tokens
+#   (input + output) and searches, shared by every job in the process
+# • waiters are served highest job priority first, FIFO within a priority
+# • each job may carry a budget of LLM calls and tokens; a request that would
+#   go over it raises BudgetExceeded instead of being sent
+# The current job is a context variable; pools that should charge work to it
+# must be ContextThreadPoolExecutors so workers inherit the caller's context.
+# ---------------------------------------------------------------------------
+
+
+class BudgetExceeded(RuntimeError):
+    """A job has used up its LLM call or token budget."""
+
+
+class Job:
+    def __init__(self, job_id: str, priority: int = 0, max_llm_calls: Optional[int] = None, max_tokens: Optional[int] = None):
+        self.job_id = job_id
+        self.priority = priority
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self.llm_calls = 0
+        self.tokens = 0
+        self.searches = 0
+
+    def charge_llm(self, input_tokens: int):
+        with self._lock:
+            if self.max_llm_calls is not None and self.llm_calls >= self.max_llm_calls:
+                raise BudgetExceeded(f"job {self.job_id}: {self.max_llm_calls} LLM calls used")
+            if self.max_tokens is not None and self.tokens + input_tokens > self.max_tokens:
+                raise BudgetExceeded(f"job {self.job_id}: {self.max_tokens} token budget used")
+            self.llm_calls += 1
+            self.tokens += input_tokens
+
+    def add_tokens(self, tokens: int):
+        with self._lock:
+            self.tokens += tokens
+
+    def add_search(self):
+        with self._lock:
+            self.searches += 1
+
+    def usage(self) -> Dict[str, int]:
+        with self._lock:
+            return {"llm_calls": self.llm_calls, "tokens": self.tokens, "searches": self.searches}
+
+
+current_job: "contextvars.ContextVar[Optional[Job]]" = contextvars.ContextVar("current_job", default=None)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    # Runs every task in a copy of the submitting thread's context, so the
+    # current job follows work handed to worker threads.
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class _Gate:
+    # Concurrency cap plus a sliding‑window limit on count and on an amount.
+    def __init__(self, max_concurrent: Optional[int], per_minute: Optional[int], amount_per_minute: Optional[int] = None):
+        self.max_concurrent = max_concurrent
+        self.per_minute = per_minute
+        self.amount_per_minute = amount_per_minute
+        self.active = 0
+        self.starts: Deque[float] = deque()
+        self.amounts: Deque[Tuple[float, int]] = deque()
+        self.waiters: List[Tuple[int, int]] = []
+        self.granted = 0
+        self.wait_seconds = 0.0
+
+    def _trim(self, now: float):
+        while self.starts and now - self.starts[0] >= 60.0:
+            self.starts.popleft()
+        while self.amounts and now - self.amounts[0][0] >= 60.0:
+            self.amounts.popleft()
+
+    def delay(self, now: float, amount: int) -> Optional[float]:
+        # 0 when a request may start now, seconds until a window slot frees up,
+        # or None when only a release can unblock it.
+        self._trim(now)
+        if self.max_concurrent is not None and self.active >= self.max_concurrent:
+            return None
+        if self.per_minute is not None and len(self.starts) >= self.per_minute:
+            return 60.0 - (now - self.starts[0])
+        if self.amount_per_minute is not None and self.amounts:
+            # A single request larger than the limit still runs on an empty window
+            used = sum(a for _, a in self.amounts)
+            if used + amount > self.amount_per_minute:
+                return 60.0 - (now - self.amounts[0][0])
+        return 0.0
+
+
+class Scheduler:
+    def __init__(self, max_concurrent_llm: Optional[int] = 8, llm_requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None, max_concurrent_searches: Optional[int] = 2,
+                 searches_per_minute: Optional[int] = None):
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._gates = {
+            "llm": _Gate(max_concurrent_llm, llm_requests_per_minute, tokens_per_minute),
+            "search": _Gate(max_concurrent_searches, searches_per_minute),
+        }
+        self.output_tokens = 0
+
+    def _acquire(self, name: str, amount: int = 0):
+        gate = self._gates[name]
+        job = current_job.get()
+        me = (-(job.priority if job else 0), next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(gate.waiters, me)
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = gate.delay(now, amount) if gate.waiters[0] == me else None
+                    if delay == 0.0:
+                        heapq.heappop(gate.waiters)
+                        gate.active += 1
+                        gate.granted += 1
+                        gate.starts.append(now)
+                        gate.amounts.append((now, amount))
+                        gate.wait_seconds += now - start
+                        # The next waiter in line may be able to start too
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(timeout=delay)
+            except BaseException:
+                # Interrupted while waiting: leave the line, or a stale head
+                # entry would block every waiter behind it
+                if me in gate.waiters:
+                    gate.waiters.remove(me)
+                    heapq.heapify(gate.waiters)
+                self._cond.notify_all()
+                raise
+
+    def _release(self, name: str):
+        with self._cond:
+            self._gates[name].active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def llm_slot(self, messages: List[Dict[str, Any]]) -> Iterator["_LLMSlot"]:
+        # Wrap one LLM request: charges the current job, waits for the global
+        # limits, and counts the response's tokens via slot.record_output().
+        input_tokens = message_tokens(messages)
+        job = current_job.get()
+        if job is not None:
+            job.charge_llm(input_tokens)
+        self._acquire("llm", input_tokens)
+        slot = _LLMSlot(self, job)
+        try:
+            yield slot
+        finally:
+            self._release("llm")
+
+    def _add_output(self, tokens: int):
+        with self._cond:
+            gate = self._gates["llm"]
+            # Output tokens count towards the TPM window as well
+            gate.amounts.append((time.monotonic(), tokens))
+            self.output_tokens += tokens
+
+    @contextmanager
+    def search_slot(self) -> Iterator[None]:
+        job = current_job.get()
+        if job is not None:
+            job.add_search()
+        self._acquire("search")
+        try:
+            yield
+        finally:
+            self._release("search")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._cond:
+            return {
+                name: {"granted": gate.granted, "active": gate.active, "waiting": len(gate.waiters),
+                       "wait_seconds": round(gate.wait_seconds, 3)}
+                for name, gate in self._gates.items()
+            }
+
+
+class _LLMSlot:
+    def __init__(self, scheduler: Scheduler, job: Optional[Job]):
+        self._scheduler = scheduler
+        self._job = job
+
+    def record_output(self, text: str):
+        tokens = count_tokens(text)
+        self._scheduler._add_output(tokens)
+        if self._job is not None:
+            self._job.add_tokens(tokens)
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def set_scheduler(scheduler: Optional[Scheduler]) -> Optional[Scheduler]:
+    # Install the process‑wide scheduler (None disables it); returns the old one.
+    global _scheduler
+    previous, _scheduler = _scheduler, scheduler
+    return previous
+
+
+def get_scheduler() -> Optional[Scheduler]:
+    return _scheduler
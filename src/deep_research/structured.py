@@ -0,0 +1,248 @@
+import ast
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Type, get_args, get_origin
+
+from pydantic import BaseModel
+from pydantic_core import ValidationError
+
+from json_schemas import (
+    ResearchPlan,
+    Site,
+    ExploreDecision,
+    Sections,
+    Step_Indices
+)
+
+from llm import (
+    call_llm,
+    get_backend
+)
+
+# ---------------------------------------------------------------------------
+# structured_call — one path for every JSON‑shaped LLM response.
+# ---------------------------------------------------------------------------
+# 1. ask the provider to enforce the schema when the backend supports it
+# 2. parse locally and tolerantly: code fences, trailing prose, smart/single
+#    quotes, trailing commas, Python tuples, scalar‑vs‑list shapes
+# 3. only then spend a bounded number of LLM repair round‑trips
+# Counters per schema are kept so repair traffic can be watched.
+# ---------------------------------------------------------------------------
+
+SCHEMA_HINTS: Dict[Type[BaseModel], str] = {
+    ResearchPlan: '{"plan": [[str, str]]}',
+    Site: '{"site": [int, str]}',
+    ExploreDecision: '{"decision": [int, str]}',
+    Sections: '{"sections": [[str, str]]}',
+    Step_Indices: '{"step_indices": [int]}',
+}
+
+
+class StructuredOutputError(ValueError):
+    """The response could not be turned into the schema, even after repairs."""
+
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"})
+
+
+def _json_span(text: str) -> str:
+    # Return the first balanced {...} or [...] in *text*, ignoring brackets
+    # inside string literals; falls back to the whole text.
+    start = next((i for i, c in enumerate(text) if c in "{["), None)
+    if start is None:
+        return text
+    depth, quote, escaped = 0, None, False
+    for i in range(start, len(text)):
+        c = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif c in "{[(":
+            depth += 1
+        elif c in "}])":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _loads(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    # Single quotes, tuples, True/False/None: valid Python literal syntax
+    return ast.literal_eval(text)
+
+
+def _default(annotation: Any) -> Any:
+    return {str: "", int: 0}.get(annotation)
+
+
+def _coerce(value: Any, annotation: Any) -> Any:
+    # Bend near‑miss shapes towards *annotation* (list vs scalar, dict vs tuple,
+    # short tuples, numeric strings); pydantic has the final say.
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin is list:
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        # A single row where a list of tuples is expected: ["q", "why"]
+        if args and get_origin(args[0]) is tuple and value \
+                and not any(isinstance(v, (list, tuple, dict)) for v in value):
+            value = [value]
+        return [_coerce(v, args[0]) for v in value] if args else list(value)
+    if origin is tuple and args and args[-1] is not Ellipsis:
+        if isinstance(value, dict):
+            value = list(value.values())
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        value = list(value)[:len(args)]
+        value += [_default(a) for a in args[len(value):]]
+        return [_coerce(v, a) for v, a in zip(value, args)]
+    if annotation is int and isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value.strip())
+    return value
+
+
+def parse_structured(raw: str, schema: Type[BaseModel]) -> BaseModel:
+    # Tolerant local parse of *raw* into *schema*; raises ValueError.
+    try:
+        return schema.model_validate_json(raw)
+    except ValidationError:
+        pass
+
+    text = raw.translate(_QUOTES)
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        data = _loads(_json_span(text.strip()))
+    except (ValueError, SyntaxError, MemoryError, RecursionError) as err:
+        raise ValueError(f"no JSON found for {schema.__name__}") from err
+
+    fields = schema.model_fields
+    if not isinstance(data, dict) and len(fields) == 1:
+        data = {next(iter(fields)): data}
+    if isinstance(data, dict):
+        data = {name: _coerce(data[name], field.annotation) if name in data else None
+                for name, field in fields.items()}
+    return schema.model_validate(data)
+
+
+class StructuredStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def add(self, schema: Type[BaseModel], counter: str):
+        with self._lock:
+            stats = self._stats.setdefault(schema.__name__, {
+                "calls": 0, "provider_schema": 0, "clean": 0, "local_fixes": 0,
+                "repairs": 0, "failures": 0,
+            })
+            stats[counter] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: dict(values) for name, values in self._stats.items()}
+
+
+structured_stats = StructuredStats()
+_provider_schema_rejected: set = set()
+_provider_schema_lock = threading.Lock()
+
+# A provider rejecting the requested schema answers 400 (or 422) naming the
+# response format as the bad parameter, or with a schema error code.
+_SCHEMA_PARAMS = ("response_format", "text.format")
+_SCHEMA_CODES = frozenset(("invalid_json_schema", "invalid_schema"))
+
+
+def _schema_rejected(err: BaseException) -> bool:
+    # Whether *err* (or an error it was raised from) is the provider turning
+    # down the response schema, read from the status and the error's
+    # param / code fields (top level or in the body's "error" object).
+    while err is not None:
+        response = getattr(err, "response", None)
+        status = getattr(err, "status_code", None) or getattr(response, "status_code", None)
+        if status in (400, 422):
+            body = getattr(err, "body", None)
+            detail = body.get("error") if isinstance(body, dict) else None
+            fields = {"param": getattr(err, "param", None), "code": getattr(err, "code", None)}
+            for source in (fields, body, detail):
+                if not isinstance(source, dict):
+                    continue
+                param, code = source.get("param"), source.get("code")
+                if isinstance(param, str) and param.startswith(_SCHEMA_PARAMS):
+                    return True
+                if code in _SCHEMA_CODES:
+                    return True
+        err = err.__cause__ or err.__context__
+    return False
+
+
+def structured_call(messages: List[Dict[str, Any]], schema: Type[BaseModel], call_site: Optional[str] = None, max_repairs: int = 2) -> Tuple[BaseModel, str]:
+    # Returns (validated model, raw response text to keep in the history).
+    structured_stats.add(schema, "calls")
+
+    raw = None
+    backend = get_backend()
+    with _provider_schema_lock:
+        use_schema = schema not in _provider_schema_rejected
+    if getattr(backend, "structured_output", False) and use_schema:
+        try:
+            raw = call_llm(messages, call_site, response_model=schema)
+            structured_stats.add(schema, "provider_schema")
+        except Exception as err:
+            # Schema not accepted by the provider (e.g. tuple shapes in strict
+            # mode): stop asking for it and fall back to plain text.
+            if not _schema_rejected(err):
+                raise
+            with _provider_schema_lock:
+                _provider_schema_rejected.add(schema)
+    if raw is None:
+        raw = call_llm(messages, call_site)
+
+    try:
+        parsed = schema.model_validate_json(raw)
+        structured_stats.add(schema, "clean")
+        return parsed, raw
+    except ValidationError:
+        pass
+
+    for repairs in range(max_repairs + 1):
+        try:
+            parsed = parse_structured(raw, schema)
+            if repairs == 0:
+                structured_stats.add(schema, "local_fixes")
+            return parsed, parsed.model_dump_json()
+        except ValueError:
+            if repairs == max_repairs:
+                break
+        # Last resort: one LLM round‑trip to reformat the answer.
+        structured_stats.add(schema, "repairs")
+        raw = call_llm([{
+            "role": "user",
+            "content": (
+                "Output this:\n"
+                f"{raw}\n"
+                f"correctly in the valid JSON schema: {SCHEMA_HINTS.get(schema, schema.model_json_schema())}\n"
+                "Do not include any other text"
+            )
+        }], "repair")
+
+    structured_stats.add(schema, "failures")
+    raise StructuredOutputError(f"could not parse a {schema.__name__} response after {max_repairs} repairs")
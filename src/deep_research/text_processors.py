@@ -1,14 +1,42 @@
-from typing import List, Tuple, Dict
+import re
+from copy import deepcopy
+from typing import List, Tuple, Dict, Optional
+from urllib.parse import urljoin, urlsplit
 import trafilatura                         # HTML → readable text extractor
+import urllib3
+from trafilatura.downloads import _initiate_pool
+from trafilatura.settings import DEFAULT_CONFIG
 from lxml import etree
 
+from page_cache import (
+    PageCache,
+    get_page_cache
+)
+
+from tracing import (
+    add_count,
+    annotate_span,
+    traced
+)
+
+from resilience import (
+    RETRYABLE_STATUS,
+    CircuitOpenError,
+    DeadlineExceeded,
+    TransientError,
+    get_resilience,
+    retry_after_seconds
+)
+
 
 # ---------------------------------------------------------------------------
 # Text‑processing helpers
 # ---------------------------------------------------------------------------
 
 
-def parse_search_results(results: list[dict]) -> str:
+def parse_search_results(results: list[dict], already_read: Optional[set] = None, previews: Optional[Dict[str, str]] = None) -> str:
+    # *previews* ({url: page_preview(...)}) adds what the prefetched page
+    # actually says; a result without one is still downloading.
     blocks = []
     for i, r in enumerate(results, 1):
         title   = r.get("title",  "").replace("\\n", "\n")
@@ -18,10 +46,20 @@ def parse_search_results(results: list[dict]) -> str:
         lines = [f"Result {i}: {title}", f"  URL: {url}"]
         if snippet:
             lines.append(f"  Snippet: {snippet}")
+        if already_read and url in already_read:
+            lines.append("  Already read in an earlier step: choosing it reuses those notes")
+        elif previews is not None:
+            lines.append(f"  Page preview {previews[url]}" if url in previews else "  Page preview: pending (still downloading)")
         blocks.append("\n".join(lines))
 
     return "\n\n".join(blocks)
 
+def page_preview(blocks: List[str], words: int = 60, word_overlap: int = 50) -> str:
+    # "(N words): first words of the page…" from extract_blocks() output.
+    total = sum(len(block.split()) for block in blocks) - word_overlap * max(0, len(blocks) - 1)
+    head = blocks[0].split()[:words] if blocks else []
+    return f"({total} words): {' '.join(head)}{'…' if total > len(head) else ''}"
+
 def parse_notes(notes: dict[str, str]) -> str:
     if not notes:
         return ""
@@ -57,33 +95,147 @@ def parse_section_notes(step_indices: List[int], notes: List[Dict[str, str]]) ->
     return "\n".join(lines).rstrip()
 
 
+def summarize_notes(notes: List[Dict[str, str]], max_words: int = 200) -> str:
+    # Compact running summary: the most recent *max_words* words of notes.
+    words: List[str] = []
+    for step_notes in notes:
+        for text in step_notes.values():
+            if not is_empty_note(text):
+                words.extend(text.split())
+    if not words:
+        return "(no notes yet)"
+    return " ".join(words[-max_words:])
 
-def extract_blocks(url: str, max_words_per_block: int = 600, word_overlap: int = 50, max_words_total: int = 5000) -> Tuple[List[str], List[str]]:
-    # Fetch *url*, return list of overlapping text blocks and unique hrefs.
 
-    # Trafilatura reliably extracts main‑content text even on messy pages.
-    # Cap at 5 000 words to control token costs and split into ~600‑word blocks
-    # with 50‑word overlap so no sentence context is lost between blocks.
+def is_empty_note(text: str) -> bool:
+    # The note‑taking prompts answer "..." when a block has nothing worth noting.
+    return not text.strip().strip(".…").strip()
+
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_DEFINITION = re.compile(r"^(?:The |An |A )?([A-Z][\w\-]*(?: [\w\-]+){0,4}?) (?:is|are|refers to|denotes|is defined as|stands for) ")
+_ACRONYM = re.compile(r"([A-Z][\w\-]+(?: [\w\-]+){0,5}) \(([A-Z][A-Za-z0-9\-]{1,9})\)")
+
+
+def digest_section(section_text: str, max_claims: int = 6, max_claim_words: int = 40) -> str:
+    # Compact stand‑in for a written section: its heading, the lead sentence
+    # of each paragraph (its key claim) and the terms it already defined.
+    paragraphs = [p.strip() for p in section_text.strip().split("\n\n") if p.strip()]
+    if not paragraphs:
+        return ""
+    heading, body = paragraphs[0].splitlines()[0].strip(), paragraphs[1:]
+
+    claims: List[str] = []
+    terms: List[str] = []
+    for paragraph in body:
+        sentences = _SENTENCE_END.split(" ".join(paragraph.split()))
+        if len(claims) < max_claims:
+            words = sentences[0].split()
+            claims.append(" ".join(words[:max_claim_words]) + (" …" if len(words) > max_claim_words else ""))
+        for sentence in sentences:
+            match = _DEFINITION.match(sentence)
+            if match:
+                terms.append(match.group(1))
+        for long_form, acronym in _ACRONYM.findall(paragraph):
+            terms.append(f"{acronym} ({long_form})")
+
+    lines = [heading]
+    lines.extend(f"- {claim}" for claim in claims)
+    unique_terms = list(dict.fromkeys(terms))
+    if unique_terms:
+        lines.append("Terms already defined: " + ", ".join(unique_terms))
+    return "\n".join(lines)
+
+
+# Identifies the extraction settings below in the page cache key; bump it
+# whenever extract_text_and_hrefs changes what it produces.
+EXTRACTION_PARAMS = "trafilatura:txt+xml_links:v2"
+
+FETCH_TIMEOUT = 15   # seconds per download attempt
+MAX_PAGE_BYTES = 2_000_000   # downloads stop here; extraction reads 5 000 words at most
 
-    html = trafilatura.fetch_url(url)
-    if html is None:
-        return [], []
 
+@traced("fetch")
+def fetch_html(url: str) -> Tuple[Optional[str], Dict[str, str]]:
+    # Download *url*; returns (html or None, lower‑cased response headers).
+    # trafilatura already retries 429/5xx (honouring Retry‑After) inside one
+    # attempt; on top of that timeouts and dropped connections are retried
+    # with backoff, downloads per host are capped, the whole fetch has a
+    # deadline, and a host that keeps failing is skipped by the breaker.
+    # Connections are kept alive in trafilatura's shared urllib3 pool, and a
+    # download stops after MAX_PAGE_BYTES.
+    try:
+        return get_resilience().call("fetch", urlsplit(url).hostname or "", _fetch_once, url)
+    except (TransientError, CircuitOpenError, DeadlineExceeded):
+        return None, {}
+
+
+def _fetch_once(url: str) -> Tuple[Optional[str], Dict[str, str]]:
+    config = deepcopy(DEFAULT_CONFIG)
+    config.set("DEFAULT", "DOWNLOAD_TIMEOUT", str(FETCH_TIMEOUT))
+    config.set("DEFAULT", "MAX_FILE_SIZE", str(MAX_PAGE_BYTES))
+    response = trafilatura.fetch_response(url, decode=True, config=config)
+    if response is None:
+        # trafilatura logs and swallows timeouts and connection errors
+        raise TransientError(f"no response from {url}")
+    if response.status in RETRYABLE_STATUS:
+        headers = response.headers or {}
+        raise TransientError(f"HTTP {response.status} from {url}", retry_after_seconds(headers.get("retry-after")))
+    if not response.data or response.status != 200:
+        return None, {}
+    add_count("bytes_fetched", len(response.data))
+    return response.html, response.headers or {}
+
+
+def resolve_redirects(url: str) -> Optional[str]:
+    # Where *url* lands after its redirects, found with a HEAD request that
+    # shares fetch_html's connection pool, host limits, retries and breaker;
+    # None when the host cannot be reached.
+    try:
+        return get_resilience().call("fetch", urlsplit(url).hostname or "", _head_once, url)
+    except (TransientError, CircuitOpenError, DeadlineExceeded):
+        return None
+
+
+def _head_once(url: str) -> Optional[str]:
+    # Redirects are followed here; failed connections are left to the
+    # resilience layer's retries.
+    pool = _initiate_pool(DEFAULT_CONFIG)
+    try:
+        response = pool.request("HEAD", url, redirect=True, timeout=FETCH_TIMEOUT,
+                                retries=urllib3.Retry(connect=0, read=0, status=0, other=0, redirect=5,
+                                                     raise_on_redirect=False))
+    except ValueError:
+        return None
+    except urllib3.exceptions.HTTPError as err:
+        raise TransientError(f"HEAD {url} failed: {err}") from err
+    if response.status in RETRYABLE_STATUS:
+        raise TransientError(f"HTTP {response.status} from {url}", retry_after_seconds(response.headers.get("retry-after")))
+    return urljoin(url, response.geturl() or url)
+
+
+@traced("extract")
+def extract_text_and_hrefs(html: str) -> Tuple[str, Dict[str, str]]:
+    # Trafilatura reliably extracts main‑content text even on messy pages.
     text = trafilatura.extract(html, include_links=False, output_format="txt") or ""
     xml_str = trafilatura.extract(html, include_links=True, output_format="xml")
 
-    # Collect outgoing links once so the agent can optionally explore them.
-    hrefs_seen: set[str] = set()
-    hrefs_list: List[str] = []
+    # Collect outgoing links once so the agent can optionally explore them:
+    # {target: anchor text} in page order, first non‑empty anchor kept.
+    hrefs: Dict[str, str] = {}
 
     if xml_str:
         root = etree.fromstring(xml_str.encode())
         for ref in root.xpath(".//ref[@target]"):
             target = ref.get("target")
-            if target and target not in hrefs_seen:
-                hrefs_seen.add(target)
-                hrefs_list.append(target)
+            if target and not hrefs.get(target):
+                hrefs[target] = " ".join("".join(ref.itertext()).split())
 
+    return text, hrefs
+
+
+def split_blocks(text: str, max_words_per_block: int = 600, word_overlap: int = 50, max_words_total: int = 5000) -> List[str]:
     # Sliding‑window block generation.
     words = text.split()
     stride = max(1, max_words_per_block - word_overlap)
@@ -94,4 +246,30 @@ def extract_blocks(url: str, max_words_per_block: int = 600, word_overlap: int =
         if chunk:
             blocks.append(chunk)
 
-    return blocks, hrefs_list
\ No newline at end of file
+    return blocks
+
+
+@traced("extract_blocks")
+def extract_blocks(url: str, max_words_per_block: int = 600, word_overlap: int = 50, max_words_total: int = 5000, cache: Optional[PageCache] = None) -> Tuple[List[str], Dict[str, str]]:
+    # Fetch *url*, return list of overlapping text blocks and unique hrefs
+    # ({target: anchor text}).
+
+    # Cap at 5 000 words to control token costs and split into ~600‑word blocks
+    # with 50‑word overlap so no sentence context is lost between blocks.
+    # With a page cache enabled, hits skip both the download and the parsing.
+
+    annotate_span(url=url)
+    cache = cache or get_page_cache()
+    cached = cache.get(url, EXTRACTION_PARAMS) if cache else None
+    if cached is not None:
+        add_count("cache_hits")
+        text, hrefs = cached
+    else:
+        html, headers = fetch_html(url)
+        if html is None:
+            return [], {}
+        text, hrefs = extract_text_and_hrefs(html)
+        if cache:
+            cache.put(url, EXTRACTION_PARAMS, html, text, hrefs, headers)
+
+    return split_blocks(text, max_words_per_block, word_overlap, max_words_total), hrefs
@@ -0,0 +1,171 @@
+import contextvars
+import functools
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+# ---------------------------------------------------------------------------
+# Tracing — nested spans with wall time, tokens, retries, cache hits, bytes.
+# ---------------------------------------------------------------------------
+# with span("explore_page"): …      opens a span under the current one
+#                                    (wall time + CPU time of its own thread)
+# @traced("search")                  the same, around a whole function
+# add_count("cache_hits")            counts into the innermost open span
+#
+# Counters roll up into the parent when a span ends, so a stage's row covers
+# everything done beneath it. Finished spans are streamed to a JSONL file and
+# folded into per‑span totals for summary_table(); nothing else is kept, so
+# memory stays flat on long runs. With tracing disabled (the default) a span
+# is a global lookup and an empty context manager. The current span is a
+# context variable:
+# ContextThreadPoolExecutor workers and asyncio tasks nest under the caller.
+# ---------------------------------------------------------------------------
+
+COUNTERS = ("llm_calls", "input_tokens", "output_tokens", "retries", "cache_hits", "bytes_fetched")
+_TIMES = ("seconds", "cpu_seconds")
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "tag", "attrs", "counters", "_lock")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, tag: Optional[str], attrs: Dict[str, Any]):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.tag = tag
+        self.attrs = attrs
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}[{self.tag}]" if self.tag else self.name
+
+    def add(self, counter: str, amount: int = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def merge(self, counters: Dict[str, int]):
+        with self._lock:
+            for counter, amount in counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+
+
+class Tracer:
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def finish(self, span: Span, start: float, seconds: float, cpu_seconds: float, error: Optional[str]):
+        record = {
+            "span_id": span.span_id, "parent_id": span.parent_id, "name": span.name, "tag": span.tag,
+            "start": round(start, 6), "seconds": round(seconds, 6), "cpu_seconds": round(cpu_seconds, 6),
+            "error": error, **span.counters, **span.attrs,
+        }
+        with self._lock:
+            totals = self._totals.setdefault(span.key, dict.fromkeys(_TIMES + ("count", "errors") + COUNTERS, 0))
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["cpu_seconds"] += cpu_seconds
+            totals["errors"] += error is not None
+            for counter, amount in span.counters.items():
+                totals[counter] = totals.get(counter, 0) + amount
+            if self._file is not None:
+                self._file.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {key: dict(totals) for key, totals in self._totals.items()}
+
+    def summary_table(self) -> str:
+        columns = ("count",) + _TIMES + ("errors",) + COUNTERS
+        rows = sorted(self.summary().items(), key=lambda item: -item[1]["seconds"])
+        width = max([len("span")] + [len(key) for key, _ in rows])
+        lines = ["span".ljust(width) + "".join(f"{c:>15}" for c in columns)]
+        for key, totals in rows:
+            cells = "".join(f"{totals[c]:>15.3f}" if c in _TIMES else f"{int(totals[c]):>15}" for c in columns)
+            lines.append(key.ljust(width) + cells)
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_tracer: Optional[Tracer] = None
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, tag: Optional[str] = None, **attrs) -> Iterator[Optional[Span]]:
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    parent = _current.get()
+    current = Span(tracer.next_id(), parent.span_id if parent else None, name, tag, attrs)
+    token = _current.set(current)
+    start, t0, cpu0 = time.time(), time.perf_counter(), time.thread_time()
+    error = None
+    try:
+        yield current
+    except BaseException as err:
+        error = type(err).__name__
+        raise
+    finally:
+        _current.reset(token)
+        if parent is not None:
+            parent.merge(current.counters)
+        tracer.finish(current, start, time.perf_counter() - t0, time.thread_time() - cpu0, error)
+
+
+def traced(name: str):
+    # Decorator: run the whole function inside span(name).
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def add_count(counter: str, amount: int = 1):
+    current = _current.get()
+    if current is not None:
+        current.add(counter, amount)
+
+
+def annotate_span(**attrs):
+    # Attach attributes (url, step index, …) to the innermost open span.
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def enable_tracing(path: Optional[str] = ".cache/trace.jsonl") -> Tracer:
+    global _tracer
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def set_tracer(tracer: Optional[Tracer]) -> Optional[Tracer]:
+    # Swap the process‑wide tracer (None disables tracing); returns the
+    # previous one so callers (benchmarks) can restore it.
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
@@ -0,0 +1,410 @@
+# ▸ Distributed execution: research steps, page explorations and report stages
+#   run as jobs on a durable JobQueue (jobqueue.py). Worker processes — on this
+#   machine or any other that can open the queue — pull and run jobs; a
+#   coordinator submits them and assembles plans, notes and reports as the
+#   results arrive.
+#
+#   python workers.py work --processes 4
+#   python workers.py run jobs.jsonl results.jsonl --runs 4
+#
+# Job input for `run` is the batch.py JSONL format (prompt, plan_depth,
+# search_depth per line).
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from json_schemas import (
+    ResearchPlan
+)
+
+from prompts import (
+    initial_messages,
+    initial_research_plan_prompt,
+    successive_research_plan_prompt
+)
+
+from research import (
+    explore_page,
+    pick_sites,
+    search
+)
+
+from report import (
+    assemble_report,
+    draft_outline,
+    draft_section_from_outline,
+    outline_text,
+    section_notes_for,
+    write_closing
+)
+
+from notes_store import (
+    NotesStore
+)
+
+from structured import (
+    structured_call
+)
+
+from text_processors import (
+    digest_section,
+    parse_notes
+)
+
+from jobqueue import (
+    JobQueue,
+    QueuedJob
+)
+
+from page_cache import (
+    enable_page_cache
+)
+
+from llm_cache import (
+    enable_llm_cache
+)
+
+from context import (
+    set_token_budget
+)
+
+from routing import (
+    enable_routing
+)
+
+from scheduler import (
+    ContextThreadPoolExecutor
+)
+
+from tracing import (
+    span
+)
+
+# ---------------------------------------------------------------------------
+# Tasks — what each job kind runs on a worker. Payloads and results are JSON.
+# ---------------------------------------------------------------------------
+# plan     messages → the (revised) plan and the raw reply for the history
+# step     search one plan step and choose its sites → the picks
+# page     explore_page() on one pick → its notes and outgoing links
+# outline  plan + notes → report sections
+# section  map one section to its notes and draft it from the outline
+# closing  introduction or conclusion of the report written so far
+#
+# Session components (block filter, duplicate index, registry, reading
+# policy, prefetcher, crawler) live in one process and are not available to
+# jobs; the page and LLM caches are, when the worker enables them.
+# ---------------------------------------------------------------------------
+
+TASKS: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+
+
+def task(kind: str):
+    # Decorator: register the handler of a job kind.
+    def register(fn):
+        TASKS[kind] = fn
+        return fn
+    return register
+
+
+@task("plan")
+def plan_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    plan, raw_plan = structured_call(payload["messages"], ResearchPlan, "plan")
+    return {"plan": [list(step) for step in plan.plan], "raw": raw_plan}
+
+
+@task("step")
+def step_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Picks as [choice messages after payload["messages"], url], like a checkpoint.
+    messages, step = payload["messages"], tuple(payload["step"])
+    results = search(step[0])
+    picks, _ = pick_sites(messages, step, results, payload["search_depth"])
+    return {"picks": [[m[len(messages):], url] for m, url in picks]}
+
+
+@task("page")
+def page_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    step = payload["step"]
+    _, notes, hrefs = explore_page(payload["messages"], payload["url"], step[1], step[0])
+    return {"notes": notes, "hrefs": hrefs}
+
+
+@task("outline")
+def outline_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    store = NotesStore([tuple(step) for step in payload["research_plan"]], payload["notes"])
+    sections, _ = draft_outline(payload["user_prompt"], store.plan_and_notes())
+    return {"sections": [list(section) for section in sections]}
+
+
+@task("section")
+def section_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Every section job indexes the notes afresh; they are small next to
+    # the two LLM calls it makes.
+    store = NotesStore([tuple(step) for step in payload["research_plan"]], payload["notes"])
+    sections = [tuple(section) for section in payload["sections"]]
+    section = sections[payload["index"]]
+    section_titles = ", ".join(title for title, _ in sections)
+    section_notes, sources = section_notes_for(
+        payload["user_prompt"], store, section, section_titles, payload["steps_allowed"],
+        payload["notes_mode"], payload["notes_budget"])
+    text = draft_section_from_outline(payload["user_prompt"], outline_text(sections), section, section_notes)
+    return {"text": text, "sources": sources}
+
+
+@task("closing")
+def closing_task(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {"text": write_closing(payload["kind"], payload["user_prompt"], payload["current_report"])}
+
+# ---------------------------------------------------------------------------
+# Worker — claim, run and complete jobs until stopped.
+# ---------------------------------------------------------------------------
+
+class _Heartbeat(threading.Thread):
+    # Extends a job's lease every third of the lease while the job runs.
+
+    def __init__(self, queue: JobQueue, job: QueuedJob):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job = job
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.queue.lease_seconds / 3):
+            if not self.queue.heartbeat(self.job):
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def execute(queue: JobQueue, job: QueuedJob) -> str:
+    # Run one claimed job; returns "done", "failed" (re‑queued while it has
+    # attempts left) or "lost" (the lease expired and the result was dropped).
+    handler = TASKS.get(job.kind)
+    if handler is None:
+        queue.fail(job, f"unknown job kind: {job.kind}", retry=False)
+        return "failed"
+    heartbeat = _Heartbeat(queue, job)
+    heartbeat.start()
+    try:
+        with span("job", job.kind, run=job.run, attempt=job.attempt):
+            result = handler(job.payload)
+    except Exception as err:
+        heartbeat.stop()
+        queue.fail(job, f"{type(err).__name__}: {err}")
+        return "failed"
+    heartbeat.stop()
+    return "done" if queue.complete(job, result) else "lost"
+
+
+def run_worker(queue: JobQueue, worker_id: Optional[str] = None, kinds: Optional[List[str]] = None, poll: float = 0.2, idle_timeout: Optional[float] = None, stop: Optional[Any] = None) -> Dict[str, int]:
+    # Run jobs (of *kinds*, default every registered kind) one at a time
+    # until *stop* (anything with is_set()) is set or no job arrived for
+    # *idle_timeout* seconds. Returns the count of each outcome.
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    counts = {"done": 0, "failed": 0, "lost": 0}
+    idle_since = time.monotonic()
+    while stop is None or not stop.is_set():
+        job = queue.claim(worker_id, kinds or list(TASKS))
+        if job is None:
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                break
+            time.sleep(poll)
+            continue
+        counts[execute(queue, job)] += 1
+        idle_since = time.monotonic()
+    return counts
+
+# ---------------------------------------------------------------------------
+# Coordinator — research() and write_report() as jobs for one run.
+# ---------------------------------------------------------------------------
+# Every job gets the key "<run>/<stage>/<payload hash>", so a coordinator
+# restarted with the same run id picks up the results its jobs already
+# produced, while a run id reused for another prompt (or settings) gets new
+# jobs instead of the old run's results. Plans
+# follow research(): the initial plan, then per step a search‑and‑choose job,
+# one page job per pick (read concurrently by whichever workers are free,
+# pages already read in an earlier step reuse their notes) and a plan
+# revision. The report follows write_report(section_mode="parallel"): the
+# outline, one job per section, then the introduction and the conclusion.
+# ---------------------------------------------------------------------------
+
+class Coordinator:
+    def __init__(self, queue: JobQueue, run: str, timeout: Optional[float] = None, priority: int = 0):
+        self.queue = queue
+        self.run = run
+        self.timeout = timeout
+        self.priority = priority
+
+    def submit(self, kind: str, stage: str, payload: Dict[str, Any]) -> int:
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        return self.queue.submit(self.run, kind, payload, key=f"{self.run}/{stage}/{digest}", priority=self.priority)
+
+    def call(self, kind: str, stage: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        job_id = self.submit(kind, stage, payload)
+        return self.queue.wait([job_id], self.timeout)[job_id]
+
+    def research(self, user_prompt: str, plan_depth: int, search_depth: int, messages: Optional[list] = None):
+        # research() with every LLM call, search and page read run as a job.
+        messages = list(messages or [])
+        read: Dict[str, str] = {}   # url → notes, for picks seen in an earlier step
+        notes: List[Dict[str, str]] = []
+
+        messages.append({"role": "user", "content": initial_research_plan_prompt.format(user_prompt = user_prompt)})
+        plan = self.call("plan", "plan/0", {"messages": messages})
+        messages.append({"role": "assistant", "content": plan["raw"]})
+        research_plan = [tuple(step) for step in plan["plan"]]
+
+        plan_idx = 0
+        while plan_idx < len(research_plan):
+            if plan_idx > 0:
+                messages.append(
+                    {"role": "user", "content": successive_research_plan_prompt.format(
+                        user_prompt = user_prompt,
+                        previous_query = research_plan[plan_idx - 1][0],
+                        query_reasoning=research_plan[plan_idx - 1][1],
+                        notes=parse_notes(notes[plan_idx - 1]),
+                        rest_of_plan=research_plan[plan_idx:],
+                        steps_left=min(plan_depth - plan_idx, 5)
+                    )
+                    }
+                )
+                plan = self.call("plan", f"plan/{plan_idx}", {"messages": messages})
+                messages.append({"role": "assistant", "content": plan["raw"]})
+                research_plan = research_plan[0:plan_idx] + [tuple(step) for step in plan["plan"]]
+                if plan_idx >= len(research_plan):
+                    break
+
+            step = research_plan[plan_idx]
+            picks = self.call("step", f"step/{plan_idx}", {
+                "messages": messages, "step": list(step), "search_depth": search_depth})["picks"]
+            step_notes = {url: read[url] for _, url in picks if url in read}
+            jobs = {self.submit("page", f"page/{plan_idx}/{url}", {"messages": messages + choice, "url": url, "step": list(step)}): url
+                    for choice, url in picks if url not in read}
+            for job_id, result in self.queue.as_completed(jobs, self.timeout):
+                step_notes[jobs[job_id]] = result["notes"]
+            # Merge in pick order so notes are deterministic regardless of timing
+            notes.append({url: step_notes[url] for _, url in picks})
+            read.update(notes[-1])
+            plan_idx += 1
+        return research_plan, notes
+
+    def write_report(self, user_prompt: str, research_plan: List[tuple[str, str]], notes: List[Dict[str, str]], steps_allowed_per_section: int = 3, report_context: str = "full", notes_mode: str = "steps", notes_budget: int = 3000) -> str:
+        # write_report(section_mode="parallel") with every stage run as a job.
+        base = {"user_prompt": user_prompt, "research_plan": [list(step) for step in research_plan], "notes": notes}
+        sections = self.call("outline", "outline", base)["sections"]
+
+        jobs = {self.submit("section", f"section/{i}", {
+                    **base, "sections": sections, "index": i, "notes_mode": notes_mode, "notes_budget": notes_budget,
+                    "steps_allowed": min(steps_allowed_per_section, len(research_plan))}): i
+                for i in range(len(sections))}
+        written_sections = [""] * len(sections)
+        sources: List[List[str]] = [[] for _ in sections]
+        for job_id, result in self.queue.as_completed(jobs, self.timeout):
+            written_sections[jobs[job_id]], sources[jobs[job_id]] = result["text"], result["sources"]
+
+        def report_so_far(parts: List[str]) -> str:
+            if report_context == "digest":
+                return "\n\n".join(digest_section(text) for text in parts)
+            return "\n\n".join(parts)
+
+        introduction = self.call("closing", "introduction", {
+            "kind": "introduction", "user_prompt": user_prompt, "current_report": report_so_far(written_sections)})["text"]
+        written_sections.insert(0, introduction)
+        conclusion = self.call("closing", "conclusion", {
+            "kind": "conclusion", "user_prompt": user_prompt, "current_report": report_so_far(written_sections)})["text"]
+        written_sections.append(conclusion)
+        return assemble_report(written_sections, sources)
+
+
+def run_distributed(queue: JobQueue, specs: List[Dict[str, Any]], max_runs: int = 4, timeout: Optional[float] = None, **report_options) -> Iterator[Dict[str, Any]]:
+    # Coordinate research + report for every spec (batch.load_jobs format),
+    # *max_runs* runs at a time; yields each run's result as it finishes.
+    # The spec id is the run id. Failures are reported, not raised.
+
+    def coordinate(spec: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.monotonic()
+        result: Dict[str, Any] = {"id": spec["id"], "prompt": spec["prompt"]}
+        coordinator = Coordinator(queue, spec["id"], timeout, spec.get("priority", 0))
+        try:
+            research_plan, notes = coordinator.research(
+                spec["prompt"], spec["plan_depth"], spec["search_depth"], initial_messages)
+            result.update(status="ok", report=coordinator.write_report(spec["prompt"], research_plan, notes, **report_options))
+        except Exception as err:
+            result.update(status="error", error=f"{type(err).__name__}: {err}")
+        result.update(seconds=round(time.monotonic() - start, 3), jobs=queue.stats(spec["id"]))
+        return result
+
+    with ContextThreadPoolExecutor(max_workers=max(1, max_runs)) as pool:
+        futures = [pool.submit(coordinate, spec) for spec in specs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _work(queue_path: str, routes: str, stop):
+    # Entry point of a worker process: the caches and routing main.py uses.
+    # Ctrl‑C reaches the parent, which lets the job in flight finish.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    enable_page_cache(".cache/pages.sqlite")
+    enable_llm_cache(".cache/llm.sqlite", mode="readwrite")
+    set_token_budget(100_000)
+    enable_routing(routes)
+    counts = run_worker(JobQueue(queue_path), stop=stop)
+    print(f"worker {os.getpid()}: {counts}", flush=True)
+
+
+if __name__ == "__main__":
+    from batch import load_jobs
+
+    parser = argparse.ArgumentParser(description="Run research + report as jobs on a shared queue.")
+    parser.add_argument("--queue", default=".cache/jobs.sqlite", help="SQLite job queue shared by every process")
+    commands = parser.add_subparsers(dest="command", required=True)
+    work = commands.add_parser("work", help="run worker processes")
+    work.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    work.add_argument("--routes", default="routes.json", help="model routing config (see routing.py)")
+    run = commands.add_parser("run", help="coordinate research + report runs from a JSONL file")
+    run.add_argument("input", help="JSONL file of jobs (see batch.py)")
+    run.add_argument("output", help="JSONL file results are appended to")
+    run.add_argument("--runs", type=int, default=4, help="runs coordinated concurrently")
+    run.add_argument("--plan-depth", type=int, default=8)
+    run.add_argument("--search-depth", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "work":
+        stop = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=_work, args=(args.queue, args.routes, stop))
+                     for _ in range(max(1, args.processes))]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # Jobs in flight finish first; a killed worker's jobs are re-run
+            # elsewhere once their lease expires.
+            stop.set()
+            for process in processes:
+                process.join()
+    else:
+        queue = JobQueue(args.queue)
+        specs = load_jobs(args.input, args.plan_depth, args.search_depth)
+        start = time.monotonic()
+        statuses: Dict[str, int] = {}
+        with open(args.output, "a", encoding="utf-8") as out:
+            for result in run_distributed(queue, specs, args.runs):
+                statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+        elapsed = time.monotonic() - start
+        print(f"{len(specs)} runs in {elapsed:.1f}s ({len(specs) * 3600 / elapsed:.2f} runs/hour): {statuses}")
+        print(f"Queue: {queue.stats()}")
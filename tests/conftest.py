@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The package modules import each other by bare name (see main.py), so the
+# tests run with src/deep_research on the path, as the scripts do.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "deep_research"))
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+
+import pytest
+
+import llm
+import research
+from checkpoint import (
+    CHECKPOINT_VERSION,
+    checkpoint_path_for,
+    load_checkpoint,
+    save_checkpoint
+)
+from prompts import (
+    initial_messages
+)
+
+
+def _state(**extra):
+    return {"research_plan": [["q1", "why"]], "notes": [], "plan_idx": 0, **extra}
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "runs" / "run.json")
+    save_checkpoint(path, _state())
+    assert load_checkpoint(path)["research_plan"] == [("q1", "why")]
+    # Replaced atomically: no temporary files are left next to it
+    save_checkpoint(path, _state(plan_idx=1))
+    assert os.listdir(tmp_path / "runs") == ["run.json"]
+    assert load_checkpoint(path)["plan_idx"] == 1
+
+
+def test_failed_write_keeps_the_previous_checkpoint(tmp_path):
+    path = str(tmp_path / "run.json")
+    save_checkpoint(path, _state())
+    with pytest.raises(TypeError):
+        save_checkpoint(path, _state(plan_idx=object()))
+    assert load_checkpoint(path)["plan_idx"] == 0
+    assert os.listdir(tmp_path) == ["run.json"]
+
+
+def test_missing_complete_and_old_checkpoints(tmp_path):
+    path = str(tmp_path / "run.json")
+    assert load_checkpoint(path) is None
+    save_checkpoint(path, _state(complete=True))
+    assert load_checkpoint(path) is None
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": CHECKPOINT_VERSION - 1, **_state()}, f)
+    with pytest.raises(ValueError):
+        load_checkpoint(path)
+
+
+def test_checkpoint_path_per_run_and_settings(tmp_path):
+    settings = {"prompt": "p", "plan_depth": 3, "search_depth": 2}
+    path = checkpoint_path_for("a", settings, str(tmp_path))
+    assert path == checkpoint_path_for("a", dict(reversed(settings.items())), str(tmp_path))
+    assert path != checkpoint_path_for("b", settings, str(tmp_path))
+    assert path != checkpoint_path_for("a", {**settings, "plan_depth": 4}, str(tmp_path))
+    assert os.path.dirname(path) == str(tmp_path)
+
+
+# ---------------------------------------------------------------------------
+# research() resuming from its checkpoints, against canned search and LLM.
+# ---------------------------------------------------------------------------
+
+class FakeSearch:
+    def __init__(self, **kwargs):
+        pass
+
+    def text(self, query, **kwargs):
+        return [{"title": f"t{i}", "href": f"http://{query}/{i}", "body": "b"} for i in range(3)]
+
+
+class FakeBackend(llm.LLMBackend):
+    # Plans two steps, picks the first result, notes every block; raises
+    # on its *crash_at*‑th call.
+    def __init__(self):
+        self.calls = 0
+        self.crash_at = None
+        self._lock = threading.Lock()
+
+    def call(self, model, messages, response_model=None, **kwargs):
+        prompt = messages[-1]["content"]
+        with self._lock:
+            self.calls += 1
+            if self.calls == self.crash_at:
+                raise RuntimeError("crash")
+        if "previous research query" in prompt:
+            return json.dumps({"plan": []})
+        if '"plan"' in prompt:
+            return json.dumps({"plan": [["s1", "r1"], ["s2", "r2"]]})
+        if '"site"' in prompt:
+            return json.dumps({"site": [1, "first"]})
+        return "note"
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    previous_backend = llm.set_backend(backend)
+    previous_search = research.set_search_backend(FakeSearch)
+    monkeypatch.setattr(research, "extract_blocks", lambda url, *a, **k: ([f"block {i} of {url}" for i in range(2)], []))
+    yield backend
+    llm.set_backend(previous_backend)
+    research.set_search_backend(previous_search)
+
+
+def test_resume_after_crash(tmp_path, backend):
+    full = research.research("p", 3, 2, initial_messages, max_workers=1)
+    total = backend.calls
+
+    path = str(tmp_path / "run.json")
+    backend.calls, backend.crash_at = 0, total // 2
+    with pytest.raises(RuntimeError):
+        research.research("p", 3, 2, initial_messages, checkpoint_path=path, max_workers=1)
+    assert load_checkpoint(path) is not None
+
+    backend.calls, backend.crash_at = 0, None
+    assert research.research("p", 3, 2, initial_messages, checkpoint_path=path, max_workers=1) == full
+    assert backend.calls < total
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["complete"]
+
+
+def test_resume_with_other_settings_is_refused(tmp_path, backend):
+    path = str(tmp_path / "run.json")
+    backend.crash_at = 5
+    with pytest.raises(RuntimeError):
+        research.research("p", 3, 2, initial_messages, checkpoint_path=path, max_workers=1)
+    backend.crash_at = None
+    with pytest.raises(ValueError, match="written with"):
+        research.research("p", 3, 1, initial_messages, checkpoint_path=path, max_workers=1)
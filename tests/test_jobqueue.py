@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+from jobqueue import (
+    DONE,
+    FAILED,
+    QUEUED,
+    JobFailed,
+    JobQueue
+)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=0.05, max_attempts=3, retry_delay=0.1)
+    yield queue
+    queue.close()
+
+
+def _status(queue, job_id):
+    return queue._conn.execute("SELECT status, attempts, not_before FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def test_claim_in_priority_order(queue):
+    low = queue.submit("run", "notes", {"n": 1})
+    high = queue.submit("run", "plan", {"n": 2}, priority=5)
+    assert queue.claim("w1").id == high
+    assert queue.claim("w1", kinds=["plan"]) is None
+    job = queue.claim("w1", kinds=["notes"])
+    assert (job.id, job.attempt, job.payload) == (low, 1, {"n": 1})
+    assert queue.claim("w1") is None
+
+
+def test_lapsed_lease_is_reclaimed(queue):
+    job_id = queue.submit("run", "notes", {"n": 1})
+    first = queue.claim("dead-worker")
+    time.sleep(0.1)
+
+    # Another process opening the same file takes the job over
+    other = JobQueue(queue.path, lease_seconds=60)
+    second = other.claim("w2")
+    assert (second.id, second.attempt, second.worker) == (job_id, 2, "w2")
+    assert other.expired == 1
+
+    # The dead worker's late result is dropped; the new lease's is kept
+    assert not queue.heartbeat(first)
+    assert not queue.complete(first, "stale")
+    assert other.complete(second, "fresh")
+    assert queue.wait([job_id], timeout=1) == {job_id: "fresh"}
+    other.close()
+
+
+def test_attempt_limit(queue):
+    job_id = queue.submit("run", "notes", {"n": 1}, max_attempts=2)
+    for attempt in (1, 2):
+        job = queue.claim("w1")
+        assert job.attempt == attempt
+        time.sleep(0.1)
+    assert queue.claim("w1") is None
+    assert _status(queue, job_id)[:2] == (FAILED, 2)
+    with pytest.raises(JobFailed, match="lease expired"):
+        queue.wait([job_id], timeout=1)
+    assert queue.stats()["expired_leases"] == 2
+
+
+def test_fail_retries_with_backoff(queue):
+    job_id = queue.submit("run", "notes", {"n": 1})
+
+    job = queue.claim("w1")
+    before = time.time()
+    assert queue.fail(job, "boom")
+    status, attempts, not_before = _status(queue, job_id)
+    assert (status, attempts) == (QUEUED, 1)
+    assert not_before >= before + 0.1
+    assert queue.claim("w1") is None   # still backing off
+    time.sleep(0.15)
+
+    job = queue.claim("w1")
+    before = time.time()
+    assert job.attempt == 2
+    assert queue.fail(job, "boom")
+    assert _status(queue, job_id)[2] >= before + 0.2   # the delay doubles
+    time.sleep(0.25)
+
+    job = queue.claim("w1")
+    assert job.attempt == 3
+    assert queue.fail(job, "boom")   # last attempt: failed for good
+    assert _status(queue, job_id)[0] == FAILED
+    with pytest.raises(JobFailed, match="boom"):
+        queue.wait([job_id], timeout=1)
+
+
+def test_fail_without_retry(queue):
+    job_id = queue.submit("run", "notes", {"n": 1})
+    assert queue.fail(queue.claim("w1"), "bad input", retry=False)
+    assert _status(queue, job_id)[:2] == (FAILED, 1)
+
+
+def test_keys_reattach_and_reject_other_payloads(queue):
+    job_id = queue.submit("run", "notes", {"n": 1}, key="run/notes/1")
+    assert queue.submit("run", "notes", {"n": 1}, key="run/notes/1") == job_id
+    with pytest.raises(ValueError):
+        queue.submit("run", "notes", {"n": 2}, key="run/notes/1")
+
+    job = queue.claim("w1")
+    assert queue.complete(job, {"notes": "x"})
+    assert queue.submit("run", "notes", {"n": 1}, key="run/notes/1") == job_id
+    assert _status(queue, job_id)[0] == DONE
+    assert queue.claim("w1") is None
+
+    # A job that failed for good is queued again with fresh attempts
+    other = queue.submit("run", "notes", {"n": 3}, key="run/notes/3")
+    queue.fail(queue.claim("w1"), "bad input", retry=False)
+    assert queue.submit("run", "notes", {"n": 3}, key="run/notes/3") == other
+    assert _status(queue, other)[:2] == (QUEUED, 0)
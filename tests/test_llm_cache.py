@@ -0,0 +1,18 @@
+from llm_cache import (
+    ResponseCache
+)
+from routing import (
+    CALL_SITES
+)
+
+
+def test_default_sites_are_the_router_call_sites(tmp_path):
+    cache = ResponseCache(str(tmp_path / "llm.sqlite"))
+    assert cache.sites == set(CALL_SITES)
+    assert cache.enabled_for("page_decision")
+
+
+def test_sites_restrict_readwrite_caching(tmp_path):
+    cache = ResponseCache(str(tmp_path / "llm.sqlite"), sites=["plan"])
+    assert cache.enabled_for("plan")
+    assert not cache.enabled_for("page_decision")
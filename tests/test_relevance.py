@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from relevance import (
+    BlockFilter,
+    evaluate,
+    evaluate_labels,
+    labels_from_pages,
+    report
+)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "relevance_pages.jsonl")
+
+
+@pytest.fixture(scope="module")
+def labels():
+    return labels_from_pages(FIXTURE)
+
+
+@pytest.mark.parametrize("threshold, saved, lost", [
+    (0.1, 14, 1),
+    (0.15, 16, 1),
+    (0.2, 18, 2),
+    (0.3, 22, 4),
+])
+def test_fixture_numbers(labels, threshold, saved, lost):
+    # The table in relevance.py's header comment
+    result = evaluate(labels, threshold)
+    assert (result["pages"], result["blocks"]) == (6, 39)
+    assert (result["llm_calls_saved"], result["skipped_with_notes"]) == (saved, lost)
+    assert sum(page["llm_calls_saved"] for page in result["per_page"]) == saved
+
+
+def test_default_threshold_keeps_recall(labels):
+    result = evaluate(labels)
+    assert result["note_recall"] >= 0.9
+    assert result["llm_calls_saved"] >= 0.4 * result["blocks"]
+    assert BlockFilter().min_relative_score == 0.15
+
+
+def test_recorded_labels_replay(tmp_path):
+    # Labels recorded by a shadow filter replay to the same numbers.
+    block_filter = BlockFilter(shadow=True)
+    for label in labels_from_pages(FIXTURE):
+        block_filter.record_outcome(label["url"], label["query"], label["block_idx"], label["score"], label["produced_notes"])
+    path = tmp_path / "labels.jsonl"
+    block_filter.dump_labels(str(path))
+    assert evaluate_labels(str(path)) == evaluate(labels_from_pages(FIXTURE))
+
+
+def test_report_lists_every_page(labels):
+    text = report(labels, [0.15])
+    assert "16 / 39" in text
+    assert text.count("saved,") == 6
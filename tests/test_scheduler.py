@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import (
+    BudgetExceeded,
+    ContextThreadPoolExecutor,
+    Job,
+    Scheduler,
+    current_job
+)
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def _wait_for(predicate, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.005)
+
+
+def test_concurrency_cap():
+    scheduler = Scheduler(max_concurrent_llm=2)
+    peak, active, lock = [0], [0], threading.Lock()
+
+    def request():
+        with scheduler.llm_slot(MESSAGES):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+    assert scheduler.stats()["llm"]["granted"] == 6
+    assert scheduler.stats()["llm"]["active"] == 0
+
+
+def test_waiters_served_by_priority_then_fifo():
+    scheduler = Scheduler(max_concurrent_searches=1)
+    order = []
+    scheduler._acquire("search")   # hold the only slot
+
+    def search(name, priority):
+        current_job.set(Job(name, priority=priority))
+        with scheduler.search_slot():
+            order.append(name)
+
+    threads = []
+    for name, priority in (("low", 0), ("high", 5), ("mid", 1), ("high2", 5)):
+        threads.append(threading.Thread(target=search, args=(name, priority)))
+        threads[-1].start()
+        _wait_for(lambda: scheduler.stats()["search"]["waiting"] == len(threads))
+    scheduler._release("search")
+    for thread in threads:
+        thread.join()
+    assert order == ["high", "high2", "mid", "low"]
+
+
+def test_requests_per_minute_window():
+    scheduler = Scheduler(max_concurrent_llm=None, llm_requests_per_minute=2)
+    gate = scheduler._gates["llm"]
+    gate.starts.extend([time.monotonic() - 59.95, time.monotonic()])
+    start = time.monotonic()
+    with scheduler.llm_slot(MESSAGES):
+        pass
+    # Waited for the oldest start to leave the 60 s window
+    assert 0.03 <= time.monotonic() - start < 1.0
+
+
+def test_job_budget():
+    scheduler = Scheduler()
+    job = Job("j", max_llm_calls=2)
+    token = current_job.set(job)
+    try:
+        for _ in range(2):
+            with scheduler.llm_slot(MESSAGES) as slot:
+                slot.record_output("four words of output")
+        with pytest.raises(BudgetExceeded):
+            with scheduler.llm_slot(MESSAGES):
+                pass
+    finally:
+        current_job.reset(token)
+    assert job.usage()["llm_calls"] == 2
+    assert job.usage()["tokens"] > 0
+    assert scheduler.stats()["llm"]["granted"] == 2
+
+
+def test_token_budget():
+    job = Job("j", max_tokens=5)
+    with pytest.raises(BudgetExceeded):
+        job.charge_llm(6)
+    assert job.usage()["llm_calls"] == 0
+
+
+def test_pool_workers_charge_the_submitting_job():
+    scheduler = Scheduler()
+    job = Job("j")
+
+    def search(_):
+        with scheduler.search_slot():
+            pass
+
+    token = current_job.set(job)
+    try:
+        with ContextThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(search, range(3)))
+    finally:
+        current_job.reset(token)
+    assert job.usage()["searches"] == 3
+
+
+def test_interrupted_waiter_leaves_the_line():
+    scheduler = Scheduler(max_concurrent_llm=1)
+    scheduler._acquire("llm")   # hold the only slot
+
+    def interrupted(timeout=None):
+        raise KeyboardInterrupt
+
+    wait, scheduler._cond.wait = scheduler._cond.wait, interrupted
+    with pytest.raises(KeyboardInterrupt):
+        scheduler._acquire("llm")
+    scheduler._cond.wait = wait
+    assert scheduler.stats()["llm"]["waiting"] == 0
+
+    granted = threading.Event()
+
+    def request():
+        scheduler._acquire("llm")
+        granted.set()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    _wait_for(lambda: scheduler.stats()["llm"]["waiting"] == 1)
+    scheduler._release("llm")
+    assert granted.wait(2)
+    thread.join()
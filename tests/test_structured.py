@@ -0,0 +1,87 @@
+import pytest
+
+from json_schemas import (
+    ResearchPlan,
+    Site,
+    ExploreDecision,
+    Sections,
+    Step_Indices
+)
+from structured import (
+    _schema_rejected,
+    parse_structured
+)
+
+
+# (raw reply, schema, expected model_dump()) — the malformed shapes
+# parse_structured has to absorb before any repair round‑trip is spent.
+CASES = [
+    # clean
+    ('{"site": [2, "official docs"]}', Site, {"site": (2, "official docs")}),
+    # code fences, with and without a language tag
+    ('```json\n{"step_indices": [1, 3]}\n```', Step_Indices, {"step_indices": [1, 3]}),
+    ('```\n{"decision": [1, "on topic"]}\n```', ExploreDecision, {"decision": (1, "on topic")}),
+    # prose around the JSON, brackets inside strings
+    ('Here is the plan:\n{"plan": [["ppo [clip]", "core idea"]]}\nHope this helps!', ResearchPlan,
+     {"plan": [("ppo [clip]", "core idea")]}),
+    # smart quotes
+    ('{“site”: [1, “the paper”]}', Site, {"site": (1, "the paper")}),
+    # trailing commas
+    ('{"sections": [["Background", "why"], ["Method", "how"],],}', Sections,
+     {"sections": [("Background", "why"), ("Method", "how")]}),
+    # Python literals: single quotes and tuples
+    ("{'plan': [('ppo', 'basics'), ('trpo', 'contrast')]}", ResearchPlan,
+     {"plan": [("ppo", "basics"), ("trpo", "contrast")]}),
+    ("{'decision': (0, 'off topic')}", ExploreDecision, {"decision": (0, "off topic")}),
+    # scalar where a list is expected, and a bare list for a one‑field schema
+    ('{"step_indices": 2}', Step_Indices, {"step_indices": [2]}),
+    ("[1, 2]", Step_Indices, {"step_indices": [1, 2]}),
+    # numeric strings, short tuples, a dict where a tuple is expected
+    ('{"step_indices": ["1", " 4 "]}', Step_Indices, {"step_indices": [1, 4]}),
+    ('{"site": [3]}', Site, {"site": (3, "")}),
+    ('{"site": {"index": "2", "reason": "docs"}}', Site, {"site": (2, "docs")}),
+    # a single row where a list of rows is expected
+    ('{"plan": ["ppo", "basics"]}', ResearchPlan, {"plan": [("ppo", "basics")]}),
+    ('{"sections": ["Background"]}', Sections, {"sections": [("Background", "")]}),
+]
+
+
+@pytest.mark.parametrize("raw, schema, expected", CASES)
+def test_parse_structured(raw, schema, expected):
+    assert parse_structured(raw, schema).model_dump() == expected
+
+
+@pytest.mark.parametrize("raw, schema", [
+    ("I could not find anything relevant.", Site),
+    ('{"site": ["first", "docs"]}', Site),
+    ('{"plan": [["ppo", "basics"]', ResearchPlan),
+])
+def test_parse_structured_rejects(raw, schema):
+    with pytest.raises(ValueError):
+        parse_structured(raw, schema)
+
+
+class FakeAPIError(Exception):
+    # The attributes the OpenAI and LiteLLM errors carry.
+    def __init__(self, status_code, param=None, code=None, body=None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        self.param = param
+        self.code = code
+        self.body = body
+
+
+def test_schema_rejected():
+    assert _schema_rejected(FakeAPIError(400, param="response_format"))
+    assert _schema_rejected(FakeAPIError(400, body={"error": {"param": "text.format.schema", "code": None}}))
+    assert _schema_rejected(FakeAPIError(422, code="invalid_json_schema"))
+    try:
+        raise RuntimeError("backend failed") from FakeAPIError(400, param="response_format")
+    except RuntimeError as err:
+        assert _schema_rejected(err)
+
+
+def test_schema_rejected_ignores_other_errors():
+    assert not _schema_rejected(FakeAPIError(400, param="messages"))
+    assert not _schema_rejected(FakeAPIError(500, param="response_format"))
+    assert not _schema_rejected(ValueError("400 invalid response_format"))